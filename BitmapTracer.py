@@ -0,0 +1,299 @@
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from CurveFlattener import polyline_chains
+from Dithering import THRESHOLD
+from RasterPreprocess import RasterPreprocessor
+
+# Contours enclosing fewer square pixels than this are specks, not artwork
+MIN_AREA = 4.0
+
+# Taubin smoothing: a shrinking and an inflating step per pass, so the staircase goes without the shape shrinking
+SMOOTHING_PASSES = 4
+SMOOTHING_SHRINK = 0.5
+SMOOTHING_INFLATE = -0.53
+
+# Points closer than this (pixels) to the chord between their neighbours are dropped
+SIMPLIFY_TOLERANCE = 0.2
+MAX_SIMPLIFY_PASSES = 64
+
+
+# ============================================================
+# Marching Squares
+# ============================================================
+# Every 2 x 2 block of pixels is a cell; where its corners are on both sides of the threshold, the outline crosses
+# the cell between the midpoints of the edges whose ends differ. Segments are oriented with the artwork on the same
+# side, so every edge midpoint has exactly one segment leaving it and the segments link up into closed contours.
+# Cells are handled a case (corner pattern) at a time, and the linking and ordering are pointer jumping over
+# arrays, so no step runs per pixel in Python.
+
+# Corners (x, y) and edge midpoints of a cell; bit of each corner in the case number
+CORNERS = {"tl": (0.0, 0.0), "tr": (1.0, 0.0), "br": (1.0, 1.0), "bl": (0.0, 1.0)}
+CORNER_BITS = {"tl": 8, "tr": 4, "br": 2, "bl": 1}
+EDGES = {"top": (0.5, 0.0), "right": (1.0, 0.5), "bottom": (0.5, 1.0), "left": (0.0, 0.5)}
+EDGE_CORNERS = {"top": ("tl", "tr"), "right": ("tr", "br"), "bottom": ("br", "bl"), "left": ("bl", "tl")}
+
+
+def _oriented(edge_a, edge_b, inside_corner) -> tuple:
+    (ax, ay), (bx, by) = EDGES[edge_a], EDGES[edge_b]
+    cx, cy = CORNERS[inside_corner]
+    cross = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (edge_a, edge_b) if cross > 0 else (edge_b, edge_a)
+
+
+def _case_segments() -> dict:
+    """
+    The oriented segments of each of the 16 corner patterns. Where only two diagonal corners are inside, each is cut
+    off on its own, so artwork touching only at a corner gives separate contours.
+    """
+    table = {}
+    for case in range(16):
+        inside = [corner for corner, bit in CORNER_BITS.items() if case & bit]
+        crossed = [edge for edge, (a, b) in EDGE_CORNERS.items() if (a in inside) != (b in inside)]
+        if not crossed:
+            table[case] = []
+        elif len(crossed) == 2:
+            table[case] = [_oriented(crossed[0], crossed[1], inside[0])]
+        else:
+            table[case] = [
+                _oriented(*[edge for edge in crossed if corner in EDGE_CORNERS[edge]], corner) for corner in inside
+            ]
+    return table
+
+
+CASE_SEGMENTS = _case_segments()
+
+
+def _trace(mask) -> tuple:
+    """
+    The outlines of the True areas of a 2-D mask: all their points, contour after contour, and the length of each.
+    """
+    grid = np.pad(np.asarray(mask, dtype=bool), 1).astype(np.int64)
+    h, w = grid.shape
+    cases = grid[:-1, :-1] * 8 + grid[:-1, 1:] * 4 + grid[1:, 1:] * 2 + grid[1:, :-1]
+
+    # Edge midpoints are numbered horizontal edges first, then vertical ones
+    horizontal = h * (w - 1)
+    cell_y, cell_x = np.mgrid[0:h - 1, 0:w - 1]
+    edge_ids = {
+        "top": cell_y * (w - 1) + cell_x,
+        "bottom": (cell_y + 1) * (w - 1) + cell_x,
+        "left": horizontal + cell_y * w + cell_x,
+        "right": horizontal + cell_y * w + cell_x + 1,
+    }
+
+    starts, ends = [], []
+    for case, segments in CASE_SEGMENTS.items():
+        if not segments:
+            continue
+        cells = cases == case
+        for edge_a, edge_b in segments:
+            starts.append(edge_ids[edge_a][cells])
+            ends.append(edge_ids[edge_b][cells])
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    count = len(starts)
+    if count == 0:
+        return np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+    rounds = int(np.ceil(np.log2(count))) + 1
+
+    leaving = np.empty(horizontal + h * w, dtype=np.int64)
+    leaving[starts] = np.arange(count)
+    following = leaving[ends]
+
+    # Name every contour after its lowest segment, by pointer jumping
+    label = np.arange(count)
+    pointer = following.copy()
+    for _ in range(rounds):
+        label = np.minimum(label, label[pointer])
+        pointer = pointer[pointer]
+
+    # Cut each contour open before its first segment and rank the segments by their distance to the cut
+    preceding = np.empty(count, dtype=np.int64)
+    preceding[following] = np.arange(count)
+    successor = following.copy()
+    last = preceding[np.flatnonzero(label == np.arange(count))]
+    successor[last] = last
+    distance = (successor != np.arange(count)).astype(np.int64)
+    for _ in range(rounds):
+        distance = distance + distance[successor]
+        successor = successor[successor]
+
+    order = np.lexsort((-distance, label))
+    ids = starts[order]
+    is_horizontal = ids < horizontal
+    vertical = ids - horizontal
+    x = np.where(is_horizontal, ids % (w - 1) + 0.5, vertical % w) - 1
+    y = np.where(is_horizontal, ids // (w - 1), vertical // w + 0.5) - 1
+    points = np.column_stack((x, y))
+
+    lengths = np.diff(np.concatenate(([0], np.flatnonzero(np.diff(label[order])) + 1, [count])))
+    return points, lengths
+
+
+def _split(points, lengths) -> list:
+    # Flat points as one closed polyline per contour, first point repeated at the end
+    return [np.vstack((contour, contour[:1])) for contour in np.split(points, np.cumsum(lengths)[:-1])]
+
+
+def trace_contours(mask) -> list:
+    """
+    The outlines of the True areas of a 2-D mask as closed (n, 2) polylines of pixel centre coordinates (x, y),
+    first point repeated at the end. Outer outlines and holes run in opposite directions.
+    """
+    points, lengths = _trace(mask)
+    return _split(points, lengths) if len(lengths) else []
+
+
+# ============================================================
+# Smoothing
+# ============================================================
+# All contours are smoothed and simplified together, as one array of points with the index of each point's
+# neighbours within its own (closed) contour.
+
+def _neighbours(lengths) -> tuple:
+    first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    position = np.arange(lengths.sum()) - first
+    size = np.repeat(lengths, lengths)
+    return first + (position - 1) % size, first + (position + 1) % size
+
+
+def _signed_areas(points, lengths) -> np.ndarray:
+    _, following = _neighbours(lengths)
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[following] - x[following] * y
+    return 0.5 * np.bincount(np.repeat(np.arange(len(lengths)), lengths), cross, minlength=len(lengths))
+
+
+def signed_area(contour) -> float:
+    return float(_signed_areas(contour[:-1], np.array([len(contour) - 1]))[0])
+
+
+def _smooth(points, lengths, passes=SMOOTHING_PASSES, tolerance=SIMPLIFY_TOLERANCE) -> tuple:
+    previous, following = _neighbours(lengths)
+    for _ in range(passes):
+        for factor in (SMOOTHING_SHRINK, SMOOTHING_INFLATE):
+            points = points + factor * ((points[previous] + points[following]) / 2 - points)
+
+    owners = np.repeat(np.arange(len(lengths)), lengths)
+    for _ in range(MAX_SIMPLIFY_PASSES):
+        previous, following = _neighbours(lengths)
+        chord = points[following] - points[previous]
+        offset = points - points[previous]
+        deviation = np.abs(chord[:, 0] * offset[:, 1] - chord[:, 1] * offset[:, 0]) / np.maximum(
+            np.hypot(chord[:, 0], chord[:, 1]), 1e-12
+        )
+
+        # Of neighbouring candidates only the one closest to its chord goes in a pass; triangles stay
+        candidate = (deviation < tolerance) & (lengths[owners] > 3)
+        score = np.where(candidate, deviation, np.inf)
+        drop = candidate & (score < score[previous]) & (score <= score[following])
+        if not drop.any():
+            break
+        points = points[~drop]
+        owners = owners[~drop]
+        lengths = np.bincount(owners, minlength=len(lengths))
+
+    return points, lengths
+
+
+def smooth_contours(contours, passes=SMOOTHING_PASSES, tolerance=SIMPLIFY_TOLERANCE) -> list:
+    """
+    Takes the pixel staircase out of traced contours with Taubin smoothing, then drops the points that lie within
+    ``tolerance`` of the chord between their neighbours.
+    """
+    if not contours:
+        return []
+    points = np.concatenate([contour[:-1] for contour in contours])
+    lengths = np.array([len(contour) - 1 for contour in contours])
+    return _split(*_smooth(points, lengths, passes, tolerance))
+
+
+# ============================================================
+# Tracing
+# ============================================================
+
+def trace_image(pixels, threshold=THRESHOLD, invert=False, min_area=MIN_AREA) -> list:
+    """
+    Smoothed outlines of the dark parts (light ones if ``invert``) of a grey level image, in pixels, specks left
+    out.
+    """
+    mask = pixels >= threshold if invert else pixels < threshold
+    points, lengths = _trace(mask)
+    if not len(lengths):
+        return []
+
+    keep = np.abs(_signed_areas(points, lengths)) >= min_area
+    points = points[np.repeat(keep, lengths)]
+    lengths = lengths[keep]
+    if not len(lengths):
+        return []
+    return _split(*_smooth(points, lengths))
+
+
+def contours_to_mm(contours, height, pitch) -> list:
+    # Pixels to mm with y up, so the traced artwork comes out the right way round as SVGs do
+    return [np.column_stack((contour[:, 0] * pitch, (height - 1 - contour[:, 1]) * pitch)) for contour in contours]
+
+
+def trace_file(img_path, output_path, config, preprocessor, threshold=THRESHOLD, invert=False, mm_per_pixel=0.1):
+    """
+    Traces an image and compiles its outlines, hatch filled if the config says so, the way GcodeFromSVGMiniCNC
+    compiles an SVG with the same config.
+    """
+    from GcodeFromSVGMiniCNC import build_compiler
+
+    start = time.perf_counter()
+    pixels, pitch = preprocessor.load(img_path, mm_per_pixel)
+    contours = contours_to_mm(trace_image(pixels, threshold, invert), len(pixels), pitch)
+    traced = time.perf_counter() - start
+
+    compiler = build_compiler(config)
+    if config.get("hatch_spacing"):
+        compiler.append_hatch_fill(contours, config["hatch_spacing"], config["hatch_angle"])
+    compiler.append_chains_optimized(polyline_chains(contours))
+    compiler.compile_to_file(output_path, passes=config["passes"])
+
+    points = sum(len(contour) - 1 for contour in contours)
+    print(
+        f"Traced {img_path}: {pixels.shape[1]}×{pixels.shape[0]} at {pitch:.3f} mm, {len(contours)} contours, "
+        f"{points} points ({traced:.2f} s), wrote {output_path} ({time.perf_counter() - start:.2f} s)"
+    )
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def main():
+    from GcodeFromSVGMiniCNC import CONFIG_CUT, CONFIG_ENGRAVE, CONFIG_FILL, INPUT_DIR, OUTPUT_DIR
+
+    parser = argparse.ArgumentParser(description="Trace the bitmaps in ./original to outline G-code in ./sliced")
+    parser.add_argument("files", nargs="*", help="images to trace (default: ./original/*.png)")
+    parser.add_argument("--threshold", type=int, default=THRESHOLD, help="grey level between artwork and background")
+    parser.add_argument("--invert", action="store_true", help="trace light artwork on a dark background")
+    parser.add_argument("--width", type=float, help="artwork width (mm, default: 0.1 mm per image pixel)")
+    parser.add_argument("--cut", action="store_true", help="cut the outlines (default: engrave them)")
+    parser.add_argument("--fill", action="store_true", help="hatch fill the artwork as well as its outlines")
+    args = parser.parse_args()
+
+    # Tracing only needs the resolution the spot can burn
+    preprocessor = RasterPreprocessor(args.width)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    for file in args.files or glob.glob(os.path.join(INPUT_DIR, "*.png")):
+        if args.cut or file.endswith(".CUT.png"):
+            config = CONFIG_CUT
+        else:
+            config = CONFIG_FILL if args.fill or file.endswith(".FILL.png") else CONFIG_ENGRAVE
+        name = os.path.basename(file).rsplit(".", 1)[0]
+        out = os.path.join(OUTPUT_DIR, f"{name}.traced.gcode")
+        trace_file(file, out, config, preprocessor, args.threshold, args.invert)
+
+
+if __name__ == "__main__":
+    main()
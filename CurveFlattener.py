@@ -0,0 +1,314 @@
+import math
+
+import numpy as np
+
+# Largest distance between a curve and the chords that replace it, in the curve's own units
+DEFAULT_TOLERANCE = 0.01
+
+# Passes of subdivision before the remaining pieces are taken as flat whatever the error
+MAX_PASSES = 16
+
+
+# ============================================================
+# Beziers
+# ============================================================
+# A cubic strays from the chord between its ends by at most 3/4 of the larger second difference of its control
+# points. Each pass tests every unfinished piece of every curve of the path against that bound and cuts the ones that
+# fail into as many equal parts as the bound says they need, so straight stretches stay one chord and tight turns get
+# the points they need. The passes are array operations over all pieces at once; the Python overhead is per pass, not
+# per point. Quadratics are raised to cubics first.
+
+def _deviation(controls):
+    """
+    Upper bound on how far each cubic strays from its chord.
+    """
+    p0, p1, p2, p3 = controls.T
+    return 0.75 * np.maximum(np.abs(p0 - 2 * p1 + p2), np.abs(p1 - 2 * p2 + p3))
+
+
+def _blossom(controls, t1, t2, t3):
+    p0, p1, p2, p3 = controls.T
+    q0, q1, q2 = p0 + t1 * (p1 - p0), p1 + t1 * (p2 - p1), p2 + t1 * (p3 - p2)
+    r0, r1 = q0 + t2 * (q1 - q0), q1 + t2 * (q2 - q1)
+    return r0 + t3 * (r1 - r0)
+
+
+def _sub_curves(controls, low, high):
+    """
+    Control points of each cubic restricted to [low, high].
+    """
+    return np.column_stack((
+        _blossom(controls, low, low, low),
+        _blossom(controls, low, low, high),
+        _blossom(controls, low, high, high),
+        _blossom(controls, high, high, high),
+    ))
+
+
+def flatten_cubics(controls, tolerance=DEFAULT_TOLERANCE):
+    """
+    Flattens cubic Beziers given as an (n, 4) array of complex control points. Returns the chord end points, in
+    order, and the index of the curve each belongs to; every curve's own start point is left out.
+    """
+    controls = np.asarray(controls, dtype=complex).reshape(-1, 4)
+
+    owners = np.arange(len(controls))
+    low = np.zeros(len(controls))
+    high = np.ones(len(controls))
+    pieces = controls
+
+    done_points, done_owners, done_ends = [], [], []
+    for attempt in range(MAX_PASSES + 1):
+        deviation = _deviation(pieces)
+        flat = deviation <= tolerance if attempt < MAX_PASSES else np.ones(len(pieces), dtype=bool)
+        done_points.append(pieces[flat, 3])
+        done_owners.append(owners[flat])
+        done_ends.append(high[flat])
+        if flat.all():
+            break
+
+        # Chord deviation falls with the square of the parameter step
+        parts = np.maximum(2, np.ceil(np.sqrt(deviation[~flat] / tolerance))).astype(np.int64)
+        owners = np.repeat(owners[~flat], parts)
+        first = np.cumsum(parts) - parts
+        index = np.arange(len(owners)) - np.repeat(first, parts)
+        step = np.repeat((high[~flat] - low[~flat]) / parts, parts)
+        low = np.repeat(low[~flat], parts) + index * step
+        high = low + step
+        pieces = _sub_curves(controls[owners], low, high)
+
+    points = np.concatenate(done_points)
+    owners = np.concatenate(done_owners)
+    order = np.lexsort((np.concatenate(done_ends), owners))
+    return points[order], owners[order]
+
+
+def quadratic_to_cubic(controls):
+    """
+    (n, 3) quadratic control points as the (n, 4) cubics tracing the same curves.
+    """
+    p0, p1, p2 = np.asarray(controls, dtype=complex).reshape(-1, 3).T
+    return np.column_stack((p0, p0 + 2 / 3 * (p1 - p0), p2 + 2 / 3 * (p1 - p2), p2))
+
+
+# ============================================================
+# Arcs
+# ============================================================
+
+def arc_steps(radii, sweeps, tolerance=DEFAULT_TOLERANCE):
+    """
+    Equal angle steps that keep the sagitta of each chord within ``tolerance``, measured on the larger radius.
+    """
+    radii = np.asarray(radii, dtype=float)
+    ratio = np.clip(1 - tolerance / np.maximum(radii, 1e-12), -1, 1)
+    step = 2 * np.arccos(ratio)
+    return np.maximum(1, np.ceil(np.abs(sweeps) / np.maximum(step, 1e-9))).astype(np.int64)
+
+
+def flatten_arcs(centers, radii, rotations, starts, sweeps, tolerance=DEFAULT_TOLERANCE, scales=None):
+    """
+    Flattens elliptical arcs: complex centers and radii (rx + ry j), rotations, start angles and sweeps in
+    radians. ``scales`` is how much a later transform enlarges each arc, which the step count has to allow for.
+    Returns the chord end points in order and the arc each belongs to, like flatten_cubics.
+    """
+    centers = np.asarray(centers, dtype=complex)
+    radii = np.asarray(radii, dtype=complex)
+    starts = np.asarray(starts, dtype=float)
+    sweeps = np.asarray(sweeps, dtype=float)
+    largest = np.maximum(np.abs(radii.real), np.abs(radii.imag)) * (1 if scales is None else np.asarray(scales))
+
+    steps = arc_steps(largest, sweeps, tolerance)
+    owners = np.repeat(np.arange(len(steps)), steps)
+    first = np.cumsum(steps) - steps
+    fraction = (np.arange(len(owners)) - np.repeat(first, steps) + 1) / np.repeat(steps, steps)
+
+    angles = starts[owners] + sweeps[owners] * fraction
+    local = radii.real[owners] * np.cos(angles) + 1j * radii.imag[owners] * np.sin(angles)
+    points = centers[owners] + np.exp(1j * np.asarray(rotations, dtype=float)[owners]) * local
+    return points, owners
+
+
+# ============================================================
+# svgpathtools Paths
+# ============================================================
+
+def flatten_segments(segments, tolerance=DEFAULT_TOLERANCE) -> list:
+    """
+    Chord end points of every segment of an svgpathtools path, one complex array per segment (start point left
+    out). Lines keep their end point only; all curves are flattened in one batch per kind.
+    """
+    from svgpathtools import Arc, CubicBezier, QuadraticBezier
+
+    segments = list(segments)
+    result = [np.array([segment.end]) for segment in segments]
+
+    cubics = [i for i, segment in enumerate(segments) if isinstance(segment, (CubicBezier, QuadraticBezier))]
+    if cubics:
+        controls = [
+            segment.bpoints() if isinstance(segment, CubicBezier) else quadratic_to_cubic(segment.bpoints())[0]
+            for segment in (segments[i] for i in cubics)
+        ]
+        points, owners = flatten_cubics(np.array(controls), tolerance)
+        _scatter(result, cubics, points, owners)
+
+    arcs = [i for i, segment in enumerate(segments) if isinstance(segment, Arc)]
+    if arcs:
+        chosen = [segments[i] for i in arcs]
+        points, owners = flatten_arcs(
+            [arc.center for arc in chosen],
+            [arc.radius for arc in chosen],
+            [math.radians(arc.rotation) for arc in chosen],
+            [math.radians(arc.theta) for arc in chosen],
+            [math.radians(arc.delta) for arc in chosen],
+            tolerance,
+        )
+        _scatter(result, arcs, points, owners)
+
+    return result
+
+
+def _scatter(result, indices, points, owners):
+    """
+    Puts the points of each flattened curve in ``result`` at the index the curve came from.
+    """
+    bounds = np.searchsorted(owners, np.arange(len(indices) + 1))
+    for slot, (low, high) in enumerate(zip(bounds[:-1], bounds[1:])):
+        result[indices[slot]] = points[low:high]
+
+
+def flatten_path(path, tolerance=DEFAULT_TOLERANCE) -> list:
+    """
+    An svgpathtools Path (or path data) as one (n, 2) polyline per continuous subpath.
+    """
+    from svgpathtools import parse_path
+
+    if isinstance(path, str):
+        if not path.strip():
+            return []
+        path = parse_path(path)
+
+    segments = list(path)
+    pieces = flatten_segments(segments, tolerance)
+
+    strokes = []
+    current = []
+    for i, segment in enumerate(segments):
+        if i == 0 or abs(segment.start - segments[i - 1].end) > 1e-9:
+            strokes.append(current)
+            current = [np.array([segment.start])]
+        current.append(pieces[i])
+    strokes.append(current)
+
+    polylines = []
+    for stroke in strokes:
+        points = np.concatenate(stroke) if stroke else np.zeros(0, dtype=complex)
+        if len(points) > 1:
+            polylines.append(np.column_stack((points.real, points.imag)))
+    return polylines
+
+
+# ============================================================
+# svg_to_gcode Curves
+# ============================================================
+
+def _transform_matrix(transformation):
+    """
+    The 2 x 3 affine part of an svg_to_gcode Transformation (which keeps it as a 4 x 4 matrix on [x, y, 1, 1]).
+    """
+    matrix = np.array(transformation.translation_matrix.matrix_list, dtype=float)
+    return np.column_stack((matrix[:2, :2], matrix[:2, 2] + matrix[:2, 3]))
+
+
+def flatten_curves(curves, tolerance=DEFAULT_TOLERANCE) -> list:
+    """
+    svg_to_gcode curves as one (n, 2) polyline each, start point included, all curves flattened in one batch per
+    kind.
+    """
+    from svg_to_gcode.geometry import CubicBazier, EllipticalArc, QuadraticBezier
+
+    def complex_of(vector):
+        return complex(vector.x, vector.y)
+
+    curves = list(curves)
+    result = [np.array([complex_of(curve.end)]) for curve in curves]
+
+    beziers = [i for i, curve in enumerate(curves) if isinstance(curve, (CubicBazier, QuadraticBezier))]
+    if beziers:
+        controls = []
+        for curve in (curves[i] for i in beziers):
+            if isinstance(curve, CubicBazier):
+                points = (curve.start, curve.control1, curve.control2, curve.end)
+                controls.append([complex_of(point) for point in points])
+            else:
+                points = (curve.start, curve.control, curve.end)
+                controls.append(quadratic_to_cubic([complex_of(point) for point in points])[0])
+        points, owners = flatten_cubics(np.array(controls), tolerance)
+        _scatter(result, beziers, points, owners)
+
+    arcs = [i for i, curve in enumerate(curves) if isinstance(curve, EllipticalArc)]
+    if arcs:
+        chosen = [curves[i] for i in arcs]
+        matrices = [
+            _transform_matrix(arc.transformation) if arc.transformation else np.array([[1.0, 0, 0], [0, 1.0, 0]])
+            for arc in chosen
+        ]
+        scales = [np.linalg.norm(matrix[:, :2], 2) for matrix in matrices]
+        points, owners = flatten_arcs(
+            [complex_of(arc.center) for arc in chosen],
+            [complex_of(arc.radii) for arc in chosen],
+            [arc.rotation for arc in chosen],
+            [arc.start_angle for arc in chosen],
+            [arc.sweep_angle for arc in chosen],
+            tolerance,
+            scales,
+        )
+        matrices = np.array(matrices)[owners]
+        x, y = points.real, points.imag
+        points = (
+            matrices[:, 0, 0] * x + matrices[:, 0, 1] * y + matrices[:, 0, 2]
+            + 1j * (matrices[:, 1, 0] * x + matrices[:, 1, 1] * y + matrices[:, 1, 2])
+        )
+        _scatter(result, arcs, points, owners)
+
+    polylines = []
+    for curve, points in zip(curves, result):
+        points = np.concatenate(([complex_of(curve.start)], points))
+        polylines.append(np.column_stack((points.real, points.imag)))
+    return polylines
+
+
+def line_chains(curves, tolerance=DEFAULT_TOLERANCE) -> list:
+    """
+    svg_to_gcode curves as LineSegmentChains for Compiler.append_line_chain, replacing
+    LineSegmentChain.line_segment_approximation, which walks each curve one trial segment at a time.
+    """
+    from svg_to_gcode.geometry import Line, LineSegmentChain
+
+    curves = list(curves)
+    chains = []
+    for curve, polyline in zip(curves, flatten_curves(curves, tolerance)):
+        if isinstance(curve, Line):
+            chain = LineSegmentChain()
+            chain.append(curve)
+            chains.append(chain)
+            continue
+
+        keep = np.ones(len(polyline), dtype=bool)
+        keep[1:] = np.any(polyline[1:] != polyline[:-1], axis=1)
+        chains.extend(polyline_chains([polyline[keep]]))
+    return chains
+
+
+def polyline_chains(polylines) -> list:
+    """
+    (n, 2) polylines as LineSegmentChains, for Compiler.append_line_chain.
+    """
+    from svg_to_gcode.geometry import Line, LineSegmentChain, Vector
+
+    chains = []
+    for polyline in polylines:
+        vectors = [Vector(x, y) for x, y in polyline.tolist()]
+        chain = LineSegmentChain()
+        chain.extend(Line(start, end) for start, end in zip(vectors[:-1], vectors[1:]))
+        chains.append(chain)
+    return chains
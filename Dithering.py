@@ -0,0 +1,321 @@
+import argparse
+import functools
+import time
+
+import numpy as np
+from PIL import Image
+
+THRESHOLD = 128
+
+# Error diffusion kernels: (rows down, columns right, weight) for every pixel the error is pushed to, and the divisor
+KERNELS = {
+    "floyd-steinberg": (
+        ((0, 1, 7), (1, -1, 3), (1, 0, 5), (1, 1, 1)),
+        16,
+    ),
+    # Only spreads 6/8 of the error, which keeps highlights and shadows clean
+    "atkinson": (
+        ((0, 1, 1), (0, 2, 1), (1, -1, 1), (1, 0, 1), (1, 1, 1), (2, 0, 1)),
+        8,
+    ),
+    "stucki": (
+        ((0, 1, 8), (0, 2, 4),
+         (1, -2, 2), (1, -1, 4), (1, 0, 8), (1, 1, 4), (1, 2, 2),
+         (2, -2, 1), (2, -1, 2), (2, 0, 4), (2, 1, 2), (2, 2, 1)),
+        42,
+    ),
+}
+
+BAYER_SIZE = 8
+BLUE_NOISE_SIZE = 64
+BLUE_NOISE_SIGMA = 1.5
+
+METHODS = tuple(KERNELS) + ("bayer", "blue-noise", "threshold")
+
+# Rows dithered at a time when an image is dithered as it is rastered
+BAND_ROWS = 64
+
+
+# ============================================================
+# Error Diffusion
+# ============================================================
+# Error diffusion looks sequential, but a pixel only takes error from the row it is on (to its left) and from rows
+# above. Walking the image in diagonals x + k y = t, with k large enough that every pixel a kernel feeds lies on a
+# later diagonal, makes all pixels of one diagonal independent of each other. In a row-major array with the padded
+# width W, the pixels of a diagonal sit at t + y (W - k): one strided slice. Every step of the scan then handles a
+# whole diagonal with a handful of slice operations, and gives the same result as the pixel-by-pixel loop.
+
+def diagonal_slope(kernel) -> int:
+    """
+    Smallest k for which every pixel a kernel feeds is on a later diagonal x + k y than the pixel feeding it.
+    """
+    offsets, _ = KERNELS[kernel] if isinstance(kernel, str) else kernel
+    return max([1] + [-dx // dy + 1 for dy, dx, _ in offsets if dy > 0])
+
+
+def error_diffusion(values, kernel="floyd-steinberg", threshold=THRESHOLD, carry=None) -> tuple:
+    """
+    Dithers a 2-D array of grey levels (0 = black, 255 = white) to 0/255 with an error diffusion kernel.
+
+    ``carry`` is error pushed into the first rows from above (as returned for the rows before); the result is the
+    dithered uint8 image and the error this image pushes past its last rows, so an image can be dithered in bands
+    with the same result as in one piece (up to float rounding, which adds up in a different order at the seams).
+    """
+    offsets, divisor = KERNELS[kernel]
+    k = diagonal_slope(kernel)
+    depth = max(dy for dy, _, _ in offsets)
+    reach = max(abs(dx) for _, dx, _ in offsets)
+
+    height, width = values.shape
+    stride = width + 2 * reach
+    grid = np.zeros((height + depth, stride), dtype=np.float32)
+    grid[:height, reach:reach + width] = values
+    if carry is not None:
+        grid[:depth, reach:reach + width] += carry
+    flat = grid.reshape(-1)
+
+    weights = [(dy * stride + dx, np.float32(weight / divisor)) for dy, dx, weight in offsets]
+    step = stride - k
+    level = np.float32(255)
+    error = np.empty(height, dtype=np.float32)
+    spread = np.empty(height, dtype=np.float32)
+
+    for t in range(width + k * (height - 1)):
+        # Rows whose pixel on this diagonal is inside the image
+        first = max(0, -(-(t - width + 1) // k))
+        last = min(height - 1, t // k)
+        if first > last:
+            continue
+        start = first * stride + reach + t - k * first
+        stop = last * stride + reach + t - k * last + 1
+        count = last - first + 1
+
+        pixels = flat[start:stop:step]
+        on = pixels >= threshold
+        np.multiply(on, level, out=spread[:count])
+        np.subtract(pixels, spread[:count], out=error[:count])
+        pixels[:] = spread[:count]
+
+        for offset, weight in weights:
+            target = flat[start + offset:stop + offset:step]
+            np.multiply(error[:count], weight, out=spread[:count])
+            target += spread[:count]
+
+    carry = grid[height:, reach:reach + width].copy()
+    return grid[:height, reach:reach + width].astype(np.uint8), carry
+
+
+def floyd_steinberg_reference(values) -> np.ndarray:
+    """
+    The pixel-by-pixel Floyd-Steinberg loop the raster tools used to run, kept to check and time error_diffusion
+    against.
+    """
+    arr = np.array(values, dtype=np.float32)
+    h, w = arr.shape
+
+    for y in range(h):
+        for x in range(w):
+            old_pixel = arr[y, x]
+            new_pixel = 0 if old_pixel < 128 else 255
+            arr[y, x] = new_pixel
+            quant_error = old_pixel - new_pixel
+            if x + 1 < w:
+                arr[y, x + 1] += quant_error * 7 / 16
+            if y + 1 < h:
+                if x > 0:
+                    arr[y + 1, x - 1] += quant_error * 3 / 16
+                arr[y + 1, x] += quant_error * 5 / 16
+                if x + 1 < w:
+                    arr[y + 1, x + 1] += quant_error * 1 / 16
+
+    return np.clip(arr, 0, 255).astype(np.uint8)
+
+
+# ============================================================
+# Ordered Dithering
+# ============================================================
+
+@functools.lru_cache(maxsize=None)
+def bayer_matrix(size=BAYER_SIZE) -> np.ndarray:
+    """
+    The size x size Bayer index matrix (size a power of two), as thresholds in (0, 255).
+    """
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while len(matrix) < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) * 255 / matrix.size
+
+
+@functools.lru_cache(maxsize=None)
+def blue_noise_matrix(size=BLUE_NOISE_SIZE, sigma=BLUE_NOISE_SIGMA, seed=0) -> np.ndarray:
+    """
+    A size x size blue noise threshold matrix in (0, 255), from Ulichney's void-and-cluster method: pixels are ranked
+    by repeatedly taking the tightest cluster out of a random pattern, then filling the largest void, measured with
+    a Gaussian on the torus so the matrix tiles without seams.
+    """
+    coordinates = np.minimum(np.arange(size), size - np.arange(size))
+    gaussian = np.exp(-(coordinates[:, None] ** 2 + coordinates[None, :] ** 2) / (2 * sigma * sigma))
+    spectrum = np.fft.rfft2(gaussian)
+
+    def energy(pattern):
+        return np.fft.irfft2(np.fft.rfft2(pattern) * spectrum, s=pattern.shape)
+
+    def splat(field, index, sign):
+        y, x = divmod(index, size)
+        field += sign * np.roll(np.roll(gaussian, y, axis=0), x, axis=1)
+
+    rng = np.random.default_rng(seed)
+    pattern = np.zeros((size, size))
+    pattern.flat[rng.choice(size * size, size * size // 10, replace=False)] = 1
+
+    # Spread the initial points out: move the tightest cluster into the largest void until that changes nothing
+    field = energy(pattern)
+    for _ in range(size * size):
+        cluster = int(np.argmax(np.where(pattern == 1, field, -np.inf)))
+        pattern.flat[cluster] = 0
+        splat(field, cluster, -1)
+        void = int(np.argmin(np.where(pattern == 0, field, np.inf)))
+        if void == cluster:
+            pattern.flat[cluster] = 1
+            splat(field, cluster, 1)
+            break
+        pattern.flat[void] = 1
+        splat(field, void, 1)
+
+    ranks = np.zeros(size * size, dtype=np.int64)
+    ones = int(pattern.sum())
+
+    # Ranks below the initial pattern: take clusters out
+    removing = pattern.copy()
+    removing_field = field.copy()
+    for rank in range(ones - 1, -1, -1):
+        cluster = int(np.argmax(np.where(removing == 1, removing_field, -np.inf)))
+        removing.flat[cluster] = 0
+        splat(removing_field, cluster, -1)
+        ranks[cluster] = rank
+
+    # Ranks above it: fill voids
+    for rank in range(ones, size * size):
+        void = int(np.argmin(np.where(pattern == 0, field, np.inf)))
+        pattern.flat[void] = 1
+        splat(field, void, 1)
+        ranks[void] = rank
+
+    return ((ranks + 0.5) * 255 / ranks.size).reshape(size, size)
+
+
+def ordered_dither(values, matrix, top=0) -> np.ndarray:
+    """
+    Thresholds every pixel against the matrix tiled over the image. ``top`` is the row the values start on, for
+    images dithered in bands.
+    """
+    height, width = values.shape
+    rows, columns = matrix.shape
+    matrix = np.roll(matrix, -(top % rows), axis=0)
+    tiled = np.tile(matrix, (-(-height // rows), -(-width // columns)))[:height, :width]
+    return np.where(values < tiled, 0, 255).astype(np.uint8)
+
+
+# ============================================================
+# Dithering
+# ============================================================
+
+def dither(values, method="floyd-steinberg") -> np.ndarray:
+    """
+    Dithers a 2-D array of grey levels (0 = black, 255 = white) to a uint8 image of 0 and 255.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    if method in KERNELS:
+        return error_diffusion(values, method)[0]
+    if method == "bayer":
+        return ordered_dither(values, bayer_matrix())
+    if method == "blue-noise":
+        return ordered_dither(values, blue_noise_matrix())
+    if method == "threshold":
+        return np.where(values < THRESHOLD, 0, 255).astype(np.uint8)
+    raise ValueError(f"Unknown dithering method {method}. Valid methods: {list(METHODS)}")
+
+
+def dither_image(img: Image.Image, method="floyd-steinberg") -> Image.Image:
+    return Image.fromarray(dither(np.asarray(img.convert("L")), method))
+
+
+def dither_bands(values, method="floyd-steinberg", rows=BAND_ROWS):
+    """
+    Dithers a 2-D array of grey levels band by band, ``rows`` rows at a time, yielding each dithered band as it is
+    done. Error diffusion carries its error across the seams, so the bands join up without a trace; only one band
+    is ever held as floats.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown dithering method {method}. Valid methods: {list(METHODS)}")
+
+    carry = None
+    for top in range(0, len(values), rows):
+        band = np.asarray(values[top:top + rows], dtype=np.float32)
+        if method in KERNELS:
+            band, carry = error_diffusion(band, method, carry=carry)
+            yield band
+        elif method == "bayer":
+            yield ordered_dither(band, bayer_matrix(), top)
+        elif method == "blue-noise":
+            yield ordered_dither(band, blue_noise_matrix(), top)
+        else:
+            yield dither(band, method)
+
+
+# ============================================================
+# Benchmark
+# ============================================================
+
+def benchmark(values, reference_rows=None):
+    """
+    Times every method on ``values`` against the pixel loop. The loop is run on the first ``reference_rows`` rows
+    only (its time is scaled up), since on a large image it takes minutes.
+    """
+    height = len(values)
+    rows = min(height, reference_rows or height)
+
+    start = time.perf_counter()
+    reference = floyd_steinberg_reference(values[:rows])
+    loop_seconds = (time.perf_counter() - start) * height / rows
+
+    matches = np.mean(error_diffusion(values[:rows].astype(np.float32))[0] == reference)
+    print(f"{'pixel loop (floyd-steinberg)':<30}{loop_seconds:10.3f} s{'':>12}"
+          f"{'  (from %d rows)' % rows if rows < height else ''}")
+
+    for method in METHODS:
+        if method == "blue-noise":
+            blue_noise_matrix()  # built once per process
+        start = time.perf_counter()
+        dither(values, method)
+        seconds = time.perf_counter() - start
+        print(f"{method:<30}{seconds:10.3f} s{loop_seconds / seconds:10.0f}x")
+
+    print(f"floyd-steinberg matches the pixel loop on {matches:.4%} of pixels")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dither an image, or time the dithering methods")
+    parser.add_argument("image", nargs="?", help="image to dither (default: a synthetic 4000x3000 gradient)")
+    parser.add_argument("--method", choices=METHODS, default="floyd-steinberg")
+    parser.add_argument("--output", help="write the dithered image here")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--reference-rows", type=int, default=100, help="rows the pixel loop is timed on")
+    args = parser.parse_args()
+
+    if args.image:
+        values = np.asarray(Image.open(args.image).convert("L"), dtype=np.float32)
+    else:
+        y, x = np.mgrid[0:3000, 0:4000]
+        values = (127.5 + 127.5 * np.sin(x / 300) * np.cos(y / 200)).astype(np.float32)
+
+    if args.benchmark:
+        benchmark(values, args.reference_rows)
+
+    if args.output:
+        Image.fromarray(dither(values, args.method)).save(args.output)
+        print(f"Saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 import numpy as np
 import xml.etree.ElementTree as ET
-from svgpathtools import parse_path
 import json
 
+from CurveFlattener import flatten_path
+
 # Character set (as you described)
 glyph_chars = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~"
 
+# Largest distance between an outline and its chords (SVG units)
+FLATTEN_TOLERANCE = 0.1
+
 # Load SVG
 svg_path = "Font.svg"
 tree = ET.parse(svg_path)
@@ -46,25 +50,8 @@ glyph_points = {}
 for char, path_elem in zip(glyph_chars, paths):
     d = path_elem.attrib.get('d')
     if d:
-        path = parse_path(d)
-        points = []
-        for segment in path:
-            # Extract the key points (start, control, and end points) of the segment
-            if segment.__class__.__name__ == 'Line':
-                points.append((round(segment.start.real, 4), round(segment.start.imag, 4)))
-                points.append((round(segment.end.real, 4), round(segment.end.imag, 4)))
-            elif segment.__class__.__name__ == 'CubicBezier':
-                points.append((round(segment.start.real, 4), round(segment.start.imag, 4)))
-                points.append((round(segment.control1.real, 4), round(segment.control1.imag, 4)))
-                points.append((round(segment.control2.real, 4), round(segment.control2.imag, 4)))
-                points.append((round(segment.end.real, 4), round(segment.end.imag, 4)))
-            elif segment.__class__.__name__ == 'QuadraticBezier':
-                points.append((round(segment.start.real, 4), round(segment.start.imag, 4)))
-                points.append((round(segment.control.real, 4), round(segment.control.imag, 4)))
-                points.append((round(segment.end.real, 4), round(segment.end.imag, 4)))
-            elif segment.__class__.__name__ == 'Arc':
-                points.append((round(segment.start.real, 4), round(segment.start.imag, 4)))
-                points.append((round(segment.end.real, 4), round(segment.end.imag, 4)))
+        # Flattened outline, every subpath one after the other
+        points = [tuple(point) for stroke in flatten_path(d, FLATTEN_TOLERANCE) for point in stroke.round(4)]
 
         # Normalize the points for this character
         normalized_points = normalize_points(points, size=100)  # Normalize to fit within a 100x100 box
@@ -0,0 +1,749 @@
+import argparse
+import collections
+import os
+import threading
+
+from GcodeInterpreter import parse_line, strip_comments
+from GrblRealtime import (CYCLE_START, FEED_HOLD, JOG_CANCEL, LINE_BUFFER_SIZE, PLANNER_BLOCKS, RX_BUFFER_SIZE,
+                          SOFT_RESET, STATUS_REPORT, apply_override)
+from MotionPlanner import MotionPlanner, PlannerBlock, arc_points, profile_from_grbl_settings
+from PtyServer import PtyServer, SerialWire
+
+
+# ============================================================
+# GRBL Constants
+# ============================================================
+
+GRBL_VERSION = "1.1h"
+
+CMD_STATUS_REPORT = STATUS_REPORT[0]
+CMD_FEED_HOLD = FEED_HOLD[0]
+CMD_CYCLE_START = CYCLE_START[0]
+CMD_RESET = SOFT_RESET[0]
+CMD_JOG_CANCEL = JOG_CANCEL[0]
+CMD_EXTENDED = 0x80  # every byte from here up is a real-time command
+
+ERROR_EXPECTED_COMMAND_LETTER = 1
+ERROR_BAD_NUMBER_FORMAT = 2
+ERROR_INVALID_STATEMENT = 3
+ERROR_SETTING_DISABLED = 5
+ERROR_IDLE_ERROR = 8
+ERROR_SYSTEM_GC_LOCK = 9
+ERROR_OVERFLOW = 11
+ERROR_INVALID_JOG_COMMAND = 16
+ERROR_UNSUPPORTED_COMMAND = 20
+ERROR_MODAL_GROUP_VIOLATION = 21
+ERROR_UNDEFINED_FEED_RATE = 22
+ERROR_NO_AXIS_WORDS = 26
+ERROR_VALUE_WORD_MISSING = 28
+ERROR_INVALID_TARGET = 33
+
+ALARM_ABORT_CYCLE = 3
+
+# GRBL 1.1 defaults with laser mode on and the plotters' rates and accelerations from GRBL_Set_Acceleration.py
+DEFAULT_SETTINGS = {
+    "$0": "10", "$1": "25", "$2": "0", "$3": "0", "$4": "0", "$5": "0", "$6": "0",
+    "$10": "1", "$11": "0.010", "$12": "0.002", "$13": "0",
+    "$20": "0", "$21": "0", "$22": "1", "$23": "0", "$24": "25.000", "$25": "500.000", "$26": "250",
+    "$27": "1.000", "$30": "1000", "$31": "0", "$32": "1",
+    "$100": "250.000", "$101": "250.000", "$102": "250.000",
+    "$110": "1300.000", "$111": "1300.000", "$112": "600.000",
+    "$120": "1900.000", "$121": "1900.000", "$122": "500.000",
+    "$130": "200.000", "$131": "200.000", "$132": "200.000",
+}
+
+SUPPORTED_G_CODES = {
+    "G0", "G1", "G2", "G3", "G4", "G17", "G20", "G21", "G28", "G40", "G49", "G53", "G54", "G80",
+    "G90", "G91", "G91.1", "G92", "G92.1", "G94",
+}
+SUPPORTED_M_CODES = {"M0", "M2", "M3", "M4", "M5", "M7", "M8", "M9", "M30"}
+SUPPORTED_PARAMS = set("XYZIJKRFSPLT")
+
+MOTION_CODES = ("G0", "G1", "G2", "G3")
+JOG_G_CODES = {"G20", "G21", "G53", "G90", "G91"}
+JOG = "jog"  # planner tag of $J= moves
+AXES = ("X", "Y", "Z")
+INCH = 25.4
+
+
+# ============================================================
+# Machine
+# ============================================================
+
+class GRBLMachine:
+    """
+    Clock-agnostic model of a GRBL 1.1 controller.
+
+    Bytes arrive through receive(), time passes through advance() and responses collect until take_output(). The
+    model keeps the 127 byte RX buffer (overflowing bytes are dropped, as on the real board), a 16 block look-ahead
+    planner with trapezoidal timing, real-time commands and "ok" sent once a line's motion is queued. Feed hold
+    and jog cancel stop instantly rather than decelerating, and feed/rapid overrides scale the speed of the move in
+    progress.
+    """
+
+    def __init__(self, settings=None, homing_time=2.0):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.homing_time = homing_time
+        self.output = bytearray()
+        self.counters = collections.Counter()
+
+        self.position = [0.0, 0.0, 0.0]
+        self.current = None
+        self.planner = None
+        self.overrides = (100, 100, 100)
+        self.reset(alarm=False)
+
+    def receive(self, data: bytes):
+        for byte in data:
+            if self._realtime(byte):
+                continue
+
+            if len(self.rx) >= RX_BUFFER_SIZE:
+                self.counters["overflows"] += 1
+                continue
+
+            self.rx.append(byte)
+
+        self._process_lines()
+
+    def take_output(self) -> bytes:
+        data = bytes(self.output)
+        self.output.clear()
+        return data
+
+    def busy(self):
+        return bool(
+            self.current or len(self.planner) or self.pending or self.sync_action or self.dwell_remaining > 0 or self.rx
+        )
+
+    def advance(self, elapsed):
+        self._process_lines()
+
+        while elapsed > 0:
+            if self.hold:
+                break
+
+            if self.dwell_remaining > 0:
+                step = min(elapsed, self.dwell_remaining)
+                self.dwell_remaining -= step
+                elapsed -= step
+                self.counters["dwell_time"] += step
+                if self.dwell_remaining <= 0:
+                    self.dwell_remaining = 0.0
+                    self._process_lines()
+                continue
+
+            if self.current is None:
+                if not len(self.planner):
+                    if self.state in ("Run", "Jog"):
+                        if self.state == "Run" and self.sync_action is None:
+                            self.counters["underruns"] += 1
+                        self.state = "Idle"
+                    self.counters["idle_time"] += elapsed
+                    break
+
+                self.current = self.planner.pop()
+                self.current_elapsed = 0.0
+                self.current_duration = self.current.duration()
+                self.state = "Jog" if self.current.tag == JOG else "Run"
+
+            # Overrides run the planned profile faster or slower
+            feed, rapid, _ = self.overrides
+            rate = (rapid if self.current.rapid else feed) / 100
+            step = min(elapsed, (self.current_duration - self.current_elapsed) / rate)
+            self.current_elapsed += step * rate
+            elapsed -= step
+            self.counters["motion_time"] += step
+
+            if self.current_elapsed >= self.current_duration:
+                self.position = list(self.current.end)
+                self.current = None
+                self.counters["blocks"] += 1
+                self._process_lines()
+
+        self._process_lines()
+
+    def reset(self, alarm=True):
+        moving = self.current is not None or (self.planner is not None and len(self.planner) > 0)
+
+        if self.current is not None:
+            self.position = list(self.current.position_at(self.current_elapsed))
+
+        self.rx = bytearray()
+        self.planner = MotionPlanner(profile_from_grbl_settings(self.settings), PLANNER_BLOCKS)
+        self.current = None
+        self.current_elapsed = 0.0
+        self.current_duration = 0.0
+        self.pending = collections.deque()
+        self.pending_ok = False
+        self.sync_action = None
+        self.dwell_remaining = 0.0
+        self.hold = False
+        self.overrides = (100, 100, 100)
+
+        self.motion = "G0"
+        self.distance = "G90"
+        self.units = "G21"
+        self.feed = None
+        self.spindle = "M5"
+        self.power = 0.0
+        self.offset = [0.0, 0.0, 0.0]
+
+        if alarm and moving:
+            self.state = "Alarm"
+            self._send(f"ALARM:{ALARM_ABORT_CYCLE}")
+        elif alarm and self.state == "Alarm":
+            pass
+        else:
+            self.state = "Idle"
+
+        self._send("")
+        self._send(f"Grbl {GRBL_VERSION} ['$' for help]")
+        if self.state == "Alarm":
+            self._send("[MSG:'$H'|'$X' to unlock]")
+
+    def status_report(self):
+        position = self.position
+        feed_override, rapid_override, spindle_override = self.overrides
+        feed = 0.0
+        if self.current is not None:
+            position = self.current.position_at(self.current_elapsed)
+            feed = self.current.nominal_speed * 60 * (rapid_override if self.current.rapid else feed_override) / 100
+
+        state = "Hold:0" if self.hold else self.state
+        report = f"<{state}|MPos:{position[0]:.3f},{position[1]:.3f},{position[2]:.3f}"
+        if int(self.settings["$10"]) & 2:
+            report += f"|Bf:{PLANNER_BLOCKS - len(self.planner)},{RX_BUFFER_SIZE - len(self.rx)}"
+        report += f"|FS:{feed:.0f},{self.power * spindle_override / 100:.0f}"
+        report += f"|Ov:{feed_override},{rapid_override},{spindle_override}>"
+        return report
+
+    def _send(self, text):
+        self.output.extend(text.encode() + b"\r\n")
+
+    def _realtime(self, byte):
+        if byte == CMD_STATUS_REPORT:
+            self._send(self.status_report())
+        elif byte == CMD_JOG_CANCEL:
+            self._cancel_jog()
+        elif byte == CMD_FEED_HOLD:
+            if self.state == "Jog":
+                # A hold during a jog cancels it
+                self._cancel_jog()
+            elif self.state == "Run" and not self.hold:
+                self.hold = True
+                self._freeze_current()
+        elif byte == CMD_CYCLE_START:
+            self.hold = False
+        elif byte == CMD_RESET:
+            self.reset()
+        elif byte >= CMD_EXTENDED:
+            # Overrides; other extended commands (door, coolant) are accepted and ignored
+            self.overrides = apply_override(bytes([byte]), *self.overrides)
+        else:
+            return False
+        return True
+
+    def _freeze_current(self):
+        """
+        Splits the executing block at the current position so that resuming accelerates from rest.
+        """
+        if self.current is None:
+            return
+
+        block = self.current
+        position = block.position_at(self.current_elapsed)
+        remaining = block.distance - block.distance_at(self.current_elapsed)
+        self.position = list(position)
+
+        resumed = PlannerBlock(
+            position, block.end, remaining, block.unit, block.nominal_speed, block.acceleration, block.rapid, block.tag
+        )
+        resumed.exit_speed = block.exit_speed
+        self.current = resumed
+        self.current_elapsed = 0.0
+        self.current_duration = resumed.duration()
+
+    def _process_lines(self):
+        while True:
+            while self.pending and not self.planner.is_full():
+                start, end, feed, rapid, tag = self.pending.popleft()
+                self.planner.add(start, end, feed, rapid, tag)
+
+            if self.pending:
+                return
+
+            if self.pending_ok:
+                self.pending_ok = False
+                self._send("ok")
+
+            if self.sync_action is not None:
+                if self.busy_with_motion() or self.dwell_remaining > 0:
+                    return
+
+                action, duration = self.sync_action
+                if action != "finish":
+                    self.sync_action = ("finish", None)
+                    self.dwell_remaining = duration
+                    if duration > 0:
+                        return
+
+                self._finish_sync()
+                continue
+
+            end = self._line_end()
+            if end < 0:
+                return
+
+            raw = bytes(self.rx[:end]).decode(errors="ignore")
+            del self.rx[:end + 1]
+            self._execute_line(raw)
+
+    def _finish_sync(self):
+        if self.state == "Home":
+            self.position = [0.0, 0.0, 0.0]
+            self.state = "Idle"
+        self.sync_action = None
+        self._send("ok")
+
+    def _line_end(self):
+        for index, byte in enumerate(self.rx):
+            if byte in (10, 13):
+                return index
+        return -1
+
+    def _execute_line(self, raw):
+        text = "".join(strip_comments(raw).split()).upper()
+
+        if len(text) > LINE_BUFFER_SIZE:
+            return self._error(ERROR_OVERFLOW)
+
+        if not text:
+            return self._send("ok")
+
+        if text.startswith("$"):
+            return self._system_command(text)
+
+        if self.state == "Alarm":
+            return self._error(ERROR_SYSTEM_GC_LOCK)
+
+        block = parse_line(text)
+        if block.system is not None:
+            error = ERROR_EXPECTED_COMMAND_LETTER if not text[0].isalpha() else ERROR_BAD_NUMBER_FORMAT
+            return self._error(error)
+
+        error = self._execute_block(block)
+        if error:
+            return self._error(error)
+
+        if self.pending:
+            self.pending_ok = True
+        elif self.sync_action is None:
+            self._send("ok")
+
+    def _execute_block(self, block):
+        if any(code not in SUPPORTED_G_CODES for code in block.g_codes):
+            return ERROR_UNSUPPORTED_COMMAND
+        if any(code not in SUPPORTED_M_CODES for code in block.m_codes):
+            return ERROR_UNSUPPORTED_COMMAND
+        if any(letter not in SUPPORTED_PARAMS for letter in block.params):
+            return ERROR_UNSUPPORTED_COMMAND
+
+        motion_codes = [code for code in block.g_codes if code in MOTION_CODES]
+        if len(motion_codes) > 1 or len(set(block.g_codes)) != len(block.g_codes):
+            return ERROR_MODAL_GROUP_VIOLATION
+
+        scale = INCH if ("G20" in block.g_codes or (self.units == "G20" and "G21" not in block.g_codes)) else 1.0
+        params = block.params
+
+        # Modal state, in GRBL's order of execution
+        if "F" in params:
+            self.feed = params["F"] * scale
+        if "S" in params:
+            self.power = params["S"]
+        for code in block.m_codes:
+            if code in ("M3", "M4", "M5"):
+                self.spindle = code
+                if code == "M5" and not int(self.settings["$32"]):
+                    self.power = 0.0
+            elif code in ("M2", "M30"):
+                self.motion, self.distance, self.spindle = "G1", "G90", "M5"
+                self.offset = [0.0, 0.0, 0.0]
+
+        if "G4" in block.g_codes:
+            if "P" not in params:
+                return ERROR_VALUE_WORD_MISSING
+            self.sync_action = ("dwell", params["P"])
+            return 0
+
+        for code in block.g_codes:
+            if code in ("G20", "G21"):
+                self.units = code
+            elif code in ("G90", "G91"):
+                self.distance = code
+            elif code in MOTION_CODES:
+                self.motion = code
+
+        axis_words = block.axis_words()
+        work = [p - o for p, o in zip(self._planned_position(), self.offset)]
+
+        if "G92" in block.g_codes:
+            machine = self._planned_position()
+            for index, axis in enumerate(AXES):
+                if axis in axis_words:
+                    self.offset[index] = machine[index] - axis_words[axis] * scale
+            return 0
+
+        if "G92.1" in block.g_codes:
+            self.offset = [0.0, 0.0, 0.0]
+            return 0
+
+        target = []
+        for index, axis in enumerate(AXES):
+            if axis not in axis_words:
+                target.append(work[index])
+            elif self.distance == "G91" and "G53" not in block.g_codes:
+                target.append(work[index] + axis_words[axis] * scale)
+            else:
+                target.append(axis_words[axis] * scale)
+
+        if "G53" in block.g_codes:
+            machine_target = [t if AXES[i] in axis_words else self._planned_position()[i] for i, t in enumerate(target)]
+            target = [t - o for t, o in zip(machine_target, self.offset)]
+
+        if "G28" in block.g_codes:
+            if axis_words:
+                self._queue_line(work, target, None, True)
+            self._queue_line(target, [-o for o in self.offset], None, True)
+            return 0
+
+        if not axis_words:
+            return 0
+
+        if self.motion in ("G1", "G2", "G3") and not self.feed:
+            return ERROR_UNDEFINED_FEED_RATE
+
+        if self.motion in ("G0", "G1"):
+            self._queue_line(work, target, self.feed, self.motion == "G0")
+            return 0
+
+        return self._queue_arc(work, target, block, scale)
+
+    def _queue_arc(self, start, target, block, scale):
+        if not ({"X", "Y"} & set(block.params)):
+            return ERROR_NO_AXIS_WORDS
+
+        if "R" in block.params:
+            points = arc_points(start, target, self.motion == "G2", radius=block.params["R"] * scale,
+                                tolerance=float(self.settings["$12"]))
+        else:
+            offset = (block.params.get("I", 0.0) * scale, block.params.get("J", 0.0) * scale)
+            points = arc_points(start, target, self.motion == "G2", offset=offset,
+                                tolerance=float(self.settings["$12"]))
+
+        if points is None:
+            return ERROR_INVALID_TARGET
+
+        previous = start
+        for point in points:
+            self._queue_line(previous, point, self.feed, False)
+            previous = point
+
+        return 0
+
+    def _queue_line(self, start, end, feed, rapid, tag=None):
+        machine_start = [s + o for s, o in zip(start, self.offset)]
+        machine_end = [e + o for e, o in zip(end, self.offset)]
+        self.pending.append((machine_start, machine_end, feed, rapid, tag))
+
+    def _planned_position(self):
+        if self.pending:
+            return list(self.pending[-1][1])
+        if len(self.planner):
+            return list(self.planner.blocks[-1].end)
+        if self.current is not None:
+            return list(self.current.end)
+        return list(self.position)
+
+    def _system_command(self, text):
+        if text == "$$":
+            if self.state not in ("Idle", "Alarm"):
+                return self._error(ERROR_IDLE_ERROR)
+            for key in sorted(self.settings, key=lambda k: int(k[1:])):
+                self._send(f"{key}={self.settings[key]}")
+            return self._send("ok")
+
+        if text == "$X":
+            if self.state == "Alarm":
+                self.state = "Idle"
+                self._send("[MSG:Caution: Unlocked]")
+            return self._send("ok")
+
+        if text == "$H":
+            if not int(self.settings["$22"]):
+                return self._error(ERROR_SETTING_DISABLED)
+            if self.state not in ("Idle", "Alarm") or self.busy_with_motion():
+                return self._error(ERROR_IDLE_ERROR)
+            self.state = "Home"
+            self.sync_action = ("home", self.homing_time)
+            return None
+
+        if text.startswith("$J="):
+            return self._jog(text[3:])
+
+        if text == "$G":
+            units = self.units
+            self._send(
+                f"[GC:{self.motion} G54 G17 {units} {self.distance} G94 {self.spindle} M9 T0 "
+                f"F{self.feed or 0:.0f} S{self.power:.0f}]"
+            )
+            return self._send("ok")
+
+        if text == "$I":
+            self._send(f"[VER:{GRBL_VERSION}.20190825:]")
+            self._send(f"[OPT:V,{PLANNER_BLOCKS - 1},{RX_BUFFER_SIZE + 1}]")
+            return self._send("ok")
+
+        if text == "$#":
+            offset = ",".join(f"{o:.3f}" for o in self.offset)
+            self._send(f"[G92:{offset}]")
+            return self._send("ok")
+
+        if "=" in text and text[1:].split("=", 1)[0].isdigit():
+            key, value = text.split("=", 1)
+            if key not in self.settings:
+                return self._error(ERROR_INVALID_STATEMENT)
+            if self.state not in ("Idle", "Alarm") or self.busy_with_motion():
+                return self._error(ERROR_IDLE_ERROR)
+            try:
+                float(value)
+            except ValueError:
+                return self._error(ERROR_BAD_NUMBER_FORMAT)
+            self.settings[key] = value
+            self.planner.profile = profile_from_grbl_settings(self.settings)
+            return self._send("ok")
+
+        return self._error(ERROR_INVALID_STATEMENT)
+
+    def _jog(self, text):
+        """
+        Queues a $J= jog. Jogs take their units, distance mode and feed from the line alone and leave the parser's
+        modal state untouched.
+        """
+        if self.state == "Alarm":
+            return self._error(ERROR_SYSTEM_GC_LOCK)
+        if self.state not in ("Idle", "Jog"):
+            return self._error(ERROR_IDLE_ERROR)
+
+        block = parse_line(text)
+        if block.system is not None:
+            return self._error(ERROR_BAD_NUMBER_FORMAT)
+
+        codes = block.g_codes
+        if block.m_codes or any(code not in JOG_G_CODES for code in codes):
+            return self._error(ERROR_INVALID_JOG_COMMAND)
+        if any(letter not in "XYZF" for letter in block.params):
+            return self._error(ERROR_INVALID_JOG_COMMAND)
+        if "F" not in block.params:
+            return self._error(ERROR_UNDEFINED_FEED_RATE)
+
+        axis_words = block.axis_words()
+        if not axis_words:
+            return self._error(ERROR_NO_AXIS_WORDS)
+
+        scale = INCH if ("G20" in codes or (self.units == "G20" and "G21" not in codes)) else 1.0
+        incremental = "G91" in codes or (self.distance == "G91" and "G90" not in codes)
+
+        machine = self._planned_position()
+        work = [m - o for m, o in zip(machine, self.offset)]
+        target = []
+        for index, axis in enumerate(AXES):
+            if axis not in axis_words:
+                target.append(work[index])
+            elif "G53" in codes:
+                target.append(axis_words[axis] * scale - self.offset[index])
+            elif incremental:
+                target.append(work[index] + axis_words[axis] * scale)
+            else:
+                target.append(axis_words[axis] * scale)
+
+        self._queue_line(work, target, block.params["F"] * scale, False, JOG)
+        self.state = "Jog"
+        self.counters["jogs"] += 1
+
+        if self.pending:
+            self.pending_ok = True
+        else:
+            self._send("ok")
+
+    def _cancel_jog(self):
+        """
+        Stops the jog in progress and throws away every queued jog move, leaving the machine idle where it stopped.
+        """
+        if self.state != "Jog":
+            return
+
+        if self.current is not None:
+            self.position = list(self.current.position_at(self.current_elapsed))
+            self.current = None
+        self.planner.clear()
+        self.pending.clear()
+        self.state = "Idle"
+        self.counters["jog_cancels"] += 1
+
+    def busy_with_motion(self):
+        return self.current is not None or len(self.planner) > 0 or bool(self.pending)
+
+    def _error(self, code):
+        self.counters["errors"] += 1
+        self._send(f"error:{code}")
+
+
+# ============================================================
+# Streaming Benchmark
+# ============================================================
+
+def _send_and_wait_allows(in_flight, length):
+    return not in_flight
+
+
+def _character_counting_allows(in_flight, length):
+    return sum(in_flight) + length <= RX_BUFFER_SIZE
+
+
+STREAMING_STRATEGIES = {
+    "send-and-wait": _send_and_wait_allows,
+    "char-count": _character_counting_allows,
+}
+
+
+def simulate_stream(lines, strategy="char-count", settings=None, baudrate=115200, host_latency=0.002,
+                    tick=0.0005, time_limit=24 * 3600, machine=None):
+    """
+    Streams a program into a GRBLMachine (or the given ``machine``) on a simulated clock and returns timing counters.
+
+    The host answers every response after ``host_latency`` seconds (USB and OS turnaround) and both directions of
+    the link run at ``baudrate``. Everything is stepped in ``tick`` increments, so results are identical on every
+    run and every machine.
+    """
+    allows = STREAMING_STRATEGIES[strategy]
+    machine = machine or GRBLMachine(settings)
+    machine.take_output()
+
+    to_machine = SerialWire(baudrate)
+    to_host = SerialWire(baudrate)
+
+    commands = [(line.strip() + "\n").encode() for line in lines if line.strip()]
+    in_flight = collections.deque()
+    received = b""
+    next_command = 0
+    acknowledged = 0
+    ready_at = 0.0
+    clock = 0.0
+    underruns = 0
+
+    while acknowledged < len(commands) or machine.busy() or len(to_machine):
+        if clock >= ready_at:
+            while next_command < len(commands) and allows(in_flight, len(commands[next_command])):
+                to_machine.push(commands[next_command])
+                in_flight.append(len(commands[next_command]))
+                next_command += 1
+
+        machine.receive(to_machine.release(tick))
+        machine.advance(tick)
+        to_host.push(machine.take_output())
+        received += to_host.release(tick)
+
+        while b"\n" in received:
+            response, received = received.split(b"\n", 1)
+            response = response.strip()
+            if response.lower() == b"ok" or response.startswith(b"error"):
+                in_flight.popleft()
+                acknowledged += 1
+                ready_at = clock + host_latency
+
+                # Once the last line is acknowledged the planner is meant to drain
+                if acknowledged < len(commands):
+                    underruns = machine.counters["underruns"]
+
+        clock += tick
+        if clock > time_limit:
+            break
+
+    counters = machine.counters
+    return {
+        "strategy": strategy,
+        "time": clock,
+        "motion_time": counters["motion_time"],
+        "dwell_time": counters["dwell_time"],
+        "underruns": underruns,
+        "overflows": counters["overflows"],
+        "errors": counters["errors"],
+    }
+
+
+def print_benchmark(file, results):
+    print(f"\n{file}")
+    print(f"{'Strategy':<16} {'Job (s)':>10} {'Motion (s)':>11} {'Busy':>7} {'Underruns':>10} {'Errors':>7}")
+
+    for result in results:
+        busy = (result["motion_time"] + result["dwell_time"]) / result["time"] if result["time"] else 0
+        print(
+            f"{result['strategy']:<16} {result['time']:>10.2f} {result['motion_time']:>11.2f} {busy:>7.1%} "
+            f"{result['underruns']:>10} {result['errors'] + result['overflows']:>7}"
+        )
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def serve(speed, baudrate):
+    machine = GRBLMachine()
+    server = PtyServer(machine, baudrate=baudrate, speed=speed)
+    print(f"GRBL {GRBL_VERSION} emulator listening on {server.port} (Ctrl+C to stop)")
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+        thread.join()
+        print(f"\nBlocks executed: {machine.counters['blocks']}, planner underruns: {machine.counters['underruns']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GRBL 1.1 emulator on a pseudo-terminal")
+    subparsers = parser.add_subparsers(dest="mode")
+
+    serve_parser = subparsers.add_parser("serve", help="expose the emulator on a pty")
+    serve_parser.add_argument("--speed", type=float, default=1.0, help="machine time per wall clock second")
+    serve_parser.add_argument("--baud", type=int, default=115200)
+
+    bench_parser = subparsers.add_parser("bench", help="compare streaming strategies on a simulated clock")
+    bench_parser.add_argument("files", nargs="+")
+    bench_parser.add_argument("--strategy", nargs="+", choices=list(STREAMING_STRATEGIES),
+                              default=list(STREAMING_STRATEGIES))
+    bench_parser.add_argument("--latency", type=float, default=0.002, help="host turnaround per response (s)")
+    bench_parser.add_argument("--baud", type=int, default=115200)
+
+    args = parser.parse_args()
+
+    if args.mode == "bench":
+        for file in args.files:
+            with open(file, "r") as f:
+                lines = f.read().splitlines()
+            results = [
+                simulate_stream(lines, strategy, baudrate=args.baud, host_latency=args.latency)
+                for strategy in args.strategy
+            ]
+            print_benchmark(os.path.basename(file), results)
+    else:
+        serve(getattr(args, "speed", 1.0), getattr(args, "baud", 115200))
+
+
+if __name__ == "__main__":
+    main()
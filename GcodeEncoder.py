@@ -0,0 +1,390 @@
+import argparse
+import glob
+import os
+from decimal import Decimal
+
+from GcodeInterpreter import AXES, MOTION_CODES, DISTANCE_CODES, GcodeInterpreter, format_number
+
+
+# ============================================================
+# Dialects
+# ============================================================
+
+# GRBL accepts packed words, modal motion and incremental moves.
+DIALECT_GRBL = {
+    "separator": "",
+    "modal_motion": True,
+    "relative": True,
+    "strip_leading_zero": True,
+}
+
+# The MakeBlock firmware splits on spaces, needs the G word first on every move and only knows absolute moves.
+DIALECT_MAKEBLOCK = {
+    "separator": " ",
+    "modal_motion": False,
+    "relative": False,
+    "strip_leading_zero": True,
+}
+
+DIALECTS = {
+    "grbl": DIALECT_GRBL,
+    "makeblock": DIALECT_MAKEBLOCK,
+}
+
+# Cost of inserting a distance mode word in front of a line
+MODE_WORD_LENGTH = 3
+
+ANY_MODE = "any"
+
+
+# ============================================================
+# Encoder
+# ============================================================
+
+class _Item:
+    """
+    One encoded line waiting for the distance mode pass.
+
+    ``texts`` maps a distance mode to the line rendered for it (None = the line reads the same in any mode).
+    ``require`` is the mode a line that cannot be rewritten must be emitted in, and ``after`` the mode such a line
+    leaves behind through its own words.
+    """
+
+    __slots__ = ("texts", "require", "after")
+
+    def __init__(self, texts, require=ANY_MODE, after=None):
+        self.texts = texts
+        self.require = require
+        self.after = after
+
+
+class GcodeEncoder:
+    """
+    Rewrites G-code into the fewest bytes that make the controller do exactly the same thing.
+
+    Comments, line numbers, whitespace, trailing zeros and redundant modal words are removed and, for dialects that
+    support it, every move is written in whichever of G90/G91 is shorter.
+    """
+
+    def __init__(self, dialect="grbl"):
+        if dialect not in DIALECTS:
+            raise ValueError(f"Unknown dialect {dialect}. Valid dialects: {list(DIALECTS)}")
+
+        self.dialect = dialect
+        self.config = DIALECTS[dialect]
+
+    def encode(self, lines) -> list:
+        interpreter = GcodeInterpreter(number=Decimal)
+        blocks = [interpreter.parse(line) for line in lines]
+
+        # Incremental moves would have to be converted across unit changes; keep such programs in their own modes.
+        rewrite = self.config["relative"] and not any("G20" in block.g_codes for block in blocks)
+        items = []
+
+        for block in blocks:
+            before = interpreter.snapshot()
+            step = interpreter.execute(block)
+
+            if step.kind == "empty":
+                continue
+
+            if step.kind == "system":
+                items.append(_Item({None: block.system}, require=step.distance_before))
+                continue
+
+            if step.kind == "opaque" or not rewrite:
+                text = self._render(block.words, before, keep_all=step.kind == "opaque")
+                if text:
+                    items.append(_Item({None: text}, require=step.distance_before, after=step.distance_after))
+                continue
+
+            words = [(letter, value) for letter, value in block.words if not self._is_distance_word(letter, value)]
+
+            if step.kind != "move" or step.distance_after is None:
+                text = self._render(words, before)
+                if text:
+                    items.append(_Item({None: text}))
+                continue
+
+            texts = {}
+            for mode in ("G90", "G91"):
+                moved = self._move_words(words, mode, step)
+                if moved is not None:
+                    texts[mode] = self._render(moved, before)
+
+            items.append(_Item(texts))
+
+        return self._choose_modes(items, interpreter.distance if rewrite else None)
+
+    def encode_file(self, in_path, out_path=None, verify=True):
+        with open(in_path, "r") as f:
+            lines = f.read().splitlines()
+
+        encoded = self.encode(lines)
+        report = {
+            "file": in_path,
+            "lines_in": len(lines),
+            "lines_out": len(encoded),
+            "bytes_in": sum(len(line) + 1 for line in lines),
+            "bytes_out": sum(len(line) + 1 for line in encoded),
+            "verified": None,
+        }
+
+        if verify:
+            ok, message = verify_equivalent(lines, encoded)
+            report["verified"] = ok
+            if not ok:
+                raise ValueError(f"{in_path}: encoded program differs from the source: {message}")
+
+        if out_path is not None:
+            with open(out_path, "w") as f:
+                f.write("\n".join(encoded) + "\n")
+
+        return report
+
+    def _is_distance_word(self, letter, value):
+        return letter == "G" and "G" + format_number(value) in DISTANCE_CODES
+
+    def _move_words(self, words, mode, step):
+        """
+        Returns the words with axis values written for the given distance mode, or None if that is impossible.
+
+        Straight moves drop axes that do not change; arcs keep theirs because GRBL rejects an arc without them.
+        """
+        moved = []
+        for letter, value in words:
+            if letter in AXES:
+                start, end = step.start[letter], step.end[letter]
+
+                if step.motion in ("G0", "G1") and _axis_unchanged(step, letter):
+                    continue
+
+                if mode == "G90":
+                    value = end
+                elif start is not None and end is not None:
+                    value = end - start
+                elif step.distance_after != "G91":
+                    return None
+
+                if value is None:
+                    return None
+
+            moved.append((letter, value))
+
+        return moved
+
+    def _render(self, words, before, keep_all=False):
+        motion, _, _, inverse_time, feed, spindle, power = before
+        parts = []
+
+        for letter, value in words:
+            code = letter + format_number(value)
+
+            if not keep_all:
+                if code in MOTION_CODES and code == motion and self.config["modal_motion"]:
+                    continue
+                if letter == "F" and value == feed and not inverse_time:
+                    continue
+                if letter == "S" and value == power:
+                    continue
+                if letter == "M" and code == spindle:
+                    continue
+
+            if letter in "GM":
+                parts.append(code)
+            else:
+                parts.append(letter + format_number(value, self.config["strip_leading_zero"]))
+
+        has_arguments = any(part[0] not in "GM" for part in parts)
+
+        # A motion word with nothing to move is only needed when it changes the mode
+        if not self.config["modal_motion"] and not keep_all and not has_arguments:
+            parts = [part for part in parts if part not in MOTION_CODES or part != motion]
+
+        return self.config["separator"].join(parts)
+
+    def _choose_modes(self, items, final_mode):
+        """
+        Picks the distance mode for every line so that the total byte count, mode switches included, is minimal.
+        """
+        cost = {None: 0}
+        history = []
+
+        for item in items:
+            new_cost = {}
+            choice = {}
+
+            for previous, previous_cost in cost.items():
+                for mode, text in item.texts.items():
+                    if mode is not None:
+                        during = mode
+                    elif item.require is ANY_MODE:
+                        during = previous
+                    else:
+                        during = item.require
+
+                    # The inherited mode cannot be re-entered once a mode has been set
+                    if during is None and previous is not None:
+                        continue
+
+                    switch = during != previous
+                    after = item.after or during
+                    total = previous_cost + len(text) + 1 + (MODE_WORD_LENGTH if switch else 0)
+
+                    if after not in new_cost or total < new_cost[after]:
+                        new_cost[after] = total
+                        choice[after] = (previous, during, text)
+
+            cost = new_cost
+            history.append(choice)
+
+        def end_cost(state):
+            return cost[state] + (MODE_WORD_LENGTH + 1 if final_mode is not None and state != final_mode else 0)
+
+        state = min(cost, key=end_cost)
+        lines = []
+        if final_mode is not None and state != final_mode:
+            lines.append(final_mode)
+
+        for choice in reversed(history):
+            previous, during, text = choice[state]
+            if during != previous:
+                text = during + self.config["separator"] + text if text else during
+            if text:
+                lines.append(text)
+            state = previous
+
+        lines.reverse()
+        return lines
+
+
+# ============================================================
+# Verification
+# ============================================================
+
+def _axis_unchanged(step, axis):
+    if step.start[axis] is not None:
+        return step.start[axis] == step.end[axis]
+    return step.distance_after == "G91" and step.block.params.get(axis, 0) == 0
+
+
+def is_null_move(step):
+    if step.motion not in ("G0", "G1"):
+        return False
+    return all(_axis_unchanged(step, axis) for axis in step.block.axis_words())
+
+
+def program_effects(lines):
+    """
+    Reduces a program to the sequence of things the machine observably does, plus its final modal state.
+    """
+    interpreter = GcodeInterpreter(number=Decimal)
+    effects = []
+    last_spindle = (None, None)
+
+    for step in interpreter.run(lines):
+        if step.kind in ("empty", "modal"):
+            pass
+        elif step.kind == "system":
+            effects.append(("system", step.block.system))
+        elif step.kind == "opaque":
+            words = tuple(word for word in step.block.words if "G" + format_number(word[1]) not in DISTANCE_CODES
+                          or word[0] != "G")
+            effects.append(("opaque", step.distance_after, words))
+        elif step.kind == "dwell":
+            effects.append(("dwell", step.block.params["P"], step.spindle, step.power))
+        elif is_null_move(step):
+            pass
+        else:
+            target = []
+            for axis in AXES:
+                if step.end[axis] is not None:
+                    target.append(step.end[axis])
+                elif axis in step.block.params and not _axis_unchanged(step, axis):
+                    target.append((step.distance_after, step.block.params[axis]))
+                else:
+                    target.append(None)
+
+            arc = tuple((letter, step.block.params.get(letter)) for letter in "IJKR")
+            feed = None if step.motion == "G0" else step.feed
+            effects.append(("move", step.motion, tuple(target), arc, feed, step.spindle, step.power, interpreter.units))
+
+        spindle = (step.spindle, step.power)
+        if spindle != last_spindle:
+            effects.append(("spindle",) + spindle)
+            last_spindle = spindle
+
+    state = interpreter.snapshot()
+    return effects, state
+
+
+def verify_equivalent(original, encoded):
+    """
+    Checks that two programs drive the machine identically. Returns (ok, message).
+    """
+    original_effects, original_state = program_effects(original)
+    encoded_effects, encoded_state = program_effects(encoded)
+
+    for index, (expected, actual) in enumerate(zip(original_effects, encoded_effects)):
+        if expected != actual:
+            return False, f"effect {index}: expected {expected}, got {actual}"
+
+    if len(original_effects) != len(encoded_effects):
+        return False, f"{len(original_effects)} effects in the source, {len(encoded_effects)} after encoding"
+
+    if original_state != encoded_state:
+        return False, f"final state {encoded_state} instead of {original_state}"
+
+    return True, "equivalent"
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def print_report(reports):
+    print(f"\n{'File':<48} {'Lines':>15} {'Bytes':>21} {'Saved':>7}")
+
+    total_in = total_out = 0
+    for report in reports:
+        total_in += report["bytes_in"]
+        total_out += report["bytes_out"]
+        saved = 1 - report["bytes_out"] / report["bytes_in"] if report["bytes_in"] else 0
+        print(
+            f"{os.path.basename(report['file']):<48} "
+            f"{report['lines_in']:>7}->{report['lines_out']:<7} "
+            f"{report['bytes_in']:>10}->{report['bytes_out']:<10} "
+            f"{saved:>6.1%}"
+        )
+
+    if total_in:
+        print(f"{'Total':<48} {'':>15} {total_in:>10}->{total_out:<10} {1 - total_out / total_in:>6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrink G-code for the serial link without changing what it does")
+    parser.add_argument("files", nargs="*", default=glob.glob("./sliced/*.gcode"))
+    parser.add_argument("--dialect", choices=list(DIALECTS), default="grbl")
+    parser.add_argument("--out-dir", type=str, help="write encoded files here (default: report only)")
+    parser.add_argument("--no-verify", action="store_true")
+    args = parser.parse_args()
+
+    encoder = GcodeEncoder(args.dialect)
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    reports = []
+    for file in args.files:
+        out_path = None
+        if args.out_dir:
+            base = os.path.basename(file).rsplit(".", 1)[0]
+            out_path = os.path.join(args.out_dir, base + ".gcode")
+
+        reports.append(encoder.encode_file(file, out_path, verify=not args.no_verify))
+
+    print_report(reports)
+
+
+if __name__ == "__main__":
+    main()
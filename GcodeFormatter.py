@@ -0,0 +1,108 @@
+import numpy as np
+
+# ============================================================
+# Bulk G-code Formatting
+# ============================================================
+# Lines are assembled as a character matrix, one row per line and one column per character position, with 0 marking
+# positions a line does not use (leading zeros, absent words). Numbers are written in fixed point from integer
+# digits, so a whole block of lines costs a few array operations per character column instead of a Python string
+# format per number. Dropping the 0 cells row by row yields the finished text.
+
+ZERO = ord("0")
+MINUS = ord("-")
+POINT = ord(".")
+NEWLINE = ord("\n")
+
+
+def literal_field(text, count, present=None) -> np.ndarray:
+    """
+    ``text`` on each of ``count`` lines (only where ``present``).
+    """
+    field = np.tile(np.frombuffer(text.encode(), dtype=np.uint8), (count, 1))
+    if present is not None:
+        field[~np.asarray(present, dtype=bool)] = 0
+    return field
+
+
+def number_field(values, decimals, prefix="", present=None) -> np.ndarray:
+    """
+    ``prefix`` and each value written with exactly ``decimals`` decimals, as f"{value:.{decimals}f}" would (bar
+    negative zero, which is written as 0).
+    """
+    scaled = np.rint(np.asarray(values, dtype=np.float64) * 10 ** decimals).astype(np.int64)
+    count = len(scaled)
+    negative = scaled < 0
+    magnitude = np.abs(scaled)
+
+    largest = int(magnitude.max()) if count else 0
+    places = max(len(str(largest)), decimals + 1)
+
+    columns = []
+    if prefix:
+        columns.append(literal_field(prefix, count))
+    columns.append(np.where(negative, MINUS, 0).astype(np.uint8)[:, None])
+
+    for place in range(places - 1, -1, -1):
+        power = 10 ** place
+        digit = (magnitude // power % 10 + ZERO).astype(np.uint8)
+        if place > decimals:
+            # Leading zeros are left out, down to the units digit
+            digit[magnitude < power] = 0
+        columns.append(digit[:, None])
+        if place == decimals and decimals:
+            columns.append(np.full((count, 1), POINT, dtype=np.uint8))
+
+    field = np.hstack(columns)
+    if present is not None:
+        field[~np.asarray(present, dtype=bool)] = 0
+    return field
+
+
+def join_lines(fields) -> tuple:
+    """
+    The lines built from ``fields`` (matrices with one row per line) as text, newline terminated, and the offset
+    where each line starts in it (plus the end).
+    """
+    matrix = np.hstack(list(fields) + [np.full((len(fields[0]), 1), NEWLINE, dtype=np.uint8)])
+    used = matrix != 0
+    offsets = np.concatenate(([0], np.cumsum(used.sum(axis=1))))
+    return matrix[used].tobytes(), offsets
+
+
+# ============================================================
+# Streaming
+# ============================================================
+
+# Write buffer of streamed programs; chunks are written as they are generated
+WRITE_BUFFER = 1 << 20
+
+
+def split_lines(chunks):
+    """
+    The lines (str, without newlines) of a program given as text chunks, as the chunks come in.
+    """
+    rest = b""
+    for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line.decode()
+    if rest:
+        yield rest.decode()
+
+
+def write_chunks(chunks, path, buffering=WRITE_BUFFER) -> tuple:
+    """
+    Writes a program given as text chunks to ``path`` as the chunks come in. Returns its (lines, bytes).
+    """
+    lines = size = 0
+    last = b"\n"
+    with open(path, "wb", buffering=buffering) as f:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            f.write(chunk)
+            lines += chunk.count(b"\n")
+            size += len(chunk)
+            last = chunk
+    return lines + (not last.endswith(b"\n")), size
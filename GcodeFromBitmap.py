@@ -1,20 +1,44 @@
+import argparse
+import collections
+import itertools
 import os
 import glob
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 import numpy as np
 
+from Dithering import METHODS, dither_bands, dither_image
+from GcodeFormatter import join_lines, number_field, split_lines, write_chunks
+from JobEstimator import estimate_lines, format_duration, summarize
+from RasterPreprocess import SPOT_SIZE_MM, RasterPreprocessor
+
+
+PROGRAM_START = b"G90\nG21\nM5\n"  # absolute coordinates, mm units, laser off
+PROGRAM_END = b"G0 X0 Y0\nM5"
+
+# Parallel rastering: G-code text per pixel at worst (a move per pixel) plus the pixel, the tallest band handed to a
+# worker, and the default cap on the bands and G-code in flight
+BYTES_PER_PIXEL = 20
+MAX_BAND_ROWS = 256
+MEMORY_CAP_MB = 512
+
 
 # ---------------------------
 # GRBL Laser Gcode Generator with Dithering
 # ---------------------------
 
 class GRBLLaserRaster:
-    def __init__(self, max_power=1000, travel_speed=2000, burn_speed=1200, invert=False, dither=True):
+    def __init__(self, max_power=1000, travel_speed=2000, burn_speed=1200, invert=False, dither=True,
+                 dither_method="floyd-steinberg", skip_white=True, overscan=2.0, preprocessor=None):
         self.max_power = max_power
         self.travel_speed = travel_speed
         self.burn_speed = burn_speed
         self.invert = invert
         self.dither = dither
+        self.dither_method = dither_method
+        self.skip_white = skip_white  # travel over blank stretches and leave out blank rows
+        self.overscan = overscan      # mm run up before and after every burn span, at S0
+        self.preprocessor = preprocessor  # RasterPreprocessor resampling to the spot size, or None for native pixels
 
     def pixel_to_power(self, px):
         # px is 0..255 (0=black, 255=white)
@@ -22,93 +46,315 @@ class GRBLLaserRaster:
             px = 255 - px
         return int((1 - (px / 255)) * self.max_power)
 
+    def pixels_to_power(self, pixels):
+        # pixel_to_power for a whole array
+        pixels = np.asarray(pixels, dtype=np.float64)
+        if self.invert:
+            pixels = 255 - pixels
+        return ((1 - pixels / 255) * self.max_power).astype(np.int64)
+
     def apply_dithering(self, img):
-        arr = np.array(img, dtype=np.float32)
-        h, w = arr.shape
-
-        for y in range(h):
-            for x in range(w):
-                old_pixel = arr[y, x]
-                new_pixel = 0 if old_pixel < 128 else 255
-                arr[y, x] = new_pixel
-                quant_error = old_pixel - new_pixel
-                if x + 1 < w:
-                    arr[y, x + 1] += quant_error * 7 / 16
-                if y + 1 < h:
-                    if x > 0:
-                        arr[y + 1, x - 1] += quant_error * 3 / 16
-                    arr[y + 1, x] += quant_error * 5 / 16
-                    if x + 1 < w:
-                        arr[y + 1, x + 1] += quant_error * 1 / 16
-        arr = np.clip(arr, 0, 255)
-        return Image.fromarray(arr.astype(np.uint8))
-
-    def generate(self, img_path, output_path, mm_per_pixel=0.1):
-        img = Image.open(img_path).convert("L")  # grayscale
-
-        if self.dither:
-            img = self.apply_dithering(img)
-
-        width, height = img.size
-        print(f"Loaded {img_path}: {width}×{height}")
-
-        gcode = []
-        gcode.append("G90")  # absolute coordinates
-        gcode.append("G21")  # mm units
-        gcode.append("M5")   # laser off
-
-        for y in range(height):
-            row = [img.getpixel((x, y)) for x in range(width)]
-
-            # serpentine scanning
-            if y % 2 == 0:
-                x_range = range(width)
-            else:
-                x_range = range(width - 1, -1, -1)
-
-            x_mm_start = x_range.start * mm_per_pixel
-            y_mm = y * mm_per_pixel
-
-            gcode.append(f"G0 X{x_mm_start:.3f} Y{y_mm:.3f} F{self.travel_speed}")
-            gcode.append("M3 S0")
-            gcode.append(f"G1 F{self.burn_speed}")
-
-            for x in x_range:
-                px = row[x]
-                power = self.pixel_to_power(px)
-                x_mm = x * mm_per_pixel
-                gcode.append(f"G1 X{x_mm:.3f} S{power}")
-
-            gcode.append("M5")  # laser off at end of line
-
-        gcode.append("G0 X0 Y0")
-        gcode.append("M5")
+        return dither_image(img, self.dither_method)
+
+    def load(self, img_path, mm_per_pixel=0.1):
+        """
+        The grey levels of the image and the pitch (mm per pixel) to raster them at.
+        """
+        if self.preprocessor is None:
+            pixels = np.asarray(Image.open(img_path).convert("L"))  # grayscale
+        else:
+            pixels, mm_per_pixel = self.preprocessor.load(img_path, mm_per_pixel)
+
+        height, width = pixels.shape
+        print(f"Loaded {img_path}: {width}×{height} at {mm_per_pixel:.3f} mm")
+        return pixels, mm_per_pixel
+
+    def rows(self, pixels):
+        # The rows to raster, dithered band by band as they are taken if dithering is on
+        if not self.dither:
+            return iter(pixels)
+        return (row for band in dither_bands(pixels, self.dither_method) for row in band)
+
+    def bands(self, pixels, rows):
+        """
+        The rows to raster in bands of ``rows``. Dithering keeps to its own bands whatever ``rows`` is, so the
+        result does not depend on how the image is split up.
+        """
+        source = self.rows(pixels)
+        while True:
+            band = list(itertools.islice(source, rows))
+            if not band:
+                return
+            yield np.array(band)
+
+    def burn_spans(self, row, mm_per_pixel):
+        """
+        (first, last) pixel of every stretch of the row that burns. White gaps the overscan would cover anyway are
+        burned through at S0 rather than travelled over.
+        """
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], (row > 0).astype(np.int8), [0]))))
+        starts, ends = edges[::2], edges[1::2] - 1
+        if len(starts) > 1:
+            gaps = (starts[1:] - ends[:-1] - 1) * mm_per_pixel
+            keep = np.concatenate(([True], gaps > 2 * self.overscan))
+            starts = starts[keep]
+            ends = np.concatenate((ends[:-1][keep[1:]], ends[-1:]))
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def span_moves(self, row, first, last, step, mm_per_pixel, overscan):
+        """
+        X (mm), S and whether S has to be written for the moves across one span: the run up, one move per run of
+        equal power (S is modal, so it is only written when it changes) and the run out. Run ups and run outs stop
+        at X0, the homed corner, so spans near the left edge get shorter ones.
+        """
+        values = row[first:last + 1] if step == 1 else row[last:first + 1][::-1]
+        run_ends = np.append(np.flatnonzero(np.diff(values)), len(values) - 1)
+        powers = values[run_ends]
+        written = powers != np.concatenate(([0], powers[:-1]))
+        xs = (first + step * run_ends) * mm_per_pixel
+
+        if overscan:
+            entry_mm = max(0.0, (first - step) * mm_per_pixel)
+            exit_mm = max(0.0, last * mm_per_pixel + step * overscan)
+            xs = np.concatenate(([entry_mm], xs, [exit_mm]))
+            powers = np.concatenate(([0], powers, [0]))
+            written = np.concatenate(([False], written, [powers[-2] != 0]))
+        return xs, powers, written
+
+    def row_gcode(self, pixels, y, forward, mm_per_pixel=0.1) -> bytes:
+        """
+        The G-code of row ``y`` as text, scanned left to right if ``forward``; empty if the row is skipped.
+
+        The moves of a row are formatted together by GcodeFormatter, so the cost per move is a share of a few array
+        operations rather than a Python string format.
+        """
+        row = self.pixels_to_power(pixels)
+        width = len(row)
+        y_mm = y * mm_per_pixel
+
+        if not self.skip_white:
+            spans = [(0, width - 1)]
+            overscan = 0.0
+        else:
+            spans = self.burn_spans(row, mm_per_pixel)
+            overscan = self.overscan
+            if not spans:
+                return b""
+
+        # serpentine scanning
+        if not forward:
+            spans = [(last, first) for first, last in reversed(spans)]
+        step = 1 if forward else -1
+
+        # Each G1 burns the pixel it ends on, so a pixel is drawn by the move from its neighbour
+        moves = [self.span_moves(row, first, last, step, mm_per_pixel, overscan) for first, last in spans]
+        xs, powers, written = (np.concatenate(column) for column in zip(*moves))
+        text, offsets = join_lines((number_field(xs, 3, "G1 X"), number_field(powers, 0, " S", written)))
+        bounds = offsets[np.cumsum([0] + [len(span_xs) for span_xs, _, _ in moves])].tolist()
+
+        chunk = []
+        for (first, _), start, stop in zip(spans, bounds[:-1], bounds[1:]):
+            # Never left of X0, where the image's corner is homed
+            entry_mm = max(0.0, (first - step) * mm_per_pixel - step * overscan)
+            chunk.append(
+                f"G0 X{entry_mm:.3f} Y{y_mm:.3f} F{self.travel_speed}\nM3 S0\nG1 F{self.burn_speed}\n".encode()
+            )
+            chunk.append(text[start:stop])
+            chunk.append(b"M5\n")  # laser off at end of every span
+        return b"".join(chunk)
+
+    def drawn_rows(self, band) -> int:
+        # How many rows of a band are scanned, each of which turns the serpentine around
+        if not self.skip_white:
+            return len(band)
+        return int((self.pixels_to_power(band) > 0).any(axis=1).sum())
+
+    def band_gcode(self, band, top, forward, mm_per_pixel=0.1) -> bytes:
+        """
+        The G-code of a band of rows starting at row ``top``, its first scanned row going left to right if
+        ``forward``.
+        """
+        chunks = []
+        for y, pixels in enumerate(band, start=top):
+            chunk = self.row_gcode(pixels, y, forward, mm_per_pixel)
+            if chunk:
+                chunks.append(chunk)
+                forward = not forward
+        return b"".join(chunks)
+
+    def raster_rows(self, rows, mm_per_pixel=0.1):
+        """
+        The G-code of the grey level ``rows`` (a 2-D array, or any iterable of rows, top first) as text: the program
+        start, one chunk per row that burns, and the program end. Chunks are generated as they are taken, so only the
+        row at hand is ever held as power or text.
+        """
+        yield PROGRAM_START
+
+        forward = True
+        for y, pixels in enumerate(rows):
+            chunk = self.row_gcode(pixels, y, forward, mm_per_pixel)
+            if chunk:
+                yield chunk
+                forward = not forward
+
+        yield PROGRAM_END
+
+    def raster_bands(self, pixels, mm_per_pixel=0.1, workers=None, memory_cap=MEMORY_CAP_MB):
+        """
+        raster_rows for a whole image, in horizontal bands spread over a pool of ``workers`` processes (default: one
+        per core). Bands are dithered here, in order, so error diffusion carries its error across the seams; each
+        band's scan direction follows from the rows before it, so the workers encode bands independently and their
+        chunks are yielded in order, giving the same program as raster_rows.
+
+        Band height and the number of bands in flight are chosen so the bands and their G-code stay within
+        ``memory_cap`` MB.
+        """
+        workers = workers or os.cpu_count() or 1
+        band_rows, in_flight = band_plan(pixels.shape[1], workers, memory_cap)
+
+        yield PROGRAM_START
+
+        pending = collections.deque()
+        forward = True
+        top = 0
+        with ProcessPoolExecutor(workers) as pool:
+            for band in self.bands(pixels, band_rows):
+                if len(pending) >= in_flight:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(_band_gcode, self, band, top, forward, mm_per_pixel))
+                forward ^= self.drawn_rows(band) % 2 == 1
+                top += len(band)
+
+            while pending:
+                yield pending.popleft().result()
+
+        yield PROGRAM_END
+
+    def program(self, pixels, mm_per_pixel=0.1, workers=1, memory_cap=MEMORY_CAP_MB):
+        # The G-code chunks of an image, rastered here or, for more than one worker, in a process pool
+        if workers == 1:
+            return self.raster_rows(self.rows(pixels), mm_per_pixel)
+        return self.raster_bands(pixels, mm_per_pixel, workers, memory_cap)
+
+    def raster_lines(self, rows, mm_per_pixel=0.1):
+        # The G-code one line at a time, e.g. to stream to the machine while later rows are still being rastered
+        return split_lines(self.raster_rows(rows, mm_per_pixel))
+
+    def generate(self, img_path, output_path, mm_per_pixel=0.1, report=False, workers=1, memory_cap=MEMORY_CAP_MB):
+        pixels, mm_per_pixel = self.load(img_path, mm_per_pixel)
 
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w") as f:
-            f.write("\n".join(gcode))
+        lines, size = write_chunks(self.program(pixels, mm_per_pixel, workers, memory_cap), output_path)
+        print(f"Saved: {output_path} ({lines} lines, {size} bytes)")
+
+        if report and self.skip_white:
+            self.report_savings(pixels, output_path, mm_per_pixel)
+
+        return lines, size
+
+    def report_savings(self, pixels, output_path, mm_per_pixel):
+        # Machine time of this job against scanning every pixel, according to JobEstimator
+        # (the estimator plans over the whole program, so this holds both in memory)
+        full_scan = GRBLLaserRaster(self.max_power, self.travel_speed, self.burn_speed, self.invert, skip_white=False)
+        before = summarize(estimate_lines(list(full_scan.raster_lines(self.rows(pixels), mm_per_pixel))))
+        with open(output_path) as f:
+            after = summarize(estimate_lines(f.read().split("\n")))
+        saved = before["total"] - after["total"]
+        print(
+            f"Estimated {format_duration(after['total'])} instead of {format_duration(before['total'])} "
+            f"scanning every pixel: {format_duration(saved)} saved ({saved / max(before['total'], 1e-9):.0%})"
+        )
 
-        print(f"Saved: {output_path}")
+
+def _band_gcode(raster, band, top, forward, mm_per_pixel):
+    # Runs in the pool processes
+    return raster.band_gcode(band, top, forward, mm_per_pixel)
+
+
+def band_plan(width, workers, memory_cap=MEMORY_CAP_MB) -> tuple:
+    """
+    (rows per band, bands in flight) for an image ``width`` pixels wide: two bands per worker, so none waits while
+    the finished ones are written, each as tall as the memory cap allows for them all, up to MAX_BAND_ROWS.
+    """
+    band_bytes = width * BYTES_PER_PIXEL
+    in_flight = 2 * workers
+    band_rows = int(min(MAX_BAND_ROWS, max(1, memory_cap * 2 ** 20 // (in_flight * band_bytes))))
+    in_flight = int(max(1, min(in_flight, memory_cap * 2 ** 20 // (band_rows * band_bytes))))
+    return band_rows, in_flight
 
 
 # ---------------------------
 # Batch Convert Bitmaps
 # ---------------------------
 
-raster = GRBLLaserRaster(
-    max_power=60,       # GRBL S-value max
-    travel_speed=2000,   # G0 speed
-    burn_speed=2000,     # G1 speed for engraving
-    invert=True,         # for wood engraving
-    dither=True          # enable dithering
-)
-
-files = glob.glob("./original/*.png") + \
-        glob.glob("./original/*.jpg") + \
-        glob.glob("./original/*.jpeg") + \
-        glob.glob("./original/*.bmp")
-
-for file in files:
-    name = os.path.basename(file).rsplit(".", 1)[0]
-    out = f"./sliced/{name}.gcode"
-    raster.generate(file, out, mm_per_pixel=0.1)
+def send_rasters(raster, files, port, mm_per_pixel=0.1, workers=1):
+    """
+    Streams the raster of each file straight to the machine: the sender takes lines as the raster generates them,
+    so the first rows burn while the rest are still being computed, and no file is written.
+    """
+    from SendTUI import SerialCommunicator
+
+    serial_comm = SerialCommunicator(port)
+    try:
+        for file in files:
+            pixels, pitch = raster.load(file, mm_per_pixel)
+            counts = serial_comm.stream(split_lines(raster.program(pixels, pitch, workers)))
+            print(f"Sent {file}: {counts['ok']} lines, {counts['bytes']} bytes"
+                  f"{', %d errors' % counts['errors'] if counts['errors'] else ''}"
+                  f"{', aborted' if counts['aborted'] else ''}")
+            if counts["aborted"]:
+                break
+    finally:
+        serial_comm.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raster every bitmap in ./original to G-code in ./sliced")
+    parser.add_argument("--dither", choices=METHODS, default="floyd-steinberg")
+    parser.add_argument(
+        "--overscan", type=float, default=2.0, help="run up before and after each burn (mm), cut short at X0"
+    )
+    parser.add_argument("--full-scan", action="store_true", help="scan every pixel, white included, from X0")
+    parser.add_argument("--report", action="store_true", help="estimate the machine time saved by skipping white")
+    parser.add_argument("--send", metavar="PORT", help="stream each raster to the GRBL on PORT as it is generated")
+    parser.add_argument("--workers", type=int, default=1, help="processes rastering bands in parallel (0: one per core)")
+    parser.add_argument("--memory-cap", type=float, default=MEMORY_CAP_MB, help="MB of bands and G-code in flight")
+    parser.add_argument("--width", type=float, help="engraving width (mm, default: 0.1 mm per image pixel)")
+    parser.add_argument("--spot", type=float, default=SPOT_SIZE_MM, help="laser spot size (mm)")
+    parser.add_argument("--gamma", type=float, default=1.0, help="above 1 darkens the mid tones")
+    parser.add_argument("--contrast", type=float, default=1.0)
+    parser.add_argument("--native", action="store_true", help="raster every image pixel, without resampling")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    raster = GRBLLaserRaster(
+        max_power=60,       # GRBL S-value max
+        travel_speed=2000,   # G0 speed
+        burn_speed=2000,     # G1 speed for engraving
+        invert=True,         # for wood engraving
+        dither=True,         # enable dithering
+        dither_method=args.dither,
+        skip_white=not args.full_scan,
+        overscan=args.overscan,
+        preprocessor=None if args.native else RasterPreprocessor(
+            args.width, spot_size=args.spot, gamma=args.gamma, contrast=args.contrast
+        ),
+    )
+
+    files = glob.glob("./original/*.png") + \
+            glob.glob("./original/*.jpg") + \
+            glob.glob("./original/*.jpeg") + \
+            glob.glob("./original/*.bmp")
+
+    if args.send:
+        send_rasters(raster, files, args.send, mm_per_pixel=0.1, workers=workers)
+        return
+
+    for file in files:
+        name = os.path.basename(file).rsplit(".", 1)[0]
+        out = f"./sliced/{name}.gcode"
+        raster.generate(file, out, mm_per_pixel=0.1, report=args.report, workers=workers, memory_cap=args.memory_cap)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,22 @@
+import argparse
 import os
 import glob
 from PIL import Image
 import numpy as np
 import math
+import itertools
+
+from Dithering import dither_bands, dither_image
+from GcodeFormatter import join_lines, number_field, write_chunks
+from GrblRealtime import PLANNER_BLOCKS
+from MotionPlanner import DEFAULT_PROFILE
+from RasterPreprocess import RasterPreprocessor
+
+# Adaptive sampling: largest distance between the wave and its chords (mm; waves this low are drawn flat). GRBL's
+# planner buffer (PLANNER_BLOCKS) has to hold enough moves to stop in, which caps the samples per cycle; where the cap
+# wins, speed is kept over shape and the wave strays further (0.1 mm at 2000 mm/min and 15 cycles/mm). generate
+# reports it when that happens.
+CHORD_TOLERANCE = 0.02
 
 
 # ---------------------------
@@ -20,7 +34,12 @@ class GRBLLaserRaster:
             max_amplitude=0.5,      # mm of wave height
             frequency=15,           # wave cycles per mm
             steps_per_pixel=3,      # micro-segments for smooth waves
-            constant_power=120      # S value for the whole burn
+            constant_power=120,     # S value for the whole burn
+            dither_method="floyd-steinberg",
+            preprocessor=None,      # RasterPreprocessor resampling to the spot size, or None for native pixels
+            adaptive=False,         # sample by amplitude instead of steps_per_pixel, see adaptive_wave_rows
+            tolerance=CHORD_TOLERANCE,
+            profile=None            # MotionPlanner profile of the machine, for its acceleration
     ):
         self.max_power = max_power
         self.travel_speed = travel_speed
@@ -31,29 +50,15 @@ class GRBLLaserRaster:
         self.frequency = frequency
         self.steps_per_pixel = steps_per_pixel
         self.constant_power = constant_power
+        self.dither_method = dither_method
+        self.preprocessor = preprocessor
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.profile = profile or DEFAULT_PROFILE
 
-    # Floyd–Steinberg dithering (optional)
+    # Dithering (optional): error diffusion, Bayer or blue noise, see Dithering.METHODS
     def apply_dithering(self, img):
-        arr = np.array(img, dtype=np.float32)
-        h, w = arr.shape
-
-        for y in range(h):
-            for x in range(w):
-                old_pixel = arr[y, x]
-                new_pixel = 0 if old_pixel < 128 else 255
-                arr[y, x] = new_pixel
-                quant_error = old_pixel - new_pixel
-                if x + 1 < w:
-                    arr[y, x + 1] += quant_error * 7 / 16
-                if y + 1 < h:
-                    if x > 0:
-                        arr[y + 1, x - 1] += quant_error * 3 / 16
-                    arr[y + 1, x] += quant_error * 5 / 16
-                    if x + 1 < w:
-                        arr[y + 1, x + 1] += quant_error * 1 / 16
-
-        arr = np.clip(arr, 0, 255)
-        return Image.fromarray(arr.astype(np.uint8))
+        return dither_image(img, self.dither_method)
 
     # Convert pixel brightness → amplitude
     def brightness_to_amplitude(self, px):
@@ -62,84 +67,253 @@ class GRBLLaserRaster:
         # dark = max amplitude / bright = small amplitude
         return self.max_amplitude * (1 - px / 255)
 
+    def brightness_to_amplitudes(self, pixels):
+        # brightness_to_amplitude for a whole array
+        pixels = np.asarray(pixels, dtype=np.float64)
+        if self.invert:
+            pixels = 255 - pixels
+        return self.max_amplitude * (1 - pixels / 255)
+
     # Sinusoidal G-code generator
-    def generate(self, img_path, output_path, mm_per_pixel=0.1):
-        img = Image.open(img_path).convert("L")
+    def wave_rows(self, rows, mm_per_pixel=0.1):
+        """
+        The G-code of the grey level ``rows`` (a 2-D array, or any iterable of equally long rows, top first) as
+        text: the program start, one chunk per row and the program end, each generated as it is taken.
 
-        if self.dither:
-            img = self.apply_dithering(img)
+        Every row crosses the same micro-step positions, so their X words and the sine at each are worked out once;
+        per row only Y is computed, for the whole row at a time, and formatted by GcodeFormatter.
+        """
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            yield b"G90\nG21\nM5\nG0 X0 Y0\nM5"
+            return
+        width = len(first_row)
+        steps = self.steps_per_pixel
 
-        width, height = img.size
-        print(f"Loaded {img_path}: {width}×{height}")
+        # Micro-step positions in forward order, and their order on the way back (pixels reversed, the steps
+        # within each pixel still forward)
+        columns = np.repeat(np.arange(width), steps)
+        x_mm = (columns + np.tile(np.arange(steps) / steps, width)) * mm_per_pixel
+        sine = np.sin(2 * math.pi * self.frequency * x_mm)
+        backward = (np.arange(width - 1, -1, -1)[:, None] * steps + np.arange(steps)).ravel()
+        x_words = number_field(x_mm, 4, "G1 X")
+        orders = ((np.arange(len(x_mm)), x_words), (backward, x_words[backward]))
 
-        g = []
-        g.append("G90")
-        g.append("G21")
-        g.append("M5")
+        yield b"G90\nG21\nM5\n"
 
-        for y in range(height):
+        for y, pixels in enumerate(itertools.chain((first_row,), rows)):
             # serpentine scanning
-            if y % 2 == 0:
-                x_pixels = range(width)
-            else:
-                x_pixels = range(width - 1, -1, -1)
+            order, row_x_words = orders[y % 2]
+            y_base = y * mm_per_pixel
+            start_x_mm = (0 if y % 2 == 0 else width - 1) * mm_per_pixel
+
+            # Sine wave vertical displacement, dark = large amplitude
+            y_mm = y_base + self.brightness_to_amplitudes(pixels)[columns[order]] * sine[order]
+            text, _ = join_lines((row_x_words, number_field(y_mm, 4, " Y")))
+            yield self.row_chunk(start_x_mm, y_base, text)
+
+        yield b"G0 X0 Y0\nM5"
+
+    def row_chunk(self, start_x_mm, y_base, moves) -> bytes:
+        return b"".join((
+            f"G0 X{start_x_mm:.3f} Y{y_base:.3f} F{self.travel_speed}\n".encode(),
+            f"M3 S{self.constant_power}\nG1 F{self.burn_speed}\n".encode(),
+            moves,
+            b"M5\n",  # end of row
+        ))
+
+    # Adaptive sampling
+    def samples_per_cycle(self, amplitudes):
+        """
+        Samples per wave cycle for each amplitude, 0 for waves within the tolerance of a straight line.
+
+        A chord of length h across a curve of curvature A k^2 strays from it by A k^2 h^2 / 8, so the tolerance
+        needs 2 pi sqrt(A / (8 tol)) samples per cycle, whatever the frequency. Moves are kept long enough that the
+        planner buffer holds the distance to stop from the burn feed, v^2 / (2 a), as GRBL slows down to keep
+        that true when moves get shorter. Counts are even, at least 2, so samples land on the crests.
+        """
+        amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        speed = self.burn_speed / 60
+        acceleration = min(self.profile["acceleration"][:2])
+        shortest = speed * speed / (2 * acceleration * (PLANNER_BLOCKS - 1))
+
+        needed = 2 * math.pi * np.sqrt(amplitudes / (8 * self.tolerance))
+        affordable = 1 / (self.frequency * shortest)
+        samples = 2 * np.ceil(np.maximum(2, np.minimum(needed, affordable)) / 2)
+        return np.where(amplitudes > self.tolerance, samples, 0).astype(np.int64)
+
+    def chord_deviation(self, amplitudes):
+        """
+        How far the sampled wave strays from the sine at each amplitude: the whole amplitude where it is drawn
+        flat, otherwise the largest gap between the sine and the chords of its sample grid.
+        """
+        amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        counts = self.samples_per_cycle(amplitudes)
+        deviation = np.where(counts > 0, 0.0, amplitudes)
+
+        t = np.linspace(0, 1, 65)
+        for count in np.unique(counts[counts > 0]):
+            # One cycle of the grid, crests on it, in radians
+            start = 2 * math.pi * (np.arange(count)[:, None] + count / 4) / count
+            end = start + 2 * math.pi / count
+            x = start + t * (end - start)
+            chord = np.sin(start) + t * (np.sin(end) - np.sin(start))
+            deviation[counts == count] = amplitudes[counts == count] * np.abs(np.sin(x) - chord).max()
+        return deviation
+
+    def adaptive_samples(self, amplitudes, mm_per_pixel=0.1) -> tuple:
+        """
+        X (mm, ascending) of the samples along one row and the amplitude at each. Each pixel gets its share of a
+        grid with the samples per cycle its amplitude needs, in phase with the wave so the crests are on it, and a
+        sample at its edge where that changes. Where the amplitude jumps by more than the tolerance, the edge gets
+        two samples, with the old amplitude and the new, so the wave steps there as the pixels do. Runs of flat
+        pixels become one move.
+
+        A white run ends flat at its right edge, before the wave of the dark pixel after it starts:
 
+        >>> raster = GRBLLaserRaster(frequency=1)
+        >>> x_mm, amplitudes = raster.adaptive_samples(raster.brightness_to_amplitudes([255] * 21 + [0] * 3), 0.15)
+        >>> [(round(float(x), 2), float(a)) for x, a in zip(x_mm[:3], amplitudes[:3])]
+        [(0.0, 0.0), (3.15, 0.0), (3.15, 0.5)]
+        """
+        amplitudes = np.where(amplitudes > self.tolerance, amplitudes, 0.0)
+        width = len(amplitudes)
+        counts_per_cycle = self.samples_per_cycle(amplitudes)
+        jumps = np.zeros(width, dtype=np.int64)
+        jumps[1:] = np.abs(np.diff(amplitudes)) > self.tolerance
+
+        # Edges also get a sample where the grid changes, or the chord across would span a step of each grid
+        edges = jumps.copy()
+        edges[0] = 1
+        edges[1:] |= np.diff(counts_per_cycle) != 0
+
+        # Grid points j lie at x = (j + n / 4) / (f n); those inside each pixel, its left edge only if it has no
+        # edge sample
+        density = self.frequency * counts_per_cycle
+        quarter = counts_per_cycle / 4
+        left = np.arange(width) * mm_per_pixel
+        first = np.where(edges == 1, np.floor(left * density - quarter + 1e-9) + 1,
+                         np.ceil(left * density - quarter - 1e-9))
+        last = np.ceil((left + mm_per_pixel) * density - quarter - 1e-9) - 1
+        inside = np.where(counts_per_cycle > 0, np.maximum(0, last - first + 1), 0).astype(np.int64)
+
+        # Per pixel: the end of the old wave where it jumps, its own edge sample, then its grid points
+        counts = jumps + edges + inside
+        pixel = np.repeat(np.arange(width), counts)
+        index = np.arange(len(pixel)) - np.repeat(np.cumsum(counts) - counts, counts)
+        before = index < jumps[pixel]
+        on_edge = index < jumps[pixel] + edges[pixel]
+        grid = first[pixel] + index - jumps[pixel] - edges[pixel]
+        x_mm = np.where(on_edge, left[pixel], (grid + quarter[pixel]) / np.maximum(density[pixel], 1e-300))
+
+        x_mm = np.append(x_mm, width * mm_per_pixel)
+        sample_amplitudes = np.append(amplitudes[np.where(before, pixel - 1, pixel)], amplitudes[-1])
+
+        # Only the ends of a flat stretch are needed
+        flat = sample_amplitudes == 0
+        keep = np.ones(len(x_mm), dtype=bool)
+        keep[1:-1] = ~(flat[:-2] & flat[1:-1] & flat[2:])
+        return x_mm[keep], sample_amplitudes[keep]
+
+    def adaptive_wave_rows(self, rows, mm_per_pixel=0.1):
+        """
+        wave_rows with samples placed by adaptive_samples: dark pixels get the samples their curvature needs,
+        light ones fewer and white stretches a single move. Rows on the way back are the same path reversed.
+        """
+        yield b"G90\nG21\nM5\n"
+
+        wavenumber = 2 * math.pi * self.frequency
+        for y, pixels in enumerate(rows):
+            x_mm, amplitudes = self.adaptive_samples(self.brightness_to_amplitudes(pixels), mm_per_pixel)
             y_base = y * mm_per_pixel
+            y_mm = y_base + amplitudes * np.sin(wavenumber * x_mm)
 
-            start_x_mm = x_pixels.start * mm_per_pixel
-            g.append(f"G0 X{start_x_mm:.3f} Y{y_base:.3f} F{self.travel_speed}")
-            g.append(f"M3 S{self.constant_power}")
-            g.append(f"G1 F{self.burn_speed}")
+            # Both samples of a jump on a node of the wave are the same point
+            keep = np.ones(len(x_mm), dtype=bool)
+            keep[1:] = (np.diff(x_mm) != 0) | (np.diff(y_mm) != 0)
+            x_mm, y_mm = x_mm[keep], y_mm[keep]
 
-            for x in x_pixels:
-                px = img.getpixel((x, y))
-                amplitude = self.brightness_to_amplitude(px)
+            # serpentine scanning
+            if y % 2:
+                x_mm, y_mm = x_mm[::-1], y_mm[::-1]
 
-                # Break each pixel into micro-moves with sine displacement
-                for s in range(self.steps_per_pixel):
-                    t = s / self.steps_per_pixel
-                    x_mm = (x + t) * mm_per_pixel
+            text, _ = join_lines((number_field(x_mm[1:], 4, "G1 X"), number_field(y_mm[1:], 4, " Y")))
+            yield self.row_chunk(x_mm[0], y_base, text)
 
-                    # Sine wave vertical displacement
-                    y_mm = y_base + amplitude * math.sin(
-                        2 * math.pi * self.frequency * x_mm
-                    )
+        yield b"G0 X0 Y0\nM5"
 
-                    g.append(f"G1 X{x_mm:.4f} Y{y_mm:.4f}")
+    def report_deviation(self, levels):
+        # Warns when the planner buffer's cap on samples per cycle keeps the waves of these grey levels from the
+        # tolerance
+        amplitudes = self.brightness_to_amplitudes(levels)
+        deviation = self.chord_deviation(amplitudes)
+        worst = int(np.argmax(deviation))
+        if deviation[worst] > self.tolerance:
+            samples = int(self.samples_per_cycle(amplitudes[worst:worst + 1])[0])
+            print(
+                f"Warning: at {self.burn_speed} mm/min the planner buffer allows {samples} samples per cycle; "
+                f"the waves stray up to {deviation[worst]:.3f} mm, over the {self.tolerance} mm tolerance. "
+                f"A lower burn speed keeps to it."
+            )
 
-            g.append("M5")  # end of row
+    def generate(self, img_path, output_path, mm_per_pixel=0.1):
+        if self.preprocessor is None:
+            rows = np.asarray(Image.open(img_path).convert("L"))
+        else:
+            rows, mm_per_pixel = self.preprocessor.load(img_path, mm_per_pixel)
 
-        g.append("G0 X0 Y0")
-        g.append("M5")
+        height, width = rows.shape
+        print(f"Loaded {img_path}: {width}×{height} at {mm_per_pixel:.3f} mm")
+
+        if self.adaptive:
+            self.report_deviation(np.array([0, 255]) if self.dither else np.unique(rows))
+
+        # Dithered band by band as the rows are taken
+        if self.dither:
+            rows = (row for band in dither_bands(rows, self.dither_method) for row in band)
 
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w") as f:
-            f.write("\n".join(g))
+        wave_rows = self.adaptive_wave_rows if self.adaptive else self.wave_rows
+        lines, size = write_chunks(wave_rows(rows, mm_per_pixel), output_path)
 
-        print(f"Saved: {output_path}")
+        print(f"Saved: {output_path} ({lines} lines, {size} bytes)")
 
 
 # ---------------------------
 # Batch Convert Bitmaps
 # ---------------------------
 
-raster = GRBLLaserRaster(
-    constant_power=200,     # GRBL S-value constant
-    travel_speed=2000,
-    burn_speed=2000,
-    invert=True,
-    dither=False,          # dithering optional
-    max_amplitude=0.5,     # bigger waves = darker burn
-    frequency=15,          # wave frequency
-    steps_per_pixel=3
-)
-
-files = glob.glob("./original/*.png") + \
-        glob.glob("./original/*.jpg") + \
-        glob.glob("./original/*.jpeg") + \
-        glob.glob("./original/*.bmp")
-
-for file in files:
-    name = os.path.basename(file).rsplit(".", 1)[0]
-    out = f"./sliced/{name}.gcode"
-    raster.generate(file, out, mm_per_pixel=0.3)
+def main():
+    parser = argparse.ArgumentParser(description="Engrave every bitmap in ./original as sine waves, G-code in ./sliced")
+    parser.add_argument("--adaptive", action="store_true", help="sample the waves by amplitude and curvature")
+    parser.add_argument("--tolerance", type=float, default=CHORD_TOLERANCE, help="chord tolerance (mm)")
+    args = parser.parse_args()
+
+    raster = GRBLLaserRaster(
+        constant_power=200,     # GRBL S-value constant
+        travel_speed=2000,
+        burn_speed=2000,
+        invert=True,
+        dither=False,          # dithering optional
+        max_amplitude=0.5,     # bigger waves = darker burn
+        frequency=15,          # wave frequency
+        steps_per_pixel=3,
+        preprocessor=RasterPreprocessor(),  # fit to the bed, no finer than the spot
+        adaptive=args.adaptive,
+        tolerance=args.tolerance,
+    )
+
+    files = glob.glob("./original/*.png") + \
+            glob.glob("./original/*.jpg") + \
+            glob.glob("./original/*.jpeg") + \
+            glob.glob("./original/*.bmp")
+
+    for file in files:
+        name = os.path.basename(file).rsplit(".", 1)[0]
+        out = f"./sliced/{name}.gcode"
+        raster.generate(file, out, mm_per_pixel=0.3)
+
+
+if __name__ == "__main__":
+    main()
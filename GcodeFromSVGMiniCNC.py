@@ -4,10 +4,14 @@ import os.path
 import typing
 import warnings
 
+import numpy as np
 from svg_to_gcode.svg_parser import parse_file
 from svg_to_gcode.geometry import Vector, Curve, LineSegmentChain
 from svg_to_gcode import UNITS, TOLERANCES
 
+from CurveFlattener import flatten_curves, line_chains, polyline_chains
+from HatchFill import DEFAULT_ANGLE, DEFAULT_SPACING, closed_loops, hatch_lines
+
 
 # ============================================================
 # Base Interface
@@ -146,10 +150,7 @@ class Compiler:
 
     def append_curves(self, curves: typing.List[Curve]):
 
-        for curve in curves:
-            line_chain = LineSegmentChain()
-            approximation = LineSegmentChain.line_segment_approximation(curve)
-            line_chain.extend(approximation)
+        for line_chain in line_chains(curves, TOLERANCES["approximation"]):
             self.append_line_chain(line_chain)
 
     def _reverse_chain(self, chain: LineSegmentChain) -> LineSegmentChain:
@@ -174,57 +175,60 @@ class Compiler:
         if not chains:
             return []
 
-        remaining = chains[:]
-        ordered = []
+        # Both ends of every chain, start then end, so the nearest is found with one array operation per step
+        starts = np.array([complex(chain.get(0).start.x, chain.get(0).start.y) for chain in chains])
+        ends = np.array([complex(chain.get(-1).end.x, chain.get(-1).end.y) for chain in chains])
+        candidates = np.column_stack((starts, ends)).ravel()
+        used = np.zeros(len(chains), dtype=bool)
 
         # Start with first chain
-        current = remaining.pop(0)
-        ordered.append(current)
+        used[0] = True
+        ordered = [chains[0]]
+        current_pos = ends[0]
 
-        current_pos = current.get(-1).end
+        for _ in range(len(chains) - 1):
+            distances = np.abs(candidates - current_pos)
+            distances[np.repeat(used, 2)] = np.inf
 
-        while remaining:
-            best_index = None
-            best_distance = float("inf")
-            reverse_chain = False
+            # First of the nearest, as a scan over the chains in order would find
+            best_index, reverse_chain = divmod(int(np.argmin(distances)), 2)
+            used[best_index] = True
 
-            for i, chain in enumerate(remaining):
-                start = chain.get(0).start
-                end = chain.get(-1).end
+            next_chain = chains[best_index]
+            if reverse_chain:
+                next_chain = self._reverse_chain(next_chain)
+                current_pos = starts[best_index]
+            else:
+                current_pos = ends[best_index]
 
-                dist_to_start = abs(current_pos - start)
-                dist_to_end = abs(current_pos - end)
+            ordered.append(next_chain)
 
-                if dist_to_start < best_distance:
-                    best_distance = dist_to_start
-                    best_index = i
-                    reverse_chain = False
+        return ordered
 
-                if dist_to_end < best_distance:
-                    best_distance = dist_to_end
-                    best_index = i
-                    reverse_chain = True
+    def append_chains_optimized(self, chains: typing.List[LineSegmentChain]):
 
-            next_chain = remaining.pop(best_index)
+        for chain in self._optimize_chain_order([chain for chain in chains if chain.chain_size() > 0]):
+            self.append_line_chain(chain)
 
-            if reverse_chain:
-                next_chain = self._reverse_chain(next_chain)
+    def append_hatch_fill(self, polygons, spacing=DEFAULT_SPACING, angle=DEFAULT_ANGLE):
 
-            ordered.append(next_chain)
-            current_pos = next_chain.get(-1).end
+        # Columns of serpentine hatch lines, ordered like any other chains
+        self.append_chains_optimized(polyline_chains(hatch_lines(polygons, spacing, angle)))
 
-        return ordered
+    def append_curves_filled(self, curves: typing.List[Curve], spacing=DEFAULT_SPACING, angle=DEFAULT_ANGLE):
+
+        # Paths that close on themselves, filled even-odd together
+        polygons = closed_loops(flatten_curves(curves, TOLERANCES["approximation"]), TOLERANCES["input"])
+        self.append_hatch_fill(polygons, spacing, angle)
 
     def append_curves_optimized(self, curves: typing.List[Curve]):
 
         # Convert all curves to line chains
-        chains = []
-        for curve in curves:
-            line_chain = LineSegmentChain()
-            approximation = LineSegmentChain.line_segment_approximation(curve)
-            line_chain.extend(approximation)
-            if line_chain.chain_size() > 0:
-                chains.append(line_chain)
+        chains = [
+            line_chain
+            for line_chain in line_chains(curves, TOLERANCES["approximation"])
+            if line_chain.chain_size() > 0
+        ]
 
         # Reorder chains
         ordered = self._optimize_chain_order(chains)
@@ -401,11 +405,19 @@ CONFIG_ENGRAVE = {
     "pass_depth": 0,
     "laser_power": 0.4,
     "dwell_time": 0,
+    "hatch_spacing": None,  # mm between fill lines, None to engrave outlines only
+    "hatch_angle": DEFAULT_ANGLE,
+}
+
+CONFIG_FILL = {
+    **CONFIG_ENGRAVE,
+    "hatch_spacing": DEFAULT_SPACING,
 }
 
 SUFFIX_CONFIG_MAP = {
     ".CUT.svg": CONFIG_CUT,
     ".ENGRAVE.svg": CONFIG_ENGRAVE,
+    ".FILL.svg": CONFIG_FILL,
 }
 
 
@@ -416,8 +428,6 @@ SUFFIX_CONFIG_MAP = {
 INPUT_DIR = "./original"
 OUTPUT_DIR = "./sliced"
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
 
 def build_compiler(config):
     interface = GRBLLaserInterface()
@@ -450,6 +460,8 @@ def process_file(file_path, config):
 
     compiler = build_compiler(config)
     compiler.clear_curves()
+    if config.get("hatch_spacing"):
+        compiler.append_curves_filled(curves, config["hatch_spacing"], config["hatch_angle"])
     compiler.append_curves_optimized(curves)
 
     base = os.path.basename(file_path)
@@ -514,9 +526,16 @@ def visualize_chains(chains):
 # Main
 # ============================================================
 
-for suffix, config in SUFFIX_CONFIG_MAP.items():
-    pattern = os.path.join(INPUT_DIR, f"*{suffix}")
-    for file in glob.glob(pattern):
-        process_file(file, config)
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    for suffix, config in SUFFIX_CONFIG_MAP.items():
+        pattern = os.path.join(INPUT_DIR, f"*{suffix}")
+        for file in glob.glob(pattern):
+            process_file(file, config)
+
+    print("\nAll files processed.")
+
 
-print("\nAll files processed.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import re
+import typing
+from decimal import Decimal
+
+from MotionPlanner import arc_points
+
+
+# ============================================================
+# Word Tables
+# ============================================================
+
+AXES = ("X", "Y", "Z")
+ARC_WORDS = ("I", "J", "K", "R")
+
+MOTION_CODES = {"G0", "G1", "G2", "G3"}
+DISTANCE_CODES = {"G90", "G91"}
+
+# Modal words that do not change where coordinates land. They are kept as-is and never make a line opaque.
+PASSIVE_CODES = {"G17", "G21", "G40", "G49", "G80", "G91.1"}
+
+KNOWN_G_CODES = MOTION_CODES | DISTANCE_CODES | PASSIVE_CODES | {"G4", "G93", "G94"}
+KNOWN_M_CODES = {"M3", "M4", "M5"}
+KNOWN_PARAMS = set(AXES) | set(ARC_WORDS) | {"F", "S", "P"}
+
+WORD_RE = re.compile(r"([A-Za-z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+COMMENT_RE = re.compile(r"\([^)]*\)|;.*$")
+
+
+def format_number(value, strip_leading_zero=False) -> str:
+    """
+    Formats a number with no trailing zeros, no trailing point and no negative zero.
+    """
+    if not isinstance(value, Decimal):
+        value = Decimal(repr(float(value)))
+
+    if value == 0:
+        return "0"
+
+    text = format(value, "f")
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+
+    if strip_leading_zero:
+        if text.startswith("0."):
+            text = text[1:]
+        elif text.startswith("-0."):
+            text = "-" + text[2:]
+
+    return text
+
+
+# ============================================================
+# Parsing
+# ============================================================
+
+class Block:
+    """
+    One line of G-code broken into words.
+
+    ``system`` holds lines that are passed to the controller verbatim ($ commands and anything the tokenizer could
+    not split into words). ``words`` keeps the source order with line numbers removed.
+    """
+
+    __slots__ = ("text", "system", "words", "g_codes", "m_codes", "params")
+
+    def __init__(self, text, system=None, words=None):
+        self.text = text
+        self.system = system
+        self.words = words or []
+        self.g_codes = []
+        self.m_codes = []
+        self.params = {}
+
+        for letter, value in self.words:
+            if letter == "G":
+                self.g_codes.append("G" + format_number(value))
+            elif letter == "M":
+                self.m_codes.append("M" + format_number(value))
+            else:
+                self.params[letter] = value
+
+    @property
+    def empty(self):
+        return self.system is None and not self.words
+
+    def axis_words(self):
+        return {axis: self.params[axis] for axis in AXES if axis in self.params}
+
+    def is_opaque(self):
+        """
+        True when the line uses words whose effect on positions the interpreter does not model.
+        """
+        if self.system is not None:
+            return True
+
+        if any(code not in KNOWN_G_CODES for code in self.g_codes):
+            return True
+
+        if any(code not in KNOWN_M_CODES for code in self.m_codes):
+            return True
+
+        if any(letter not in KNOWN_PARAMS for letter in self.params):
+            return True
+
+        letters = [letter for letter, _ in self.words if letter not in "GM"]
+        if len(set(letters)) != len(letters) or len(set(self.g_codes)) != len(self.g_codes):
+            return True
+
+        motion_codes = [code for code in self.g_codes if code in MOTION_CODES]
+        if len(motion_codes) > 1 or len(self.m_codes) > 1:
+            return True
+
+        if "G4" in self.g_codes:
+            return bool(motion_codes or self.axis_words()) or "P" not in self.params
+
+        return "P" in self.params
+
+
+def strip_comments(line: str) -> str:
+    return COMMENT_RE.sub("", line).strip()
+
+
+def parse_line(line: str, number=float) -> Block:
+    """
+    Splits a line into (letter, value) words. Comments, whitespace, block-delete and line numbers are dropped.
+    """
+    text = strip_comments(line)
+
+    if text in ("", "%", "/"):
+        return Block(text)
+
+    if text.startswith("$") or text.startswith("/"):
+        return Block(text, system=text)
+
+    words = []
+    position = 0
+    for match in WORD_RE.finditer(text):
+        if text[position:match.start()].strip():
+            return Block(text, system=text)
+        position = match.end()
+
+        letter = match.group(1).upper()
+        if letter == "N":
+            continue
+        words.append((letter, number(match.group(2))))
+
+    if text[position:].strip():
+        return Block(text, system=text)
+
+    return Block(text, words=words)
+
+
+# ============================================================
+# Interpreter
+# ============================================================
+
+class Step(typing.NamedTuple):
+    """
+    What a single line did to the machine.
+
+    ``kind`` is one of "empty", "modal", "move", "dwell", "opaque" or "system". ``start`` and ``end`` map each axis
+    to an absolute coordinate, or None when the position is not known (before the first absolute move, or after a
+    line the interpreter cannot model).
+    """
+    kind: str
+    block: Block
+    motion: typing.Optional[str]
+    start: dict
+    end: dict
+    feed: typing.Any
+    spindle: typing.Optional[str]
+    power: typing.Any
+    distance_before: typing.Optional[str]
+    distance_after: typing.Optional[str]
+
+
+class GcodeInterpreter:
+    """
+    Tracks GRBL-style modal state line by line.
+
+    ``number`` selects the numeric type: Decimal keeps arithmetic exact for rewriting and verification, float is
+    faster for time estimates and previews.
+    """
+
+    def __init__(self, number=float):
+        self.number = number
+        self.motion = None
+        self.distance = None  # None until the program selects G90 or G91
+        self.units = "G21"
+        self.inverse_time = False
+        self.feed = None
+        self.spindle = None
+        self.power = None
+        self.position = {axis: None for axis in AXES}
+
+    def parse(self, line: str) -> Block:
+        return parse_line(line, number=self.number)
+
+    def snapshot(self):
+        return (self.motion, self.distance, self.units, self.inverse_time, self.feed, self.spindle, self.power)
+
+    def execute(self, block: Block) -> Step:
+        start = dict(self.position)
+        distance_before = self.distance
+
+        if block.empty:
+            return self._step("empty", block, None, start, distance_before)
+
+        if block.system is not None:
+            self._forget_position()
+            return self._step("system", block, None, start, distance_before)
+
+        opaque = block.is_opaque()
+        self._apply_modal(block)
+
+        if opaque:
+            self._forget_position()
+            return self._step("opaque", block, None, start, distance_before)
+
+        if "G4" in block.g_codes:
+            return self._step("dwell", block, None, start, distance_before)
+
+        axis_words = block.axis_words()
+        if not axis_words:
+            return self._step("modal", block, None, start, distance_before)
+
+        if self.motion is None:
+            self._forget_position()
+            return self._step("opaque", block, None, start, distance_before)
+
+        for axis, value in axis_words.items():
+            if self.distance == "G90":
+                self.position[axis] = value
+            elif self.distance == "G91" and self.position[axis] is not None:
+                self.position[axis] = self.position[axis] + value
+            else:
+                self.position[axis] = None
+
+        return self._step("move", block, self.motion, start, distance_before)
+
+    def run(self, lines) -> typing.Iterator[Step]:
+        for line in lines:
+            yield self.execute(self.parse(line))
+
+    def _apply_modal(self, block: Block):
+        for code in block.g_codes:
+            if code in MOTION_CODES:
+                self.motion = code
+            elif code in DISTANCE_CODES:
+                self.distance = code
+            elif code in ("G20", "G21"):
+                self.units = code
+            elif code == "G93":
+                self.inverse_time = True
+            elif code == "G94":
+                self.inverse_time = False
+
+        for code in block.m_codes:
+            if code in KNOWN_M_CODES:
+                self.spindle = code
+
+        if "F" in block.params:
+            self.feed = block.params["F"]
+        if "S" in block.params:
+            self.power = block.params["S"]
+
+    def _forget_position(self):
+        self.position = {axis: None for axis in AXES}
+
+    def _step(self, kind, block, motion, start, distance_before):
+        return Step(
+            kind,
+            block,
+            motion,
+            start,
+            dict(self.position),
+            self.feed,
+            self.spindle,
+            self.power,
+            distance_before,
+            self.distance,
+        )
+
+
+# ============================================================
+# Tool Path
+# ============================================================
+
+def trace_moves(lines, arc_tolerance=0.002) -> typing.Iterator[tuple]:
+    """
+    Follows the tool through a program in absolute millimetres.
+
+    Yields (index, step, start, points) for every line: ``points`` are the ends of the straight pieces the line
+    moves through, with arcs split the way GRBL's mc_arc() splits them, and is empty when the line does not move.
+    Positions the interpreter cannot know (before the first move, after homing) are taken to be the origin.
+    """
+    interpreter = GcodeInterpreter()
+    position = [0.0, 0.0, 0.0]
+
+    for index, line in enumerate(lines):
+        step = interpreter.execute(interpreter.parse(line))
+        start = position
+        points = []
+
+        if step.kind == "system" and step.block.system.strip().upper() == "$H":
+            position = [0.0, 0.0, 0.0]
+        elif step.kind == "opaque" and "G28" in step.block.g_codes:
+            position = [0.0, 0.0, 0.0]
+            points = [position]
+        elif step.kind == "move":
+            scale = 25.4 if interpreter.units == "G20" else 1.0
+            relative = step.distance_after == "G91"
+            params = step.block.params
+
+            target = list(position)
+            for axis_index, axis in enumerate(AXES):
+                if axis in params:
+                    value = float(params[axis]) * scale
+                    target[axis_index] = position[axis_index] + value if relative else value
+
+            if step.motion in ("G2", "G3"):
+                clockwise = step.motion == "G2"
+                if "R" in params:
+                    points = arc_points(position, target, clockwise, radius=float(params["R"]) * scale,
+                                        tolerance=arc_tolerance)
+                else:
+                    offset = (float(params.get("I", 0)) * scale, float(params.get("J", 0)) * scale)
+                    points = arc_points(position, target, clockwise, offset=offset, tolerance=arc_tolerance)
+                points = points or [target]
+            else:
+                points = [target]
+
+            position = target
+
+        yield index, step, start, points
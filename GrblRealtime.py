@@ -0,0 +1,102 @@
+# ============================================================
+# GRBL 1.1 Real-Time Commands
+# ============================================================
+# GRBL picks these bytes out of the serial stream the moment they arrive, ahead of anything waiting in its RX
+# buffer, so they must be written straight to the port rather than queued behind G-code lines.
+
+STATUS_REPORT = b"?"
+FEED_HOLD = b"!"
+CYCLE_START = b"~"
+SOFT_RESET = b"\x18"
+
+SAFETY_DOOR = b"\x84"
+JOG_CANCEL = b"\x85"
+
+FEED_OVERRIDE_RESET = b"\x90"
+FEED_OVERRIDE_PLUS_10 = b"\x91"
+FEED_OVERRIDE_MINUS_10 = b"\x92"
+FEED_OVERRIDE_PLUS_1 = b"\x93"
+FEED_OVERRIDE_MINUS_1 = b"\x94"
+
+RAPID_OVERRIDE_100 = b"\x95"
+RAPID_OVERRIDE_50 = b"\x96"
+RAPID_OVERRIDE_25 = b"\x97"
+
+SPINDLE_OVERRIDE_RESET = b"\x99"
+SPINDLE_OVERRIDE_PLUS_10 = b"\x9a"
+SPINDLE_OVERRIDE_MINUS_10 = b"\x9b"
+SPINDLE_OVERRIDE_PLUS_1 = b"\x9c"
+SPINDLE_OVERRIDE_MINUS_1 = b"\x9d"
+SPINDLE_STOP = b"\x9e"
+
+# Buffer sizes of a stock GRBL 1.1 build (config.h): the serial RX buffer that character counting fills, the planner
+# blocks queued for motion, and the longest line the parser takes
+RX_BUFFER_SIZE = 127
+PLANNER_BLOCKS = 16
+LINE_BUFFER_SIZE = 80
+
+# Override limits from GRBL's config.h (percent)
+FEED_OVERRIDE_RANGE = (10, 200)
+RAPID_OVERRIDES = (25, 50, 100)
+SPINDLE_OVERRIDE_RANGE = (10, 200)
+
+# (key, command, description). Keys are single characters as read from a terminal; Ctrl+X arrives as 0x18.
+KEY_BINDINGS = (
+    ("!", FEED_HOLD, "Feed hold"),
+    ("~", CYCLE_START, "Resume"),
+    ("\x18", SOFT_RESET, "Soft reset"),
+    ("=", FEED_OVERRIDE_RESET, "Feed 100%"),
+    ("+", FEED_OVERRIDE_PLUS_10, "Feed +10%"),
+    ("-", FEED_OVERRIDE_MINUS_10, "Feed -10%"),
+    ("]", FEED_OVERRIDE_PLUS_1, "Feed +1%"),
+    ("[", FEED_OVERRIDE_MINUS_1, "Feed -1%"),
+    ("3", RAPID_OVERRIDE_100, "Rapid 100%"),
+    ("2", RAPID_OVERRIDE_50, "Rapid 50%"),
+    ("1", RAPID_OVERRIDE_25, "Rapid 25%"),
+    (".", SPINDLE_OVERRIDE_RESET, "Laser 100%"),
+    ("*", SPINDLE_OVERRIDE_PLUS_10, "Laser +10%"),
+    ("/", SPINDLE_OVERRIDE_MINUS_10, "Laser -10%"),
+    (")", SPINDLE_OVERRIDE_PLUS_1, "Laser +1%"),
+    ("(", SPINDLE_OVERRIDE_MINUS_1, "Laser -1%"),
+)
+
+COMMANDS_BY_KEY = {key: (command, description) for key, command, description in KEY_BINDINGS}
+
+
+def key_label(key) -> str:
+    """
+    Readable name of a binding's key, also usable as a QKeySequence ("Ctrl+X" for 0x18).
+    """
+    if ord(key) < 32:
+        return "Ctrl+" + chr(ord(key) + 64)
+    return key
+
+
+def apply_override(command, feed, rapid, spindle):
+    """
+    Returns the (feed, rapid, spindle) override percentages after ``command``, clamped the way GRBL clamps them.
+    """
+    feed_steps = {
+        FEED_OVERRIDE_PLUS_10: 10, FEED_OVERRIDE_MINUS_10: -10, FEED_OVERRIDE_PLUS_1: 1, FEED_OVERRIDE_MINUS_1: -1,
+    }
+    spindle_steps = {
+        SPINDLE_OVERRIDE_PLUS_10: 10, SPINDLE_OVERRIDE_MINUS_10: -10,
+        SPINDLE_OVERRIDE_PLUS_1: 1, SPINDLE_OVERRIDE_MINUS_1: -1,
+    }
+
+    if command == FEED_OVERRIDE_RESET:
+        feed = 100
+    elif command in feed_steps:
+        feed = min(FEED_OVERRIDE_RANGE[1], max(FEED_OVERRIDE_RANGE[0], feed + feed_steps[command]))
+    elif command == RAPID_OVERRIDE_100:
+        rapid = 100
+    elif command == RAPID_OVERRIDE_50:
+        rapid = 50
+    elif command == RAPID_OVERRIDE_25:
+        rapid = 25
+    elif command == SPINDLE_OVERRIDE_RESET:
+        spindle = 100
+    elif command in spindle_steps:
+        spindle = min(SPINDLE_OVERRIDE_RANGE[1], max(SPINDLE_OVERRIDE_RANGE[0], spindle + spindle_steps[command]))
+
+    return feed, rapid, spindle
@@ -0,0 +1,155 @@
+import math
+
+import numpy as np
+
+# Distance between hatch lines (mm), about the width of the burn, and their direction (degrees from X)
+DEFAULT_SPACING = 0.15
+DEFAULT_ANGLE = 45.0
+
+# Ends of hatch lines further apart than this many spacings are not linked, so the link cannot stray far from the
+# outline it runs along
+MAX_LINK_SPACINGS = 3.0
+
+# Curves whose ends are this close (mm) are taken as joined
+JOIN_TOLERANCE = 1e-3
+
+
+# ============================================================
+# Closed Outlines
+# ============================================================
+
+def closed_loops(polylines, tolerance=JOIN_TOLERANCE) -> list:
+    """
+    Joins polylines that follow on from each other, as the curves of a path do, and returns the runs that come back
+    to their start as closed (n, 2) polygons, first point repeated at the end. Open runs are left out.
+    """
+    loops, run = [], []
+    for polyline in polylines:
+        if len(polyline) < 2:
+            continue
+        if run and math.dist(run[-1][-1], polyline[0]) > tolerance:
+            run = []
+        run.append(polyline)
+
+        if math.dist(polyline[-1], run[0][0]) <= tolerance and sum(len(part) - 1 for part in run) > 2:
+            loop = np.vstack([run[0]] + [part[1:] for part in run[1:]])
+            loop[-1] = loop[0]
+            loops.append(loop)
+            run = []
+    return loops
+
+
+# ============================================================
+# Scanlines
+# ============================================================
+# The polygons are turned so the hatch lines run along X, at multiples of the spacing so neighbouring shapes line up.
+# Every edge of every polygon is crossed by the scanlines in [low, high) of its Y, so a vertex on a scanline counts
+# once and every scanline crosses the outlines an even number of times. Sorted along each scanline, the crossings
+# pair up into the spans inside the fill by the even-odd rule, holes and overlaps included.
+
+def _rotation(angle) -> tuple:
+    radians = math.radians(angle)
+    return math.cos(radians), math.sin(radians)
+
+
+def scanline_spans(polygons, spacing=DEFAULT_SPACING, angle=DEFAULT_ANGLE) -> tuple:
+    """
+    The spans of the hatch lines inside closed polygons (first point repeated at the end): the scanline number of
+    each, and where it starts and ends along the scanline, sorted by scanline then position.
+    """
+    cos, sin = _rotation(angle)
+    points = np.concatenate(polygons)
+    u = points[:, 0] * cos + points[:, 1] * sin
+    v = points[:, 1] * cos - points[:, 0] * sin
+
+    # Edges join each point to the next one of the same polygon
+    last = np.cumsum([len(polygon) for polygon in polygons]) - 1
+    edge = np.ones(len(points), dtype=bool)
+    edge[last] = False
+    start = np.flatnonzero(edge)
+    u0, v0, u1, v1 = u[start], v[start], u[start + 1], v[start + 1]
+
+    first = np.ceil(np.minimum(v0, v1) / spacing).astype(np.int64)
+    crossed = np.ceil(np.maximum(v0, v1) / spacing).astype(np.int64) - first
+    owners = np.repeat(np.arange(len(start)), crossed)
+    lines = np.repeat(first, crossed) + np.arange(len(owners)) - np.repeat(np.cumsum(crossed) - crossed, crossed)
+
+    t = (lines * spacing - v0[owners]) / (v1[owners] - v0[owners])
+    crossings = u0[owners] + t * (u1[owners] - u0[owners])
+
+    order = np.lexsort((crossings, lines))
+    lines, crossings = lines[order][0::2], crossings[order]
+    low, high = crossings[0::2], crossings[1::2]
+    inside = high > low
+    return lines[inside], low[inside], high[inside]
+
+
+# ============================================================
+# Serpentine Linking
+# ============================================================
+# A span is linked to the span on the next scanline when each is the only one overlapping the other, so the laser can
+# turn around at the outline and come back without a lift. Linked spans make columns down the shape, drawn back and
+# forth; where the shape branches or a hole starts, a new column begins.
+
+def _link(lines, low, high, spacing) -> np.ndarray:
+    """
+    The span each span is linked to on the next scanline, or -1.
+    """
+    count = len(lines)
+    origin = low.min()
+    width = high.max() - origin + 1
+    key_low = lines * width + (low - origin)
+    key_high = lines * width + (high - origin)
+
+    # Spans of one scanline do not overlap, so both their starts and ends are in order
+    below_first = np.searchsorted(key_high, (lines + 1) * width + (low - origin), side="right")
+    below_end = np.searchsorted(key_low, (lines + 1) * width + (high - origin), side="left")
+    above_first = np.searchsorted(key_high, (lines - 1) * width + (low - origin), side="right")
+    above_end = np.searchsorted(key_low, (lines - 1) * width + (high - origin), side="left")
+    above = above_end - above_first
+
+    candidate = np.minimum(below_first, count - 1)
+    limit = MAX_LINK_SPACINGS * spacing
+    linked = (
+        (below_end - below_first == 1)
+        & (above[candidate] == 1)
+        & (np.abs(low[candidate] - low) <= limit)
+        & (np.abs(high[candidate] - high) <= limit)
+    )
+    return np.where(linked, candidate, -1)
+
+
+def hatch_lines(polygons, spacing=DEFAULT_SPACING, angle=DEFAULT_ANGLE) -> list:
+    """
+    Hatching of the closed polygons, even-odd filled, as polylines: each one a column of hatch lines drawn back and
+    forth and linked at their ends.
+    """
+    polygons = [np.asarray(polygon, dtype=np.float64) for polygon in polygons if len(polygon) > 3]
+    if not polygons:
+        return []
+    lines, low, high = scanline_spans(polygons, spacing, angle)
+    count = len(lines)
+    if not count:
+        return []
+
+    following = _link(lines, low, high, spacing)
+    has_link = following >= 0
+    preceding = np.arange(count)
+    preceding[following[has_link]] = np.flatnonzero(has_link)
+
+    # Find the top of every column by pointer jumping; linked spans are on consecutive scanlines
+    head = preceding
+    for _ in range(max(1, int(np.ceil(np.log2(count))) + 1)):
+        head = head[head]
+    forward = (lines - lines[head]) % 2 == 0
+
+    order = np.lexsort((lines, head))
+    entry = np.where(forward, low, high)[order]
+    leave = np.where(forward, high, low)[order]
+    u = np.column_stack((entry, leave)).ravel()
+    v = np.repeat(lines[order] * spacing, 2)
+
+    cos, sin = _rotation(angle)
+    points = np.column_stack((u * cos - v * sin, u * sin + v * cos))
+    bounds = 2 * (np.flatnonzero(np.diff(head[order])) + 1)
+    return np.split(points, bounds)
@@ -0,0 +1,282 @@
+import argparse
+import glob
+import itertools
+import os
+import time
+import typing
+
+from GcodeInterpreter import trace_moves
+from MakeBlockEmulator import MakeBlockMachine
+from MotionPlanner import DEFAULT_PROFILE, MotionPlanner
+
+
+# ============================================================
+# Line Estimates
+# ============================================================
+
+KIND_CUT = "cut"
+KIND_TRAVEL = "travel"
+KIND_DWELL = "dwell"
+KINDS = (KIND_CUT, KIND_TRAVEL, KIND_DWELL)
+
+MACHINES = ("grbl", "makeblock")
+
+# GRBL answers "ok" as soon as a line is planned, so under send-and-wait the machine runs this many lines behind
+# the acknowledgements. The MakeBlock firmware only answers once a move is done.
+ACKNOWLEDGEMENT_LAG = {
+    "grbl": 16,
+    "makeblock": 0,
+}
+
+ACKNOWLEDGEMENT_BYTES = 4  # "ok\r\n"
+
+
+class LineEstimate(typing.NamedTuple):
+    """
+    Estimated machine time of one line and what that time is spent on (None for lines that take no time).
+    """
+    seconds: float
+    kind: typing.Optional[str]
+
+
+def _link_time(line, baudrate, host_latency):
+    """
+    Shortest time a send-and-wait round trip of ``line`` can take, however short the move.
+    """
+    return (len(line.strip()) + 1 + ACKNOWLEDGEMENT_BYTES) * 10.0 / baudrate + host_latency
+
+
+def _move_kind(step):
+    if step.motion == "G0":
+        return KIND_TRAVEL
+    if step.spindle == "M5" or step.power == 0:
+        return KIND_TRAVEL
+    return KIND_CUT
+
+
+def estimate_grbl(lines, profile=None, baudrate=115200, host_latency=0.002) -> list:
+    """
+    Estimates every line under GRBL's look-ahead planner: junction speeds, trapezoids and the 16 block queue.
+    """
+    profile = profile or DEFAULT_PROFILE
+    planner = MotionPlanner(profile)
+
+    seconds = [0.0] * len(lines)
+    kinds = [None] * len(lines)
+
+    def run(block):
+        seconds[block.tag] += block.duration()
+
+    def drain():
+        while len(planner):
+            run(planner.pop())
+
+    scale = 1.0
+    inverse_time = False
+
+    for index, step, start, points in trace_moves(lines):
+        codes = step.block.g_codes
+        if "G20" in codes or "G21" in codes:
+            scale = 25.4 if "G20" in codes else 1.0
+        if "G93" in codes or "G94" in codes:
+            inverse_time = "G93" in codes
+
+        if step.kind == "dwell":
+            drain()
+            seconds[index] += float(step.block.params.get("P", 0))
+            kinds[index] = KIND_DWELL
+            continue
+
+        if step.kind in ("system", "opaque"):
+            drain()
+
+        if not points:
+            continue
+
+        rapid = step.kind == "opaque" or step.motion == "G0"
+        feed = None
+        if step.feed and not inverse_time and not rapid:
+            feed = float(step.feed) * scale
+
+        previous = start
+        for point in points:
+            if planner.is_full():
+                run(planner.pop())
+            planner.add(previous, point, feed, rapid=rapid, tag=index)
+            previous = point
+
+        kinds[index] = KIND_TRAVEL if rapid else _move_kind(step)
+
+    drain()
+
+    return [
+        LineEstimate(max(time_, _link_time(line, baudrate, host_latency)) if line.strip() else 0.0, kind)
+        for line, time_, kind in zip(lines, seconds, kinds)
+    ]
+
+
+def estimate_makeblock(lines, baudrate=115200, host_latency=0.002) -> list:
+    """
+    Estimates every line by running it through the firmwareV4 model, which only acknowledges finished moves.
+    """
+    machine = MakeBlockMachine()
+    estimates = []
+
+    for line in lines:
+        text = line.strip()
+        if not text:
+            estimates.append(LineEstimate(0.0, None))
+            continue
+
+        machine.receive((text + "\n").encode())
+        move = machine.move
+        seconds = move.duration if move is not None else machine.homing_remaining
+        if move is not None:
+            # A move with the laser at zero power is travel
+            kind = KIND_CUT if machine.laser_power > 0 else KIND_TRAVEL
+        elif text.startswith("G28"):
+            kind = KIND_TRAVEL
+        else:
+            kind = None
+
+        if seconds > 0:
+            # The model polls its serial port while moving; nothing else is queued, so skip straight to the end
+            machine.last_poll = machine.clock + seconds
+            machine.advance(seconds + 1e-6)
+        machine.take_output()
+
+        estimates.append(LineEstimate(max(seconds, _link_time(text, baudrate, host_latency)), kind))
+
+    return estimates
+
+
+def estimate_lines(lines, machine="grbl", profile=None, baudrate=115200, host_latency=0.002) -> list:
+    if machine not in MACHINES:
+        raise ValueError(f"Unknown machine {machine}. Valid machines: {list(MACHINES)}")
+
+    if machine == "makeblock":
+        return estimate_makeblock(lines, baudrate, host_latency)
+    return estimate_grbl(lines, profile, baudrate, host_latency)
+
+
+def summarize(estimates) -> dict:
+    summary = {kind: 0.0 for kind in KINDS}
+    summary["total"] = 0.0
+
+    for estimate in estimates:
+        summary["total"] += estimate.seconds
+        if estimate.kind is not None:
+            summary[estimate.kind] += estimate.seconds
+
+    return summary
+
+
+def format_duration(seconds) -> str:
+    seconds = int(round(max(0.0, seconds)))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+# ============================================================
+# Live Progress
+# ============================================================
+
+class JobProgress:
+    """
+    Turns acknowledgements into progress through the estimated motion time of a job.
+
+    Acknowledgements of the last ``lag_lines`` lines are not counted as done, since the controller may still be
+    working through them. The remaining time is scaled by how the wall clock has compared with the estimate so far;
+    ``prior_seconds`` of estimated motion at a ratio of 1 keep the scale steady at the start of a job.
+    """
+
+    def __init__(self, estimates, lag_lines=0, prior_seconds=10.0):
+        self.estimates = estimates
+        self.lag_lines = lag_lines
+        self.prior_seconds = prior_seconds
+        self.cumulative = list(itertools.accumulate(estimate.seconds for estimate in estimates))
+        self.total = self.cumulative[-1] if self.cumulative else 0.0
+        self.totals = summarize(estimates)
+
+        self.done = 0.0
+        self.done_by_kind = {kind: 0.0 for kind in KINDS}
+        self.counted = 0
+        self.started = None
+
+    def start(self, now=None):
+        self.started = time.monotonic() if now is None else now
+
+    def acknowledge(self, index):
+        """
+        Records the acknowledgement of line ``index`` (0-based).
+        """
+        self._count(index + 1 - self.lag_lines)
+
+    def finish(self):
+        """
+        Counts every line as done, once the controller has worked through the job.
+        """
+        self._count(len(self.estimates))
+
+    def _count(self, finished):
+        while self.counted < finished:
+            estimate = self.estimates[self.counted]
+            if estimate.kind is not None:
+                self.done_by_kind[estimate.kind] += estimate.seconds
+            self.counted += 1
+
+        if self.counted:
+            self.done = self.cumulative[self.counted - 1]
+
+    def elapsed(self, now=None):
+        if self.started is None:
+            return 0.0
+        return (time.monotonic() if now is None else now) - self.started
+
+    def scale(self, now=None):
+        return (self.elapsed(now) + self.prior_seconds) / (self.done + self.prior_seconds)
+
+    def remaining(self, now=None):
+        return max(0.0, self.total - self.done) * self.scale(now)
+
+    def fraction(self):
+        return self.done / self.total if self.total else 1.0
+
+    def split(self) -> str:
+        return " ".join(
+            f"{kind} {format_duration(self.done_by_kind[kind])}/{format_duration(self.totals[kind])}"
+            for kind in KINDS
+            if self.totals[kind] > 0
+        )
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate how long G-code files take to run")
+    parser.add_argument("files", nargs="*", default=glob.glob("./sliced/*.gcode"))
+    parser.add_argument("--machine", choices=MACHINES, default="grbl")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--latency", type=float, default=0.002, help="host turnaround per response (s)")
+    args = parser.parse_args()
+
+    print(f"\n{'File':<40} {'Total':>9} {'Cut':>9} {'Travel':>9} {'Dwell':>9}")
+    for file in args.files:
+        with open(file, "r") as f:
+            lines = f.read().splitlines()
+
+        summary = summarize(estimate_lines(lines, args.machine, baudrate=args.baud, host_latency=args.latency))
+        print(
+            f"{os.path.basename(file):<40} {format_duration(summary['total']):>9} "
+            f"{format_duration(summary[KIND_CUT]):>9} {format_duration(summary[KIND_TRAVEL]):>9} "
+            f"{format_duration(summary[KIND_DWELL]):>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+import argparse
+import collections
+import queue
+import re
+import sys
+import threading
+import time
+
+from rich.progress import Progress, BarColumn, TextColumn
+from rich.table import Table
+
+from GcodeEncoder import GcodeEncoder
+from JobEstimator import ACKNOWLEDGEMENT_LAG, MACHINES, JobProgress, estimate_lines, format_duration
+from MotionPlanner import profile_from_grbl_settings
+from SendTUI import FINISHED_RESPONSE, SerialCommunicator, console, list_serial_ports, send_notification
+
+SETTING_RE = re.compile(r"(\$\d+)=([-+]?[\d.]+)")
+
+
+def notify(message):
+    # Desktop notifications are a nicety; a host without notify-send must not stop the farm
+    try:
+        send_notification(message)
+    except OSError:
+        pass
+
+
+# ============================================================
+# Jobs
+# ============================================================
+
+class Job:
+    __slots__ = ("path", "run", "runs")
+
+    def __init__(self, path, run, runs):
+        self.path = path
+        self.run = run
+        self.runs = runs
+
+    def __str__(self):
+        return self.path if self.runs == 1 else f"{self.path} ({self.run}/{self.runs})"
+
+
+def parse_job(spec):
+    """
+    "part.gcode" runs once, "part.gcode:5" five times.
+    """
+    path, _, count = spec.rpartition(":")
+    if path and count.isdigit():
+        return path, int(count)
+    return spec, 1
+
+
+def build_queue(specs, repeat=1) -> queue.Queue:
+    jobs = queue.Queue()
+    for spec in specs:
+        path, count = parse_job(spec)
+        runs = count * repeat
+        for run in range(1, runs + 1):
+            jobs.put(Job(path, run, runs))
+    return jobs
+
+
+def parse_bindings(bindings) -> dict:
+    """
+    Turns "--bind /dev/ttyUSB1=makeblock" options into {port: machine}.
+    """
+    bound = {}
+    for binding in bindings:
+        port, _, machine = binding.partition("=")
+        if machine not in MACHINES:
+            raise ValueError(f"Unknown machine {machine} for {port}. Valid machines: {list(MACHINES)}")
+        bound[port] = machine
+    return bound
+
+
+# ============================================================
+# Workers
+# ============================================================
+
+class MachineWorker(threading.Thread):
+    """
+    Streams jobs from the shared queue to one machine until the queue is empty.
+
+    Each worker encodes and estimates files for its own machine type; GRBL machines are asked for their settings
+    first so estimates use that machine's rates and accelerations.
+    """
+
+    def __init__(self, port, machine, jobs, progress, stop_event, encode=False):
+        super().__init__(daemon=True)
+        self.port = port
+        self.machine = machine
+        self.jobs = jobs
+        self.progress = progress
+        self.stop_event = stop_event
+        self.encoder = GcodeEncoder(machine) if encode else None
+        self.profile = None
+
+        self.serial_comm = None
+        self.stats = collections.Counter()
+        self.job_times = []
+        self.task = progress.add_task(port, total=1, job="waiting", remaining="", split="")
+
+    def connect(self):
+        self.serial_comm = SerialCommunicator(self.port)
+        if self.machine == "grbl":
+            response = self.serial_comm.send_and_wait("$$")
+            settings = dict(SETTING_RE.findall(response))
+            if settings:
+                self.profile = profile_from_grbl_settings(settings)
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+
+                try:
+                    self.run_job(job)
+                finally:
+                    self.jobs.task_done()
+        finally:
+            self.progress.update(self.task, job="done", remaining="", split="")
+            if self.serial_comm is not None:
+                self.serial_comm.close()
+
+    def run_job(self, job):
+        try:
+            with open(job.path, "r") as f:
+                lines = f.read().splitlines()
+        except Exception as e:
+            self.stats["failed"] += 1
+            console.print(f"[red]{self.port}: failed to open {job}: {e}[/red]")
+            return
+
+        if self.encoder is not None:
+            lines = self.encoder.encode(lines)
+
+        estimates = estimate_lines(lines, self.machine, self.profile)
+        tracker = JobProgress(estimates, lag_lines=ACKNOWLEDGEMENT_LAG[self.machine])
+        self.progress.reset(
+            self.task,
+            total=tracker.total or 1,
+            job=str(job),
+            remaining=format_duration(tracker.total) + " left",
+            split=tracker.split(),
+        )
+
+        start = time.time()
+        tracker.start()
+
+        for index, line in enumerate(lines):
+            if self.stop_event.is_set():
+                return
+
+            if not line.strip():
+                continue
+
+            response = self.serial_comm.send_and_wait(line)
+            if "error" in response.lower():
+                self.stats["errors"] += 1
+                console.log(f"[red]{self.port}: '{line.strip()}' -> {response.strip()}[/red]")
+            elif FINISHED_RESPONSE not in response.lower():
+                self.stats["timeouts"] += 1
+
+            self.stats["lines"] += 1
+            self.stats["bytes"] += len(line.strip()) + 1
+
+            tracker.acknowledge(index)
+            self.progress.update(
+                self.task,
+                completed=tracker.done,
+                remaining=format_duration(tracker.remaining()) + " left",
+                split=tracker.split(),
+            )
+
+        # The last lines acknowledged were still in the planner; the job is done now it has been sent
+        tracker.finish()
+        self.progress.update(self.task, completed=tracker.done, remaining="", split=tracker.split())
+
+        elapsed = time.time() - start
+        self.stats["jobs"] += 1
+        self.stats["busy"] += elapsed
+        self.stats["estimated"] += tracker.total
+        self.job_times.append((str(job), elapsed))
+
+        notify(f"{self.port}: {job} finished")
+
+
+# ============================================================
+# Farm
+# ============================================================
+
+def run_farm(ports, bindings, jobs, encode=False):
+    stop_event = threading.Event()
+
+    with Progress(
+        "[progress.description]{task.description}",
+        TextColumn("{task.fields[job]}"),
+        BarColumn(),
+        "[progress.percentage]{task.percentage:>3.0f}%",
+        TextColumn("{task.fields[remaining]}"),
+        TextColumn("{task.fields[split]}"),
+        console=console,
+    ) as progress:
+        workers = [
+            MachineWorker(port, bindings.get(port, "grbl"), jobs, progress, stop_event, encode)
+            for port in ports
+        ]
+
+        # SerialCommunicator exits on a port that will not open; that only drops the port from the farm
+        connected = []
+        for worker in workers:
+            try:
+                worker.connect()
+            except (Exception, SystemExit) as e:
+                # SystemExit comes with the reason already printed
+                reason = "" if isinstance(e, SystemExit) else f": {e}"
+                console.print(f"[red]Dropping {worker.port}{reason}[/red]")
+                if worker.serial_comm is not None:
+                    worker.serial_comm.close()
+                progress.remove_task(worker.task)
+                continue
+            console.print(f"[green]Connected to {worker.port} ({worker.machine})[/green]")
+            connected.append(worker)
+        workers = connected
+        if not workers:
+            console.print("[red]No machine connected.[/red]")
+
+        farm_start = time.time()
+        for worker in workers:
+            worker.start()
+
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(0.2)
+        except KeyboardInterrupt:
+            console.print("[red]Interrupted by user. Stopping after the current line on every machine.[/red]")
+            stop_event.set()
+            for worker in workers:
+                worker.join()
+
+    farm_elapsed = time.time() - farm_start
+    print_summary(workers, farm_elapsed)
+    return workers, farm_elapsed
+
+
+def print_summary(workers, farm_elapsed):
+    table = Table(title="Farm Summary")
+    table.add_column("Port", style="cyan")
+    table.add_column("Machine")
+    table.add_column("Jobs", justify="right")
+    table.add_column("Lines", justify="right")
+    table.add_column("Busy (s)", justify="right", style="magenta")
+    table.add_column("Utilization", justify="right")
+    table.add_column("Lines/s", justify="right")
+    table.add_column("Actual/Estimate", justify="right")
+    table.add_column("Timeouts", justify="right")
+    table.add_column("Failed", justify="right")
+
+    totals = collections.Counter()
+    for worker in workers:
+        stats = worker.stats
+        totals.update(stats)
+        utilization = stats["busy"] / farm_elapsed if farm_elapsed else 0
+        rate = stats["lines"] / stats["busy"] if stats["busy"] else 0
+        accuracy = f"{stats['busy'] / stats['estimated']:.2f}" if stats["estimated"] else "-"
+        table.add_row(
+            worker.port,
+            worker.machine,
+            str(stats["jobs"]),
+            str(stats["lines"]),
+            f"{stats['busy']:.2f}",
+            f"{utilization:.0%}",
+            f"{rate:.1f}",
+            accuracy,
+            str(stats["timeouts"]),
+            str(stats["failed"]),
+        )
+
+    utilization = totals["busy"] / (farm_elapsed * len(workers)) if farm_elapsed and workers else 0
+    table.add_row(
+        "[bold]Farm[/bold]",
+        "",
+        f"[bold]{totals['jobs']}[/bold]",
+        f"[bold]{totals['lines']}[/bold]",
+        f"[bold]{totals['busy']:.2f}[/bold]",
+        f"[bold]{utilization:.0%}[/bold]",
+        f"[bold]{totals['lines'] / farm_elapsed if farm_elapsed else 0:.1f}[/bold]",
+        "",
+        f"[bold]{totals['timeouts']}[/bold]",
+        f"[bold]{totals['failed']}[/bold]",
+    )
+
+    console.print(table)
+
+    jobs_per_hour = totals["jobs"] / farm_elapsed * 3600 if farm_elapsed else 0
+    console.print(
+        f"[bold green]{totals['jobs']} jobs in {farm_elapsed:.2f} seconds on {len(workers)} machines "
+        f"({jobs_per_hour:.1f} jobs/hour).[/bold green]"
+    )
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a queue of G-code jobs across every connected plotter")
+    parser.add_argument("jobs", nargs="+", help="G-code files, optionally with a repeat count (part.gcode:5)")
+    parser.add_argument("--ports", nargs="+", help="ports to use (default: every /dev/ttyUSB*)")
+    parser.add_argument(
+        "--bind",
+        action="append",
+        default=[],
+        metavar="PORT=MACHINE",
+        help=f"machine type of a port, one of {list(MACHINES)} (default: grbl)",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="run the whole queue this many times")
+    parser.add_argument("--encode", action="store_true", help="shrink every file for its machine's dialect")
+    args = parser.parse_args()
+
+    ports = args.ports or list_serial_ports()
+    if not ports:
+        console.print("[red]No serial ports found.[/red]")
+        sys.exit(1)
+
+    try:
+        bindings = parse_bindings(args.bind)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        sys.exit(1)
+
+    jobs = build_queue(args.jobs, args.repeat)
+    console.print(f"[green]{jobs.qsize()} jobs queued for {len(ports)} machines[/green]")
+
+    run_farm(ports, bindings, jobs, args.encode)
+    notify("Farm finished")
+
+
+if __name__ == "__main__":
+    main()
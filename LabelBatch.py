@@ -0,0 +1,286 @@
+import argparse
+import csv
+import os
+import re
+import time
+import typing
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from svgpathtools import Document
+
+from CurveFlattener import flatten_path
+from GcodeEncoder import DIALECTS
+from TextToolpath import (
+    DRAW_FEED,
+    PEN_UP,
+    SVG_NS,
+    format_strokes,
+    layout_text,
+    load_font,
+    merge_strokes,
+    order_layout,
+    order_strokes,
+    toolpath_to_gcode,
+    write_gcode,
+)
+
+# Size of an SVG unit in mm (unitless lengths are CSS pixels)
+UNIT_MM = {
+    "": 25.4 / 96,
+    "px": 25.4 / 96,
+    "pt": 25.4 / 72,
+    "pc": 25.4 / 6,
+    "mm": 1.0,
+    "cm": 10.0,
+    "in": 25.4,
+}
+
+LENGTH_RE = re.compile(r"\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([a-z]*)")
+FIELD_RE = re.compile(r"\{(\w+)")
+
+# Chord tolerance of the template's own geometry (mm)
+STATIC_TOLERANCE = 0.02
+
+BED_WIDTH_MM = 200
+BED_HEIGHT_MM = 200
+PANEL_GAP_MM = 2.0
+
+
+# ============================================================
+# Template
+# ============================================================
+
+def parse_length(text, default=None):
+    """
+    (value, unit) of an SVG length such as "85.6mm" or "24px".
+    """
+    match = LENGTH_RE.match(text or "")
+    if not match:
+        return default
+    return float(match.group(1)), match.group(2)
+
+
+def _font_size(element):
+    style = dict(
+        part.split(":", 1) for part in (element.get("style") or "").replace(" ", "").split(";") if ":" in part
+    )
+    value, _ = parse_length(style.get("font-size") or element.get("font-size"), (16.0, ""))
+    return value
+
+
+class TextField(typing.NamedTuple):
+    """
+    A <text> element of the template: its content as a str.format pattern over the CSV columns, where its
+    baseline starts (mm, y up, relative to the label's lower left corner), its cap height and its text-anchor.
+    """
+    pattern: str
+    origin: tuple
+    height: float
+    anchor: str
+
+
+class LabelTemplate:
+    """
+    An SVG laid out as one label. Everything but the text is the static geometry: it is flattened, ordered and
+    written out once. The <text> elements are fields whose content is filled in per unit, e.g. ``SN-{serial}``, and
+    drawn in the single-line font.
+
+    Shapes take their transforms into account; text elements only their x/y, font-size and text-anchor.
+    """
+
+    def __init__(self, path, font, tolerance=STATIC_TOLERANCE):
+        self.path = path
+        self.font = font
+        root = ET.parse(path).getroot()
+
+        # User units to mm, from the viewBox and the document size
+        view_box = [float(value) for value in re.split(r"[\s,]+", root.get("viewBox", "").strip()) if value]
+        width, width_unit = parse_length(root.get("width"), (view_box[2] if view_box else 100.0, ""))
+        height, height_unit = parse_length(root.get("height"), (view_box[3] if view_box else 100.0, ""))
+        self.width = width * UNIT_MM[width_unit]
+        self.height = height * UNIT_MM[height_unit]
+        if len(view_box) != 4:
+            view_box = [0.0, 0.0, width, height]
+        self.min_x, self.min_y = view_box[0], view_box[1]
+        self.scale = (self.width / view_box[2], self.height / view_box[3])
+
+        strokes = []
+        for shape in Document(path).paths():
+            strokes.extend(self.to_mm(stroke) for stroke in flatten_path(shape, tolerance / min(self.scale)))
+        self.static = merge_strokes(order_strokes(strokes))
+
+        self.fields = []
+        for element in root.iter(f"{SVG_NS}text"):
+            pattern = "".join(element.itertext()).strip()
+            if not pattern:
+                continue
+            x, _ = parse_length((element.get("x") or "0").split()[0], (0.0, ""))
+            y, _ = parse_length((element.get("y") or "0").split()[0], (0.0, ""))
+            size = _font_size(element) * self.scale[1]
+            self.fields.append(TextField(
+                pattern,
+                tuple(self.to_mm(np.array([[x, y]]))[0]),
+                size * font.cap_height / font.units_per_em,
+                element.get("text-anchor", "start"),
+            ))
+
+    def to_mm(self, points):
+        """
+        Template user units to mm with y up and the origin in the label's lower left corner.
+        """
+        return np.column_stack((
+            (points[:, 0] - self.min_x) * self.scale[0],
+            self.height - (points[:, 1] - self.min_y) * self.scale[1],
+        ))
+
+    def field_names(self) -> list:
+        return sorted({name for field in self.fields for name in FIELD_RE.findall(field.pattern)})
+
+    def text_strokes(self, values, offset=(0.0, 0.0), start=(0.0, 0.0)) -> list:
+        """
+        The fields filled in from ``values`` and laid out, ordered from ``start``, with the label at ``offset``.
+        """
+        strokes = []
+        for field in self.fields:
+            origin = (field.origin[0] + offset[0], field.origin[1] + offset[1])
+            layout = layout_text(self.font, field.pattern.format_map(values), field.height, origin)
+
+            if field.anchor in ("middle", "end") and len(layout.vertices):
+                left, right = layout.vertices[:, 0].min(), layout.vertices[:, 0].max()
+                shift = origin[0] - (right if field.anchor == "end" else (left + right) / 2)
+                layout.vertices[:, 0] += shift
+
+            strokes.extend(order_layout(layout, strokes[-1][-1] if strokes else start))
+        return merge_strokes(strokes)
+
+
+# ============================================================
+# Batch Generation
+# ============================================================
+
+class LabelBatch:
+    """
+    Generates the G-code of many labels from one template. The static part of a label is formatted once; per unit
+    only the fields are laid out from the glyph cache and formatted.
+    """
+
+    def __init__(self, template: LabelTemplate, feed=DRAW_FEED, dialect="grbl", header=(), footer=()):
+        self.template = template
+        self.feed = feed
+        self.dialect = dialect
+        self.header = list(header)
+        self.footer = list(footer)
+
+        static = template.static
+        self.static_end = static[-1][-1] if static else (0.0, 0.0)
+        self.static_gcode = toolpath_to_gcode(static, feed, dialect, self.header)
+
+    def unit(self, values) -> list:
+        """
+        The G-code of one label at the template's own position.
+        """
+        text = self.template.text_strokes(values, start=self.static_end)
+        return self.static_gcode + format_strokes(text, self.dialect) + self.footer
+
+    def panel_cells(self, columns, rows, gap=PANEL_GAP_MM) -> list:
+        """
+        Offsets (mm) of the labels in a ``columns`` x ``rows`` grid, bottom row first and each row in the opposite
+        direction to the last so the pen never travels back across the panel.
+        """
+        template = self.template
+        pitch = (template.width + gap, template.height + gap)
+        cells = []
+        for row in range(rows):
+            order = range(columns) if row % 2 == 0 else reversed(range(columns))
+            cells.extend((column * pitch[0], row * pitch[1]) for column in order)
+        return cells
+
+    def panel_gcode(self, units, cells) -> list:
+        """
+        One job drawing each of ``units`` (field values) at the matching cell offset.
+        """
+        template = self.template
+        strokes = []
+        for values, offset in zip(units, cells):
+            start = strokes[-1][-1] if strokes else (0.0, 0.0)
+            static = [stroke + offset for stroke in template.static]
+            strokes.extend(static)
+            strokes.extend(template.text_strokes(values, offset, static[-1][-1] if static else start))
+        return toolpath_to_gcode(strokes, self.feed, self.dialect, self.header, self.footer)
+
+
+def grid_size(template: LabelTemplate, bed=(BED_WIDTH_MM, BED_HEIGHT_MM), gap=PANEL_GAP_MM) -> tuple:
+    """
+    (columns, rows) of labels that fit on the bed.
+    """
+    columns = int((bed[0] + gap) // (template.width + gap))
+    rows = int((bed[1] + gap) // (template.height + gap))
+    if not columns or not rows:
+        raise ValueError(f"A {template.width:.1f} x {template.height:.1f} mm label does not fit on the bed")
+    return columns, rows
+
+
+def read_units(csv_path) -> list:
+    """
+    One dict of field values per CSV row, plus ``index`` (counting from 1) for naming files.
+    """
+    with open(csv_path, newline="") as f:
+        return [dict(row, index=index) for index, row in enumerate(csv.DictReader(f), start=1)]
+
+
+def check_fields(template: LabelTemplate, units):
+    available = set(units[0]) if units else set()
+    missing = [name for name in template.field_names() if name not in available]
+    if missing:
+        raise ValueError(f"The CSV has no column for {', '.join(missing)}")
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate label G-code from an SVG template and a CSV of fields")
+    parser.add_argument("template", help="SVG whose <text> elements hold fields like {serial}")
+    parser.add_argument("csv", help="one row of field values per label")
+    parser.add_argument("--font", default="ReliefSingleLineSVG-Regular.svg")
+    parser.add_argument("--feed", type=float, default=DRAW_FEED)
+    parser.add_argument("--dialect", choices=list(DIALECTS), default="grbl")
+    parser.add_argument("--output-dir", default="labels")
+    parser.add_argument("--name", default="{index:04d}.gcode", help="file name pattern for --per-unit output")
+    parser.add_argument("--panel", action="store_true", help="place as many labels as fit on the bed in each job")
+    parser.add_argument("--bed", type=float, nargs=2, default=(BED_WIDTH_MM, BED_HEIGHT_MM), metavar=("W", "H"))
+    parser.add_argument("--gap", type=float, default=PANEL_GAP_MM, help="space between panelized labels (mm)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    template = LabelTemplate(args.template, load_font(args.font))
+    units = read_units(args.csv)
+    check_fields(template, units)
+    batch = LabelBatch(template, args.feed, args.dialect, footer=[PEN_UP, "G0 X0 Y0"])
+    print(
+        f"Template {template.width:.1f} x {template.height:.1f} mm: {len(template.static)} static strokes, "
+        f"fields {', '.join(template.field_names()) or 'none'} ({time.perf_counter() - start:.2f} s)"
+    )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    if args.panel:
+        columns, rows = grid_size(template, args.bed, args.gap)
+        cells = batch.panel_cells(columns, rows, args.gap)
+        for number, first in enumerate(range(0, len(units), len(cells)), start=1):
+            path = os.path.join(args.output_dir, f"panel-{number:02d}.gcode")
+            write_gcode(batch.panel_gcode(units[first:first + len(cells)], cells), path)
+            print(f"Wrote {path}")
+    else:
+        for values in units:
+            write_gcode(batch.unit(values), os.path.join(args.output_dir, args.name.format_map(values)))
+
+    elapsed = time.perf_counter() - start
+    print(f"{len(units)} labels in {elapsed:.2f} s ({len(units) / max(elapsed, 1e-9):.0f} labels/s)")
+
+
+if __name__ == "__main__":
+    main()
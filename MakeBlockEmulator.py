@@ -0,0 +1,468 @@
+import argparse
+import collections
+import math
+import os
+import re
+import threading
+
+from GRBLEmulator import simulate_stream
+from PtyServer import PtyServer
+
+
+# ============================================================
+# Firmware Constants (firmwareV4/firmwareV4.ino)
+# ============================================================
+
+STEPS_PER_MM = 87.58
+BED_WIDTH_MM = 380
+BED_HEIGHT_MM = 310
+
+# initRobotSetup(): spd = 100 - 85
+STEP_DELAY_MIN_US = (100 - 85) * 10
+STEP_DELAY_MAX_US = (100 - 85) * 100
+SPEED_STEP = 1
+
+# Time spent on the MePort writes and bookkeeping of one doMove() iteration
+STEP_OVERHEAD_US = 10
+
+POLL_INTERVAL = 0.4  # doMove() checks the serial port every 400 ms
+SERIAL_RX_BUFFER = 64  # HardwareSerial ring buffer
+COMMAND_BUFFER = 64  # char buf[64]
+
+NUMBER_RE = re.compile(r"\s*[-+]?\d+")
+FLOAT_RE = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+def _atoi(text):
+    match = NUMBER_RE.match(text)
+    return int(match.group()) if match else 0
+
+
+def _atof(text):
+    match = FLOAT_RE.match(text)
+    return float(match.group()) if match else 0.0
+
+
+def _print_float(value):
+    """
+    Arduino's Serial.print(float) with its default two decimals.
+    """
+    return f"{value:.2f}"
+
+
+# ============================================================
+# Stepping Model
+# ============================================================
+
+def _delay(step_delay, aux_delay):
+    if step_delay + aux_delay > STEP_DELAY_MAX_US:
+        return aux_delay
+    return step_delay + aux_delay
+
+
+def _delay_range_sum(low, high, aux_delay):
+    """
+    Sum of the iteration delays while mDelay takes every integer value in [low, high] once.
+    """
+    if high < low:
+        return 0
+
+    total = 0
+    cutoff = STEP_DELAY_MAX_US - aux_delay
+    top = min(high, cutoff)
+    if top >= low:
+        count = top - low + 1
+        total += (low + top) * count // 2 + aux_delay * count
+    if high > cutoff:
+        total += aux_delay * (high - max(low, cutoff + 1) + 1)
+    return total
+
+
+def _ramp(start, direction, count, aux_delay):
+    """
+    Delays of ``count`` iterations with mDelay moving by ``direction`` per step from ``start``, clamped to the
+    firmware's limits. Returns (microseconds, final mDelay).
+    """
+    if direction < 0:
+        linear = max(0, min(count, start - STEP_DELAY_MIN_US))
+        total = _delay_range_sum(start - linear, start - 1, aux_delay)
+        total += (count - linear) * _delay(STEP_DELAY_MIN_US, aux_delay)
+        end = max(STEP_DELAY_MIN_US, start - count)
+    else:
+        linear = max(0, min(count, STEP_DELAY_MAX_US - start))
+        total = _delay_range_sum(start + 1, start + linear, aux_delay)
+        total += (count - linear) * _delay(STEP_DELAY_MAX_US, aux_delay)
+        end = min(STEP_DELAY_MAX_US, start + count)
+
+    return total + count * STEP_OVERHEAD_US, end
+
+
+def move_time_us(iterations, steps, aux_delay=0):
+    """
+    Microseconds doMove() spends on its first ``iterations`` iterations of a ``steps`` long move.
+
+    The delay starts at stepdelay_max, drops by SPEED_STEP per iteration down to stepdelay_min and climbs back once
+    fewer than (max - min) / SPEED_STEP iterations remain.
+    """
+    ramp_length = (STEP_DELAY_MAX_US - STEP_DELAY_MIN_US) // SPEED_STEP
+    accelerating = min(steps, max(0, steps - ramp_length + 1) + 1)
+
+    total, step_delay = _ramp(STEP_DELAY_MAX_US, -SPEED_STEP, min(iterations, accelerating), aux_delay)
+    if iterations <= accelerating:
+        return total
+
+    decelerating, _ = _ramp(step_delay, SPEED_STEP, iterations - accelerating, aux_delay)
+    return total + decelerating
+
+
+def iterations_after(elapsed_us, steps, aux_delay=0):
+    low, high = 0, steps
+    while low < high:
+        middle = (low + high + 1) // 2
+        if move_time_us(middle, steps, aux_delay) <= elapsed_us:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+# ============================================================
+# Machine
+# ============================================================
+
+class _Move:
+    __slots__ = ("start", "delta", "steps", "duration", "elapsed", "target", "deferred_ok", "outer_targets")
+
+    def __init__(self, start, delta, steps, duration, target):
+        self.start = start
+        self.delta = delta
+        self.steps = steps
+        self.duration = duration
+        self.elapsed = 0.0
+        self.target = target
+        self.deferred_ok = 0
+        self.outer_targets = []
+
+
+class MakeBlockMachine:
+    """
+    Model of the MakeBlock XY plotter running firmwareV4.
+
+    Commands are space separated, moves block until they finish and only then print "OK". While a move runs the
+    firmware polls the serial port every 400 ms; a complete line found there is executed at once and aborts the
+    move, exactly as process_serial() does. Moves beyond the 380x310 mm bed stall against the frame and lose steps.
+    ``receive``/``advance``/``take_output`` match GRBLMachine so both run behind the same PtyServer.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.output = bytearray()
+        self.counters = collections.Counter()
+
+        self.clock = 0.0
+        self.last_poll = 0.0
+        self.hardware_rx = bytearray()
+        self.command = bytearray()
+
+        self.current = [0.0, 0.0]  # currentX/currentY, the firmware's idea of where it is
+        self.stepper = [0, 0]  # currentXStepperPosition/currentYStepperPosition
+        self.carriage = [0, 0]  # where the carriage physically is, in steps
+        self.aux_delay = 0
+        self.laser_power = 0
+
+        self.move = None
+        self.homing_remaining = 0.0
+
+    def receive(self, data: bytes):
+        for byte in data:
+            if len(self.hardware_rx) >= SERIAL_RX_BUFFER:
+                self.counters["overflows"] += 1
+                continue
+            self.hardware_rx.append(byte)
+
+        self._run_loop()
+
+    def take_output(self) -> bytes:
+        data = bytes(self.output)
+        self.output.clear()
+        return data
+
+    def busy(self):
+        return self.move is not None or self.homing_remaining > 0 or bool(self.hardware_rx)
+
+    def advance(self, elapsed):
+        while elapsed > 0:
+            if self.homing_remaining > 0:
+                step = min(elapsed, self.homing_remaining)
+                self.homing_remaining -= step
+                self.clock += step
+                elapsed -= step
+                self.counters["motion_time"] += step
+                if self.homing_remaining <= 0:
+                    self._println("OK")
+                    self._run_loop()
+                continue
+
+            if self.move is None:
+                self.clock += elapsed
+                self.counters["idle_time"] += elapsed
+                break
+
+            move = self.move
+            next_poll = self.last_poll + POLL_INTERVAL
+            if self.clock >= next_poll - 1e-9:
+                self._poll()
+                continue
+
+            step = min(elapsed, move.duration - move.elapsed, next_poll - self.clock)
+            move.elapsed += step
+            self.clock += step
+            elapsed -= step
+            self.counters["motion_time"] += step
+            if self.laser_power > 0:
+                self.counters["laser_time"] += step
+
+            if move.elapsed >= move.duration:
+                self._finish_move(move.steps)
+
+    def _println(self, text):
+        self.output.extend(text.encode() + b"\r\n")
+
+    def _run_loop(self):
+        """
+        loop(): read one character at a time and run each complete line.
+        """
+        while self.move is None and self.homing_remaining <= 0 and self.hardware_rx:
+            byte = self.hardware_rx.pop(0)
+            self.command.append(byte)
+
+            if byte == ord("\n"):
+                line = self.command.decode(errors="ignore")
+                self.command.clear()
+                self._parse_command(line)
+            elif len(self.command) >= COMMAND_BUFFER:
+                self.command.clear()
+
+    def _poll(self):
+        """
+        process_serial() inside doMove(): a complete line runs immediately and aborts the move in progress.
+        """
+        self.last_poll = self.clock
+        self.command.clear()
+
+        lines = []
+        while self.hardware_rx:
+            byte = self.hardware_rx.pop(0)
+            self.command.append(byte)
+            if byte == ord("\n"):
+                lines.append(self.command.decode(errors="ignore"))
+                self.command.clear()
+            elif len(self.command) >= COMMAND_BUFFER:
+                self.command.clear()
+
+        if not lines:
+            return
+
+        aborted = self.move
+        done = iterations_after(aborted.elapsed * 1e6, aborted.steps, self.aux_delay)
+        self._step_to(aborted, done)
+        self.move = None
+        self.counters["aborted_moves"] += 1
+
+        # The aborted move's own OK is printed after the lines that interrupted it, and prepareMove() then adopts
+        # its target as the current position even though the steppers never got there.
+        for line in lines:
+            self._parse_command(line)
+
+        if self.move is not None:
+            self.move.deferred_ok += 1 + aborted.deferred_ok
+            self.move.outer_targets = [aborted.target] + aborted.outer_targets
+        else:
+            self.current = (aborted.outer_targets or [aborted.target])[-1]
+            for _ in range(1 + aborted.deferred_ok):
+                self._println("OK")
+
+    def _parse_command(self, line):
+        kind = line[:1]
+
+        if kind == "G":
+            code = _atoi(line[1:])
+            if code in (0, 1):
+                if self._parse_coordinate(line[1:]):
+                    return
+            elif code == 28:
+                self._home()
+                return
+        elif kind == "M":
+            code = _atoi(line[1:])
+            argument = line[1:].split(" ", 1)[1] if " " in line[1:] else ""
+            if code == 3:
+                self.aux_delay = _atoi(argument)
+            elif code == 4:
+                self.laser_power = min(100, max(0, _atoi(argument)))
+            elif code == 11:
+                self._echo_end_stops()
+        elif kind == "P":
+            self._println(f"POS X{_print_float(self.current[0])} Y{_print_float(self.current[1])}")
+
+        self._println("OK")
+
+    def _parse_coordinate(self, command):
+        """
+        parseCordinate()/prepareMove(). Returns True when a move was started and OK is deferred.
+        """
+        target = list(self.current)
+        for token in command.split(" ")[1:]:
+            if token.startswith("X"):
+                target[0] = _atof(token[1:])
+            elif token.startswith("Y"):
+                target[1] = _atof(token[1:])
+            elif token.startswith("A"):
+                self.aux_delay = _atoi(token[1:])
+
+        distance = math.hypot(target[0] - self.current[0], target[1] - self.current[1])
+        self._println("distance=" + _print_float(distance))
+        if distance < 0.001:
+            return False
+
+        target_steps = [int(target[0] * STEPS_PER_MM), int(target[1] * STEPS_PER_MM)]
+        delta = [target_steps[0] - self.stepper[0], target_steps[1] - self.stepper[1]]
+        steps = max(abs(delta[0]), abs(delta[1]))
+
+        if steps == 0:
+            self.current = target
+            return False
+
+        duration = move_time_us(steps, steps, self.aux_delay) / 1e6
+        self.move = _Move(list(self.stepper), delta, steps, duration, target)
+        return True
+
+    def _step_to(self, move, iterations):
+        """
+        Applies the first ``iterations`` iterations of a move to the step counters and the carriage.
+        """
+        for axis in (0, 1):
+            if move.steps == iterations:
+                moved = move.delta[axis]
+            else:
+                moved = int(abs(move.delta[axis]) * iterations / move.steps) * (1 if move.delta[axis] > 0 else -1)
+
+            self.stepper[axis] = move.start[axis] + moved
+
+            limit = round((BED_WIDTH_MM if axis == 0 else BED_HEIGHT_MM) * STEPS_PER_MM)
+            carriage = self.carriage[axis] + moved
+            if not 0 <= carriage <= limit:
+                self.counters["limit_crashes"] += 1
+                if self.verbose:
+                    print(f"Carriage hit the frame on {'XY'[axis]} ({carriage / STEPS_PER_MM:.1f} mm)")
+            self.carriage[axis] = min(limit, max(0, carriage))
+
+    def _finish_move(self, iterations):
+        move = self.move
+        self._step_to(move, iterations)
+        self.move = None
+        self.current = (move.outer_targets or [move.target])[-1]
+        self.counters["moves"] += 1
+
+        for _ in range(1 + move.deferred_ok):
+            self._println("OK")
+
+        self._run_loop()
+
+    def _home(self):
+        """
+        goHome(): Y then X run backwards at the fastest step rate until a switch closes.
+        """
+        self.aux_delay = 0
+        self.laser_power = 0
+
+        steps = self.carriage[0] + self.carriage[1]
+        self.homing_remaining = steps * (STEP_DELAY_MIN_US + STEP_OVERHEAD_US) / 1e6
+
+        self.carriage = [0, 0]
+        self.stepper = [0, 0]
+        self.current = [0.0, 0.0]
+
+        if self.homing_remaining <= 0:
+            self._println("OK")
+
+    def _echo_end_stops(self):
+        """
+        M11 reports ylimit_pin2 ylimit_pin1 xlimit_pin2 xlimit_pin1, 0 = pressed. Pin 1 is taken to be the minimum
+        switch and pin 2 the maximum switch.
+        """
+        x_limit = round(BED_WIDTH_MM * STEPS_PER_MM)
+        y_limit = round(BED_HEIGHT_MM * STEPS_PER_MM)
+        states = [
+            int(self.carriage[1] < y_limit),
+            int(self.carriage[1] > 0),
+            int(self.carriage[0] < x_limit),
+            int(self.carriage[0] > 0),
+        ]
+        self._println("M11 " + " ".join(str(state) for state in states))
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def serve(speed, baudrate):
+    machine = MakeBlockMachine(verbose=True)
+    server = PtyServer(machine, baudrate=baudrate, speed=speed)
+    print(f"MakeBlock firmwareV4 emulator listening on {server.port} (Ctrl+C to stop)")
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+        thread.join()
+        counters = machine.counters
+        print(
+            f"\nMoves: {counters['moves']}, aborted: {counters['aborted_moves']}, "
+            f"frame hits: {counters['limit_crashes']}, dropped bytes: {counters['overflows']}"
+        )
+
+
+def time_files(files, host_latency, baudrate):
+    print(f"\n{'File':<40} {'Job (s)':>10} {'Motion (s)':>11} {'Laser (s)':>10} {'Aborted':>8}")
+
+    for file in files:
+        with open(file, "r") as f:
+            lines = f.read().splitlines()
+
+        machine = MakeBlockMachine()
+        result = simulate_stream(
+            lines, "send-and-wait", machine=machine, baudrate=baudrate, host_latency=host_latency
+        )
+        print(
+            f"{os.path.basename(file):<40} {result['time']:>10.2f} {result['motion_time']:>11.2f} "
+            f"{machine.counters['laser_time']:>10.2f} {machine.counters['aborted_moves']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MakeBlock firmwareV4 emulator on a pseudo-terminal")
+    subparsers = parser.add_subparsers(dest="mode")
+
+    serve_parser = subparsers.add_parser("serve", help="expose the emulator on a pty")
+    serve_parser.add_argument("--speed", type=float, default=1.0, help="machine time per wall clock second")
+    serve_parser.add_argument("--baud", type=int, default=115200)
+
+    time_parser = subparsers.add_parser("time", help="time files sent line by line on a simulated clock")
+    time_parser.add_argument("files", nargs="+")
+    time_parser.add_argument("--latency", type=float, default=0.002, help="host turnaround per response (s)")
+    time_parser.add_argument("--baud", type=int, default=115200)
+
+    args = parser.parse_args()
+
+    if args.mode == "time":
+        time_files(args.files, args.latency, args.baud)
+    else:
+        serve(getattr(args, "speed", 1.0), getattr(args, "baud", 115200))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,8 @@ from svg_to_gcode.compiler.interfaces import Interface
 from svg_to_gcode.geometry import LineSegmentChain
 from svg_to_gcode.geometry import Vector
 
+from CurveFlattener import line_chains
+
 
 class MakeBlockXYLaserPlotterCompiler(Compiler):
     """
@@ -63,6 +65,14 @@ class MakeBlockXYLaserPlotterCompiler(Compiler):
 
         self.body.extend(code)
 
+    def append_curves(self, curves):
+        """
+        Draws curves by flattening them to line segments (all curves in one batch, to TOLERANCES["approximation"])
+        and calling self.append_line_chain(). The resulting code is appended to "self.body"
+        """
+        for line_chain in line_chains(curves, TOLERANCES["approximation"]):
+            self.append_line_chain(line_chain)
+
     def clear_curves(self):
         self.body.clear()
 
@@ -205,6 +215,14 @@ class MakeBlockXYPenPlotterCompiler(Compiler):
 
         self.body.extend(code)
 
+    def append_curves(self, curves):
+        """
+        Draws curves by flattening them to line segments (all curves in one batch, to TOLERANCES["approximation"])
+        and calling self.append_line_chain(). The resulting code is appended to "self.body"
+        """
+        for line_chain in line_chains(curves, TOLERANCES["approximation"]):
+            self.append_line_chain(line_chain)
+
     def clear_curves(self):
         self.body.clear()
 
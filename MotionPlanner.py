@@ -0,0 +1,309 @@
+import collections
+import math
+
+
+# ============================================================
+# Machine Profiles
+# ============================================================
+
+# Matches the limits GRBL_Set_Acceleration.py writes to the plotters.
+DEFAULT_PROFILE = {
+    "max_rate": (1300.0, 1300.0, 600.0),  # mm/min ($110-$112)
+    "acceleration": (1900.0, 1900.0, 500.0),  # mm/sec^2 ($120-$122)
+    "junction_deviation": 0.01,  # mm ($11)
+}
+
+MINIMUM_JUNCTION_SPEED = 0.0  # mm/sec
+MINIMUM_FEED_RATE = 1.0  # mm/min
+
+
+def profile_from_grbl_settings(settings: dict) -> dict:
+    """
+    Builds a motion profile from a settings dictionary as returned by read_all_settings() ({"$110": "1300.000"}).
+    """
+
+    def value(key, default):
+        return float(settings.get(key, default))
+
+    defaults = DEFAULT_PROFILE
+    return {
+        "max_rate": tuple(value(f"${110 + i}", defaults["max_rate"][i]) for i in range(3)),
+        "acceleration": tuple(value(f"${120 + i}", defaults["acceleration"][i]) for i in range(3)),
+        "junction_deviation": value("$11", defaults["junction_deviation"]),
+    }
+
+
+# ============================================================
+# Trapezoids
+# ============================================================
+
+def trapezoid(distance, entry_speed, nominal_speed, exit_speed, acceleration):
+    """
+    Splits a move into accelerate, cruise and decelerate distances.
+
+    Returns (accelerate_distance, cruise_distance, decelerate_distance, peak_speed). Speeds in mm/sec.
+    """
+    accelerate = (nominal_speed ** 2 - entry_speed ** 2) / (2 * acceleration)
+    decelerate = (nominal_speed ** 2 - exit_speed ** 2) / (2 * acceleration)
+
+    if accelerate + decelerate <= distance:
+        return accelerate, distance - accelerate - decelerate, decelerate, nominal_speed
+
+    # Triangle profile: the nominal speed is never reached
+    peak_squared = (2 * acceleration * distance + entry_speed ** 2 + exit_speed ** 2) / 2
+    peak = math.sqrt(max(peak_squared, entry_speed ** 2, exit_speed ** 2))
+    accelerate = min(distance, max(0.0, (peak ** 2 - entry_speed ** 2) / (2 * acceleration)))
+    return accelerate, 0.0, distance - accelerate, peak
+
+
+def trapezoid_time(distance, entry_speed, nominal_speed, exit_speed, acceleration):
+    if distance <= 0:
+        return 0.0
+
+    _, cruise, _, peak = trapezoid(distance, entry_speed, nominal_speed, exit_speed, acceleration)
+    time = (peak - entry_speed) / acceleration + (peak - exit_speed) / acceleration
+
+    if cruise > 0:
+        time += cruise / nominal_speed
+
+    return time
+
+
+def trapezoid_distance(elapsed, distance, entry_speed, nominal_speed, exit_speed, acceleration):
+    """
+    Distance covered after ``elapsed`` seconds of a trapezoid move.
+    """
+    accelerate, cruise, _, peak = trapezoid(distance, entry_speed, nominal_speed, exit_speed, acceleration)
+
+    accelerate_time = (peak - entry_speed) / acceleration
+    if elapsed <= accelerate_time:
+        return entry_speed * elapsed + 0.5 * acceleration * elapsed ** 2
+
+    elapsed -= accelerate_time
+    cruise_time = cruise / nominal_speed if cruise > 0 else 0.0
+    if elapsed <= cruise_time:
+        return accelerate + peak * elapsed
+
+    elapsed -= cruise_time
+    decelerate_time = (peak - exit_speed) / acceleration
+    elapsed = min(elapsed, decelerate_time)
+    return min(distance, accelerate + cruise + peak * elapsed - 0.5 * acceleration * elapsed ** 2)
+
+
+# ============================================================
+# Arcs
+# ============================================================
+
+def arc_points(start, target, clockwise, offset=None, radius=None, tolerance=0.002):
+    """
+    Splits a G2/G3 arc into the chord end points GRBL's mc_arc() would queue, ending with ``target``.
+
+    The center is given either as the I/J ``offset`` from ``start`` or as a signed ``radius``. Returns None when the
+    arc cannot be drawn (zero radius, or a radius too small to reach the target).
+    """
+    x, y = target[0] - start[0], target[1] - start[1]
+
+    if offset is None:
+        h_x2_div_d = 4.0 * radius * radius - x * x - y * y
+        if h_x2_div_d < 0 or (x == 0 and y == 0):
+            return None
+        h_x2_div_d = -math.sqrt(h_x2_div_d) / math.hypot(x, y)
+        if not clockwise:
+            h_x2_div_d = -h_x2_div_d
+        if radius < 0:
+            h_x2_div_d = -h_x2_div_d
+            radius = -radius
+        offset_i = 0.5 * (x - y * h_x2_div_d)
+        offset_j = 0.5 * (y + x * h_x2_div_d)
+    else:
+        offset_i, offset_j = offset
+        radius = math.hypot(offset_i, offset_j)
+        if radius == 0:
+            return None
+
+    center = (start[0] + offset_i, start[1] + offset_j)
+    r_start = (-offset_i, -offset_j)
+    r_end = (target[0] - center[0], target[1] - center[1])
+
+    angular_travel = math.atan2(
+        r_start[0] * r_end[1] - r_start[1] * r_end[0], r_start[0] * r_end[0] + r_start[1] * r_end[1]
+    )
+    if clockwise:
+        if angular_travel >= -5e-7:
+            angular_travel -= 2 * math.pi
+    elif angular_travel <= 5e-7:
+        angular_travel += 2 * math.pi
+
+    segments = int(abs(0.5 * angular_travel * radius) / math.sqrt(tolerance * (2 * radius - tolerance)))
+
+    points = []
+    start_angle = math.atan2(r_start[1], r_start[0])
+    for i in range(1, segments):
+        angle = start_angle + angular_travel * i / segments
+        points.append([
+            center[0] + radius * math.cos(angle),
+            center[1] + radius * math.sin(angle),
+            start[2] + (target[2] - start[2]) * i / segments,
+        ])
+
+    points.append(list(target))
+    return points
+
+
+# ============================================================
+# Planner
+# ============================================================
+
+class PlannerBlock:
+    """
+    A straight move queued in the planner. Speeds are in mm/sec, distances in mm.
+    """
+
+    __slots__ = (
+        "start", "end", "distance", "unit", "nominal_speed", "acceleration",
+        "max_entry_speed", "entry_speed", "exit_speed", "rapid", "tag",
+    )
+
+    def __init__(self, start, end, distance, unit, nominal_speed, acceleration, rapid, tag):
+        self.start = start
+        self.end = end
+        self.distance = distance
+        self.unit = unit
+        self.nominal_speed = nominal_speed
+        self.acceleration = acceleration
+        self.max_entry_speed = 0.0
+        self.entry_speed = 0.0
+        self.exit_speed = 0.0
+        self.rapid = rapid
+        self.tag = tag
+
+    def duration(self):
+        return trapezoid_time(self.distance, self.entry_speed, self.nominal_speed, self.exit_speed, self.acceleration)
+
+    def distance_at(self, elapsed):
+        return trapezoid_distance(
+            elapsed, self.distance, self.entry_speed, self.nominal_speed, self.exit_speed, self.acceleration
+        )
+
+    def position_at(self, elapsed):
+        travelled = self.distance_at(elapsed)
+        return tuple(s + u * travelled for s, u in zip(self.start, self.unit))
+
+
+class MotionPlanner:
+    """
+    GRBL-style look-ahead planner.
+
+    Junction speeds follow the junction deviation model and every add replans the queue with a backward and a
+    forward pass. The first queued block's entry speed is fixed once the block ahead of it has been handed out by
+    pop(), which is what makes an empty queue (a starved planner) bring the machine to a stop.
+    """
+
+    def __init__(self, profile=None, size=16):
+        self.profile = profile or DEFAULT_PROFILE
+        self.size = size
+        self.blocks = collections.deque()
+        self.previous_unit = None
+        self.previous_nominal_speed = 0.0
+        self.committed_exit_speed = 0.0
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def is_full(self):
+        return len(self.blocks) >= self.size
+
+    def clear(self):
+        self.blocks.clear()
+        self.previous_unit = None
+        self.previous_nominal_speed = 0.0
+        self.committed_exit_speed = 0.0
+
+    def add(self, start, end, feed=None, rapid=False, tag=None):
+        """
+        Queues a move from ``start`` to ``end`` (xyz tuples in mm) at ``feed`` mm/min. Zero length moves are dropped
+        and return None.
+        """
+        delta = [e - s for s, e in zip(start, end)]
+        distance = math.sqrt(sum(d * d for d in delta))
+        if distance < 1e-6:
+            return None
+
+        unit = tuple(d / distance for d in delta)
+
+        speed_limit = min(
+            rate / 60 / abs(u) for rate, u in zip(self.profile["max_rate"], unit) if abs(u) > 1e-12
+        )
+        acceleration = min(
+            accel / abs(u) for accel, u in zip(self.profile["acceleration"], unit) if abs(u) > 1e-12
+        )
+
+        if rapid or feed is None:
+            nominal_speed = speed_limit
+        else:
+            nominal_speed = min(max(feed, MINIMUM_FEED_RATE) / 60, speed_limit)
+
+        block = PlannerBlock(tuple(start), tuple(end), distance, unit, nominal_speed, acceleration, rapid, tag)
+
+        if self.blocks or self.committed_exit_speed > 0:
+            block.max_entry_speed = min(
+                self._junction_speed(unit, acceleration), nominal_speed, self.previous_nominal_speed
+            )
+        else:
+            block.max_entry_speed = 0.0
+
+        self.previous_unit = unit
+        self.previous_nominal_speed = nominal_speed
+
+        if not self.blocks:
+            block.entry_speed = min(self.committed_exit_speed, block.max_entry_speed)
+
+        self.blocks.append(block)
+        self._recalculate()
+        return block
+
+    def pop(self) -> PlannerBlock:
+        """
+        Hands the oldest block to the executor and fixes its exit speed.
+        """
+        block = self.blocks.popleft()
+        block.exit_speed = self.blocks[0].entry_speed if self.blocks else 0.0
+        self.committed_exit_speed = block.exit_speed
+        return block
+
+    def _junction_speed(self, unit, acceleration):
+        if self.previous_unit is None:
+            return 0.0
+
+        cos_theta = -sum(p * u for p, u in zip(self.previous_unit, unit))
+        if cos_theta > 0.999999:
+            # Full reversal
+            return MINIMUM_JUNCTION_SPEED
+        if cos_theta < -0.999999:
+            # Straight line
+            return float("inf")
+
+        sin_theta_d2 = math.sqrt(0.5 * (1.0 - cos_theta))
+        speed_squared = acceleration * self.profile["junction_deviation"] * sin_theta_d2 / (1.0 - sin_theta_d2)
+        return max(MINIMUM_JUNCTION_SPEED, math.sqrt(speed_squared))
+
+    def _recalculate(self):
+        blocks = self.blocks
+
+        # Backward pass: every block must be able to stop by the end of the queue
+        next_entry = 0.0
+        for block in reversed(blocks):
+            if block is blocks[0]:
+                break
+            block.entry_speed = min(
+                block.max_entry_speed,
+                math.sqrt(next_entry ** 2 + 2 * block.acceleration * block.distance),
+            )
+            next_entry = block.entry_speed
+
+        # Forward pass: and reach its entry speed from the block before
+        for previous, block in zip(blocks, list(blocks)[1:]):
+            block.entry_speed = min(
+                block.entry_speed,
+                math.sqrt(previous.entry_speed ** 2 + 2 * previous.acceleration * previous.distance),
+            )
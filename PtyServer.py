@@ -0,0 +1,102 @@
+import collections
+import os
+import select
+import time
+import tty
+
+
+# ============================================================
+# Serial Wire
+# ============================================================
+
+class SerialWire:
+    """
+    Releases bytes no faster than a UART at the given baud rate would (8N1, ten bits per byte).
+    """
+
+    def __init__(self, baudrate=115200):
+        self.byte_time = 10.0 / baudrate
+        self.queue = collections.deque()
+        self.credit = 0.0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, data: bytes):
+        self.queue.extend(data)
+
+    def release(self, elapsed) -> bytes:
+        if not self.queue:
+            self.credit = 0.0
+            return b""
+
+        self.credit += elapsed
+        count = min(len(self.queue), int(self.credit / self.byte_time))
+        self.credit -= count * self.byte_time
+        return bytes(self.queue.popleft() for _ in range(count))
+
+    def clear(self):
+        self.queue.clear()
+        self.credit = 0.0
+
+
+# ============================================================
+# Pseudo-Terminal Server
+# ============================================================
+
+class PtyServer:
+    """
+    Exposes an emulated controller on a pseudo-terminal so the senders can open it like /dev/ttyUSB0.
+
+    ``machine`` must provide receive(bytes), advance(seconds) and take_output() -> bytes. ``speed`` runs machine
+    time faster than the wall clock; the serial link itself is always throttled to ``baudrate``.
+    """
+
+    def __init__(self, machine, baudrate=115200, speed=1.0, tick=0.001):
+        self.machine = machine
+        self.speed = speed
+        self.tick = tick
+        self.rx_wire = SerialWire(baudrate)
+        self.tx_wire = SerialWire(baudrate)
+
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self.running = False
+
+    def serve_forever(self):
+        self.running = True
+        last = time.monotonic()
+
+        try:
+            while self.running:
+                readable, _, _ = select.select([self.master_fd], [], [], self.tick)
+                if readable:
+                    self.rx_wire.push(os.read(self.master_fd, 4096))
+
+                now = time.monotonic()
+                elapsed = now - last
+                last = now
+
+                data = self.rx_wire.release(elapsed)
+                if data:
+                    self.machine.receive(data)
+
+                self.machine.advance(elapsed * self.speed)
+                self.tx_wire.push(self.machine.take_output())
+
+                output = self.tx_wire.release(elapsed)
+                if output:
+                    os.write(self.master_fd, output)
+        finally:
+            self.close()
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        for fd in (self.master_fd, self.slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
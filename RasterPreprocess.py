@@ -0,0 +1,135 @@
+import argparse
+import time
+import typing
+
+import numpy as np
+from PIL import Image
+
+# GRBL laser travel ($130, $131) and the diameter of the burn its spot leaves
+BED_WIDTH_MM = 200
+BED_HEIGHT_MM = 200
+SPOT_SIZE_MM = 0.15
+
+# Integer reduce() gets the image to within this factor of its final size; resampling does the rest
+REDUCING_GAP = 2
+
+
+# ============================================================
+# Raster Size
+# ============================================================
+# Rastering costs time per pixel, and pixels finer than the laser spot only burn over each other. The image is
+# resampled to the pitch the spot can resolve before any other work is done on it, JPEGs already while decoding.
+
+class RasterSize(typing.NamedTuple):
+    """
+    The pixels an image is rastered at and the pitch (mm per pixel) between them.
+    """
+    width: int
+    height: int
+    pitch: float
+
+
+def raster_size(image_size, mm_per_pixel=0.1, width_mm=None, bed=(BED_WIDTH_MM, BED_HEIGHT_MM),
+                spot_size=SPOT_SIZE_MM) -> RasterSize:
+    """
+    The raster for an image of ``image_size`` pixels. Its physical size is ``width_mm`` wide, or the image at
+    ``mm_per_pixel`` as before, shrunk to fit the bed either way. Pixels are no closer than the spot size and never
+    more than the image has.
+    """
+    native_width, native_height = image_size
+    width_mm = width_mm or native_width * mm_per_pixel
+    height_mm = width_mm * native_height / native_width
+    fit = min(1.0, bed[0] / width_mm, bed[1] / height_mm)
+    width_mm, height_mm = width_mm * fit, height_mm * fit
+
+    pitch = max(mm_per_pixel, spot_size)
+    width = min(native_width, max(1, round(width_mm / pitch)))
+    height = min(native_height, max(1, round(height_mm / pitch)))
+    return RasterSize(width, height, width_mm / width)
+
+
+# ============================================================
+# Tone
+# ============================================================
+
+def tone_lut(gamma=1.0, contrast=1.0, brightness=0.0) -> np.ndarray:
+    """
+    One 256 entry table doing all tone corrections at once: gamma (above 1 darkens the mid tones), then contrast
+    about mid grey and a brightness shift in grey levels.
+    """
+    levels = np.arange(256) / 255
+    levels = levels ** gamma
+    levels = (levels - 0.5) * contrast + 0.5 + brightness / 255
+    return np.clip(np.rint(levels * 255), 0, 255).astype(np.uint8)
+
+
+# ============================================================
+# Loading
+# ============================================================
+
+class RasterPreprocessor:
+    """
+    Loads an image for rastering: decoded at reduced size where the format allows (JPEG DCT scaling), brought near
+    the raster size with integer reduce(), resampled to it, and tone corrected through one lookup table.
+    """
+
+    def __init__(self, width_mm=None, bed=(BED_WIDTH_MM, BED_HEIGHT_MM), spot_size=SPOT_SIZE_MM, gamma=1.0,
+                 contrast=1.0, brightness=0.0):
+        self.width_mm = width_mm
+        self.bed = bed
+        self.spot_size = spot_size
+        self.lut = tone_lut(gamma, contrast, brightness)
+
+    def load(self, img_path, mm_per_pixel=0.1) -> tuple:
+        """
+        The grey levels (uint8) of the image at its raster size, and the pitch (mm per pixel) to raster them at.
+        """
+        img = Image.open(img_path)
+        size = raster_size(img.size, mm_per_pixel, self.width_mm, self.bed, self.spot_size)
+
+        # Only takes effect for JPEGs, which then decode at 1/2, 1/4 or 1/8 size, still at least as large as asked
+        img.draft("L", (size.width, size.height))
+        img = img.convert("L")
+
+        factor = min(img.width // size.width, img.height // size.height) // REDUCING_GAP
+        if factor > 1:
+            img = img.reduce(factor)
+        if img.size != (size.width, size.height):
+            img = img.resize((size.width, size.height), Image.LANCZOS)
+
+        return np.take(self.lut, np.asarray(img)), size.pitch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the raster size of an image, and time loading it at that size")
+    parser.add_argument("image")
+    parser.add_argument("--mm-per-pixel", type=float, default=0.1)
+    parser.add_argument("--width", type=float, help="engraving width (mm)")
+    parser.add_argument("--spot", type=float, default=SPOT_SIZE_MM, help="laser spot size (mm)")
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--contrast", type=float, default=1.0)
+    parser.add_argument("--output", help="write the preprocessed image here")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    native = np.asarray(Image.open(args.image).convert("L"))
+    native_seconds = time.perf_counter() - start
+
+    preprocessor = RasterPreprocessor(args.width, spot_size=args.spot, gamma=args.gamma, contrast=args.contrast)
+    start = time.perf_counter()
+    pixels, pitch = preprocessor.load(args.image, args.mm_per_pixel)
+    seconds = time.perf_counter() - start
+
+    height, width = native.shape
+    print(f"native   {width}x{height} px in {native_seconds:.2f} s")
+    print(f"raster   {pixels.shape[1]}x{pixels.shape[0]} px at {pitch:.3f} mm "
+          f"({pixels.shape[1] * pitch:.1f} x {pixels.shape[0] * pitch:.1f} mm) in {seconds:.2f} s, "
+          f"{pixels.size / native.size:.1%} of the pixels")
+
+    if args.output:
+        Image.fromarray(pixels).save(args.output)
+        print(f"Saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
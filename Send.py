@@ -1,56 +1,176 @@
 import sys
+import collections
+import threading
+import time
 import serial
 import glob
 
-from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QFileDialog, QMessageBox)
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QIcon, QKeySequence
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QFileDialog, QMessageBox, QProgressBar, QLabel, QPushButton,
+                             QHBoxLayout, QShortcut)
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
 
 from ui import Ui_MainWindow  # Import the generated UI code
+from GrblRealtime import (KEY_BINDINGS, CYCLE_START, FEED_HOLD, SOFT_RESET, FEED_OVERRIDE_MINUS_10,
+                          FEED_OVERRIDE_RESET, FEED_OVERRIDE_PLUS_10, key_label)
+from ToolpathPreview import ToolpathPreview
 
 FINISHED_RESPONSE = "ok\r\n"
 
+MAX_LOG_LINES = 2000  # lines kept in the log view and waiting to be shown
+LOG_FRAME_RATE = 30  # log flushes per second
+THROUGHPUT_WINDOW = 2.0  # seconds averaged by the throughput readout
+
+# Real-time buttons shown under Home/E-Stop; every binding in KEY_BINDINGS also has a keyboard shortcut
+REALTIME_BUTTONS = (
+    ("Hold", FEED_HOLD),
+    ("Resume", CYCLE_START),
+    ("Soft Reset", SOFT_RESET),
+    ("Feed -10%", FEED_OVERRIDE_MINUS_10),
+    ("Feed 100%", FEED_OVERRIDE_RESET),
+    ("Feed +10%", FEED_OVERRIDE_PLUS_10),
+)
+
 
 class SerialCommunicator:
     def __init__(self, port, baudrate=115200):
-        self.serial_port = serial.Serial(port, baudrate)
-
-    def send(self, command):
-        self.serial_port.reset_output_buffer()
-        self.serial_port.reset_input_buffer()
-        if not command.endswith("\n"):
-            command += "\n"
-        self.serial_port.write(command.encode())
+        # The timeout lets wait_for_ok notice a soft reset even if the controller stays silent
+        self.serial_port = serial.Serial(port, baudrate, timeout=0.5)
+        self.write_lock = threading.Lock()
+        self.reset_event = threading.Event()
+        self.resets = 0  # soft resets sent so far
+
+    def send(self, command, resets=None):
+        """
+        Writes a line. Given ``resets`` (a count read from self.resets), only while no soft reset has been sent
+        since; returns whether the line was written.
+        """
+        with self.write_lock:
+            if resets is not None and resets != self.resets:
+                return False
+
+            # A reset before this line is over, its banner dropped with the input below
+            self.reset_event.clear()
+            self.serial_port.reset_output_buffer()
+            self.serial_port.reset_input_buffer()
+            if not command.endswith("\n"):
+                command += "\n"
+            self.serial_port.write(command.encode())
+            return True
+
+    def send_realtime(self, command: bytes):
+        """
+        Writes a real-time command straight to the port, from any thread, without waiting for the line in flight.
+        """
+        with self.write_lock:
+            self.serial_port.write(command)
+            self.serial_port.flush()
+
+            if command == SOFT_RESET:
+                self.resets += 1
+                self.reset_event.set()
 
     def read(self):
-        return self.serial_port.readline().decode()
+        return self.serial_port.readline().decode(errors="ignore")
 
     def wait_for_ok(self):
         response = ""
         while True:
             response += self.read()
-            if FINISHED_RESPONSE in response:
+            if FINISHED_RESPONSE in response.lower() or self.reset_event.is_set():
                 return response
 
     def close(self):
         if self.serial_port.is_open:
             self.serial_port.close()
 
-class GCodeUploader(QThread):
-    progress_signal = pyqtSignal(str)
+class LogBuffer:
+    """
+    Bounded buffer between the threads that produce log lines and the log view.
+
+    Producers append from any thread; the GUI drains everything once per frame. When the GUI falls behind, the
+    oldest lines are dropped and replaced by a single note saying how many were skipped.
+    """
+
+    def __init__(self, capacity=MAX_LOG_LINES):
+        self.lock = threading.Lock()
+        self.pending = collections.deque(maxlen=capacity)
+        self.dropped = 0
+
+    def append(self, message):
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(message.replace("\r", "").rstrip("\n"))
+
+    def drain(self):
+        with self.lock:
+            lines = list(self.pending)
+            dropped = self.dropped
+            self.pending.clear()
+            self.dropped = 0
+
+        if dropped:
+            lines.insert(0, f"... {dropped} lines skipped ...")
+        return lines
+
+
+class ThroughputMeter:
+    """
+    Lines and bytes per second over the last few seconds of cumulative counter samples.
+    """
+
+    def __init__(self, window=THROUGHPUT_WINDOW):
+        self.window = window
+        self.samples = collections.deque()
+
+    def reset(self):
+        self.samples.clear()
+
+    def sample(self, lines, sent_bytes, now=None):
+        now = time.monotonic() if now is None else now
+        self.samples.append((now, lines, sent_bytes))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+        first_time, first_lines, first_bytes = self.samples[0]
+        elapsed = now - first_time
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return (lines - first_lines) / elapsed, (sent_bytes - first_bytes) / elapsed
+
+
+class GCodeUploader(QObject):
+    finished = pyqtSignal()
 
-    def __init__(self, serial_communicator, file_path):
+    def __init__(self, serial_communicator, file_path, log):
         super().__init__()
         self.serial_communicator = serial_communicator
         self.file_path = file_path
+        self.log = log
+
+        # Read by the GUI thread on every frame
+        self.total_lines = 0
+        self.lines_sent = 0
+        self.bytes_sent = 0
 
     def run(self):
         with open(self.file_path, "r") as f:
             lines = f.readlines()
-            for line in lines:
-                self.serial_communicator.send(line)
-                received = self.serial_communicator.wait_for_ok()
-                self.progress_signal.emit(f"Received: {received}")
+
+        self.total_lines = len(lines)
+        resets = self.serial_communicator.resets
+        for line in lines:
+            if not self.serial_communicator.send(line, resets):
+                self.log.append("Soft reset: upload aborted. Send $X to unlock.")
+                break
+
+            received = self.serial_communicator.wait_for_ok()
+            self.lines_sent += 1
+            self.bytes_sent += len(line.rstrip("\n")) + 1
+            self.log.append(f"Received: {received.strip()}")
+
+        self.finished.emit()
 
 
 class SerialApp(QMainWindow):
@@ -61,6 +181,29 @@ class SerialApp(QMainWindow):
 
         self.serial_communicator: SerialCommunicator | None = None
         self.uploader_thread = None
+        self.uploader_worker = None
+
+        # The log view is only touched by flush_log, in batches, at a fixed frame rate
+        self.log = LogBuffer()
+        self.ui.responseText.document().setMaximumBlockCount(MAX_LOG_LINES)
+        self.throughput = ThroughputMeter()
+
+        self.progressBar = QProgressBar()
+        self.progressBar.setFormat("%v / %m lines (%p%)")
+        self.progressBar.setValue(0)
+        self.progressBar.hide()
+        self.throughputLabel = QLabel()
+        self.ui.statusbar.addPermanentWidget(self.throughputLabel)
+        self.ui.statusbar.addPermanentWidget(self.progressBar)
+
+        # Preview of the selected file above the log, advanced by the upload's acknowledgements
+        self.preview = ToolpathPreview(self.ui.centralwidget)
+        layout = self.ui.verticalLayout_2
+        layout.insertWidget(layout.indexOf(self.ui.responseText), self.preview, 2)
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self.flush_log)
+        self.flush_timer.start(1000 // LOG_FRAME_RATE)
 
         # Connect signals and slots
         self.ui.connectButton.clicked.connect(self.connect)
@@ -73,6 +216,26 @@ class SerialApp(QMainWindow):
 
         self.ui.commandEntry.returnPressed.connect(self.send_command)
 
+        # Real-time commands bypass the line queue, so they work while an upload is waiting for "ok"
+        realtime_layout = QHBoxLayout()
+        for label, command in REALTIME_BUTTONS:
+            button = QPushButton(label, self.ui.centralwidget)
+            button.clicked.connect(lambda checked, command=command, label=label: self.send_realtime(command, label))
+            realtime_layout.addWidget(button)
+        layout = self.ui.verticalLayout_2
+        for index in range(layout.count()):
+            if layout.itemAt(index).layout() is self.ui.buttonLayout:
+                layout.insertLayout(index + 1, realtime_layout)
+                break
+
+        self.realtime_shortcuts = []
+        for key, command, description in KEY_BINDINGS:
+            shortcut = QShortcut(QKeySequence(key_label(key)), self)
+            shortcut.activated.connect(
+                lambda command=command, description=description: self.send_realtime(command, description)
+            )
+            self.realtime_shortcuts.append(shortcut)
+
         self.update_ports()
 
     def show_no_open_port_warning(self):
@@ -90,16 +253,16 @@ class SerialApp(QMainWindow):
         if self.serial_communicator and self.serial_communicator.serial_port.is_open:
             self.serial_communicator.close()
             self.ui.connectButton.setText("Connect")
-            self.ui.responseText.append("Disconnected from port\n")
+            self.log.append("Disconnected from port\n")
             return
 
         port = self.ui.portCombo.currentText()
         try:
             self.serial_communicator = SerialCommunicator(port)
-            self.ui.responseText.append(f"Connected to port: {self.serial_communicator.serial_port.name}\n")
+            self.log.append(f"Connected to port: {self.serial_communicator.serial_port.name}\n")
             self.ui.connectButton.setText("Disconnect")
         except Exception as e:
-            self.ui.responseText.append(f"Error: {str(e)}\n")
+            self.log.append(f"Error: {str(e)}\n")
 
     def send_command(self):
         if not self.serial_communicator or not self.serial_communicator.serial_port.is_open:
@@ -108,47 +271,54 @@ class SerialApp(QMainWindow):
         command = self.ui.commandEntry.text()
         if command:
             self.serial_communicator.send(command)
-            self.ui.responseText.append(f"Sent: {command}")
+            self.log.append(f"Sent: {command}")
             response = self.serial_communicator.wait_for_ok()
-            self.ui.responseText.append(f"Received: {response}")
+            self.log.append(f"Received: {response}")
 
         self.ui.commandEntry.clear()
 
     def send_home_command(self):
         if self.serial_communicator and self.serial_communicator.serial_port.is_open:
             self.serial_communicator.send("G28")
-            self.ui.responseText.append("Sent: G28 (Homing)\n")
+            self.log.append("Sent: G28 (Homing)\n")
             response = self.serial_communicator.wait_for_ok()
-            self.ui.responseText.append(f"Received: {response}\n")
+            self.log.append(f"Received: {response}\n")
         else:
             return self.show_no_open_port_warning()
 
     def send_stop_command(self):
         if self.serial_communicator and self.serial_communicator.serial_port.is_open:
-            self.serial_communicator.send("M4\nG28")
-            self.ui.responseText.append("Sent: M4 + G28 (Emergency Stop)\n")
-            response = self.serial_communicator.wait_for_ok()
-            self.ui.responseText.append(f"Received: {response}\n")
+            # Hold first so the machine decelerates, then reset to drop everything queued behind it
+            self.serial_communicator.send_realtime(FEED_HOLD)
+            self.serial_communicator.send_realtime(SOFT_RESET)
+            self.log.append("Sent: Feed hold + Soft reset (Emergency Stop)\n")
         else:
             return self.show_no_open_port_warning()
 
+    def send_realtime(self, command, description):
+        if not self.serial_communicator or not self.serial_communicator.serial_port.is_open:
+            return self.show_no_open_port_warning()
+
+        self.serial_communicator.send_realtime(command)
+        self.log.append(f"Sent: {description}")
+
     def laser_on(self):
         if self.serial_communicator and self.serial_communicator.serial_port.is_open:
             power = self.ui.laserPowerSlider.value() * (1000 / 255)
             # self.serial_communicator.send(f"M4 {power}\n")
             self.serial_communicator.send(f"M4 S{int(power)}\n")
-            self.ui.responseText.append(f"Sent: M4 {power} (Laser On)\n")
+            self.log.append(f"Sent: M4 {power} (Laser On)\n")
             response = self.serial_communicator.wait_for_ok()
-            self.ui.responseText.append(f"Received: {response}\n")
+            self.log.append(f"Received: {response}\n")
         else:
             return self.show_no_open_port_warning()
 
     def laser_off(self):
         if self.serial_communicator and self.serial_communicator.serial_port.is_open:
             self.serial_communicator.send("M4 S0")
-            self.ui.responseText.append("Sent: M4 (Laser Off)\n")
+            self.log.append("Sent: M4 (Laser Off)\n")
             response = self.serial_communicator.wait_for_ok()
-            self.ui.responseText.append(f"Received: {response}\n")
+            self.log.append(f"Received: {response}\n")
         else:
             return self.show_no_open_port_warning()
 
@@ -160,31 +330,55 @@ class SerialApp(QMainWindow):
         if not file_path:
             return
 
-        self.ui.responseText.append(f"Uploading file: {file_path}\n")
+        self.log.append(f"Uploading file: {file_path}\n")
+        self.preview.load_file(file_path)
+        self.progressBar.show()
 
         # Ensure previous thread is cleaned up
         if self.uploader_thread is not None and self.uploader_thread.isRunning():
             self.uploader_thread.quit()
             self.uploader_thread.wait()
 
-        # Start the G-code upload in a separate thread
+        # Start the G-code upload in a separate thread. Both objects are kept until the next upload so the status
+        # bar can still read the worker's counters after it finishes.
         self.uploader_thread = QThread()
-        self.uploader_worker = GCodeUploader(self.serial_communicator, file_path)
+        self.uploader_worker = GCodeUploader(self.serial_communicator, file_path, self.log)
+        self.throughput.reset()
         self.uploader_worker.moveToThread(self.uploader_thread)
 
         self.uploader_thread.started.connect(self.uploader_worker.run)
-        self.uploader_worker.progress_signal.connect(self.update_response)
         self.uploader_worker.finished.connect(self.on_upload_finished)  # Improved handling
-        self.uploader_worker.finished.connect(self.uploader_worker.deleteLater)
-        self.uploader_thread.finished.connect(self.uploader_thread.deleteLater)
+        self.uploader_worker.finished.connect(self.uploader_thread.quit)
 
         self.uploader_thread.start()
 
     def on_upload_finished(self):
-        self.ui.responseText.append("File upload finished.\n")
+        self.log.append("File upload finished.\n")
+        self.update_progress()
 
     def update_response(self, message):
-        self.ui.responseText.append(message)
+        self.log.append(message)
+
+    def flush_log(self):
+        lines = self.log.drain()
+        if lines:
+            self.ui.responseText.append("\n".join(lines))
+
+        if self.uploader_worker is not None:
+            self.update_progress()
+
+    def update_progress(self):
+        worker = self.uploader_worker
+        self.progressBar.setMaximum(max(worker.total_lines, 1))
+        self.progressBar.setValue(worker.lines_sent)
+        self.preview.set_progress(worker.lines_sent)
+
+        lines_per_second, bytes_per_second = self.throughput.sample(worker.lines_sent, worker.bytes_sent)
+        self.throughputLabel.setText(f"{lines_per_second:.1f} lines/s  {bytes_per_second:.0f} B/s")
+
+    def closeEvent(self, event):
+        self.preview.shutdown()
+        super().closeEvent(event)
 
 def apply_dark_theme(app):
     with open("dark.qss", "r") as file:
@@ -0,0 +1,293 @@
+import csv
+import os
+import re
+
+from GcodeInterpreter import MOTION_CODES, parse_line
+
+# ============================================================
+# Latency Histograms
+# ============================================================
+# Latencies are recorded in whole microseconds into log-linear buckets, the layout HdrHistogram uses: values below
+# 2^SUB_BUCKET_BITS get a bucket each, larger values share each power of two between 2^(SUB_BUCKET_BITS - 1)
+# buckets, so every recorded value is kept to within 1 / 2^(SUB_BUCKET_BITS - 1), under 0.8%, whatever its magnitude.
+
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+# Bucket bounds of the Prometheus export (seconds)
+PROMETHEUS_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20)
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Gaps shorter than this between the machine running out of queued motion and the next acknowledged move are
+# noise in the estimate, not starvation
+STARVATION_THRESHOLD = 0.005
+
+COMMAND_ORDER = ("G0", "G1", "G2", "G3", "G4", "M3", "M4", "M5", "$", "other")
+
+
+def _bucket_index(value):
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKET_HALF * shift + (value >> shift)
+
+
+def _bucket_bounds(index):
+    """
+    (lowest, highest) microsecond value that lands in bucket ``index``.
+    """
+    if index < SUB_BUCKET_COUNT:
+        return index, index
+    shift = index // SUB_BUCKET_HALF - 1
+    lowest = (index - SUB_BUCKET_HALF * shift) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Distribution of round-trip times with a fixed relative error, cheap enough to record every line of a job.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        value = max(0, int(round(seconds * 1e6)))
+        index = _bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count / 1e6 if self.count else 0.0
+
+    def percentile(self, percent):
+        """
+        Highest value equivalent to the ``percent`` percentile, in seconds.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = max(1, int(-(-percent * self.count // 100)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_bucket_bounds(index)[1], self.max) / 1e6
+        return self.max / 1e6
+
+    def count_at_or_below(self, seconds):
+        limit = seconds * 1e6
+        return sum(count for index, count in self.counts.items() if _bucket_bounds(index)[1] <= limit)
+
+
+# ============================================================
+# Send Metrics
+# ============================================================
+
+def command_type(line, modal_motion="G1"):
+    """
+    The command a line is timed under: its motion code, G4, its M code, "$" for system lines, else "other".
+    Lines with bare axis words take the modal motion code.
+    """
+    block = parse_line(line)
+    if block.system is not None:
+        return "$"
+
+    motion = [code for code in block.g_codes if code in MOTION_CODES]
+    if "G4" in block.g_codes:
+        return "G4"
+    if motion:
+        return motion[0]
+    if block.m_codes:
+        return block.m_codes[0]
+    if block.axis_words():
+        return modal_motion
+    return "other"
+
+
+class SendMetrics:
+    """
+    Send-to-ok latency by command type, plus the stalls and planner starvation seen while streaming.
+
+    Starvation is judged against the motion estimate of each line: every acknowledged line hands the controller
+    that much work, so when an acknowledgement arrives after the machine should already have finished everything
+    before it, the machine sat idle waiting for the host.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.histograms = {}
+        self.timeouts = 0
+        self.errors = 0
+        self.starvation_events = 0
+        self.starved_seconds = 0.0
+        self.elapsed = 0.0
+
+        self._modal_motion = "G1"
+        self._busy_until = None
+
+    def histogram(self, command):
+        if command not in self.histograms:
+            self.histograms[command] = LatencyHistogram()
+        return self.histograms[command]
+
+    def record(self, line, seconds, response, estimate=None, now=None):
+        """
+        Records one send-and-wait round trip. ``estimate`` is the line's LineEstimate, ``now`` the monotonic time
+        its acknowledgement arrived.
+        """
+        command = command_type(line, self._modal_motion)
+        if command in MOTION_CODES:
+            self._modal_motion = command
+
+        response = response.lower()
+        if "error" in response:
+            self.errors += 1
+        elif "ok" not in response:
+            self.timeouts += 1
+            return
+
+        self.histogram(command).record(seconds)
+
+        if estimate is None or now is None or estimate.kind is None:
+            return
+
+        if self._busy_until is not None and now - self._busy_until > STARVATION_THRESHOLD:
+            self.starvation_events += 1
+            self.starved_seconds += now - self._busy_until
+        self._busy_until = max(self._busy_until or now, now) + estimate.seconds
+
+    def merge(self, other):
+        for command, histogram in other.histograms.items():
+            self.histogram(command).merge(histogram)
+        self.timeouts += other.timeouts
+        self.errors += other.errors
+        self.starvation_events += other.starvation_events
+        self.starved_seconds += other.starved_seconds
+        self.elapsed += other.elapsed
+
+    def commands(self):
+        known = [command for command in COMMAND_ORDER if command in self.histograms]
+        return known + sorted(command for command in self.histograms if command not in COMMAND_ORDER)
+
+    def combined(self) -> LatencyHistogram:
+        histogram = LatencyHistogram()
+        for command in self.commands():
+            histogram.merge(self.histograms[command])
+        return histogram
+
+    def rows(self):
+        """
+        (command, histogram) for every command type seen, followed by ("all", combined histogram).
+        """
+        rows = [(command, self.histograms[command]) for command in self.commands()]
+        rows.append(("all", self.combined()))
+        return rows
+
+
+# ============================================================
+# Export
+# ============================================================
+
+def _file_stem(label):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") or "run"
+
+
+def write_csv(metrics: SendMetrics, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["label", "command", "count", "min_ms", "mean_ms"]
+            + [f"p{percent:g}_ms" for percent in PERCENTILES]
+            + ["max_ms"]
+        )
+        for command, histogram in metrics.rows():
+            if not histogram.count:
+                continue
+            writer.writerow(
+                [metrics.label, command, histogram.count, f"{histogram.min / 1e3:.3f}", f"{histogram.mean() * 1e3:.3f}"]
+                + [f"{histogram.percentile(percent) * 1e3:.3f}" for percent in PERCENTILES]
+                + [f"{histogram.max / 1e3:.3f}"]
+            )
+
+        writer.writerow([])
+        writer.writerow(["label", "timeouts", "errors", "starvation_events", "starved_s", "elapsed_s"])
+        writer.writerow([
+            metrics.label,
+            metrics.timeouts,
+            metrics.errors,
+            metrics.starvation_events,
+            f"{metrics.starved_seconds:.3f}",
+            f"{metrics.elapsed:.3f}",
+        ])
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_prometheus(metrics: SendMetrics, path):
+    """
+    Writes the metrics in the Prometheus text exposition format, for node_exporter's textfile collector or a
+    pushgateway.
+    """
+    label = f'label="{_escape(metrics.label)}"'
+    lines = [
+        "# HELP gcode_sender_ack_latency_seconds Time from sending a line to its ok.",
+        "# TYPE gcode_sender_ack_latency_seconds histogram",
+    ]
+    for command in metrics.commands():
+        histogram = metrics.histograms[command]
+        labels = f'{label},command="{_escape(command)}"'
+        for bound in PROMETHEUS_BUCKETS:
+            lines.append(
+                f'gcode_sender_ack_latency_seconds_bucket{{{labels},le="{bound:g}"}} '
+                f"{histogram.count_at_or_below(bound)}"
+            )
+        lines.append(f'gcode_sender_ack_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"gcode_sender_ack_latency_seconds_sum{{{labels}}} {histogram.total / 1e6:.6f}")
+        lines.append(f"gcode_sender_ack_latency_seconds_count{{{labels}}} {histogram.count}")
+
+    counters = (
+        ("timeouts_total", "Lines that got no ok before the sender gave up.", metrics.timeouts),
+        ("errors_total", "Lines the controller answered with an error.", metrics.errors),
+        ("starvation_events_total", "Times the machine ran out of queued motion.", metrics.starvation_events),
+        ("starved_seconds_total", "Estimated time the machine spent waiting for the host.", metrics.starved_seconds),
+        ("elapsed_seconds_total", "Wall-clock time spent streaming.", metrics.elapsed),
+    )
+    for name, description, value in counters:
+        lines.append(f"# HELP gcode_sender_{name} {description}")
+        lines.append(f"# TYPE gcode_sender_{name} counter")
+        value = f"{value:.6f}" if isinstance(value, float) else str(value)
+        lines.append(f"gcode_sender_{name}{{{label}}} {value}")
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def export_metrics(metrics: SendMetrics, directory) -> list:
+    """
+    Writes ``<label>.csv`` and ``<label>.prom`` into ``directory`` and returns their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, _file_stem(metrics.label))
+    write_csv(metrics, stem + ".csv")
+    write_prometheus(metrics, stem + ".prom")
+    return [stem + ".csv", stem + ".prom"]
@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 import sys
 import time
+import select
+import termios
+import threading
+import tty
 import serial
 import glob
 import argparse
+import collections
+import os
 import subprocess
 
 from rich.console import Console
-from rich.progress import Progress, BarColumn, TimeRemainingColumn
+from rich.progress import Progress, BarColumn, TextColumn
 from rich.prompt import Prompt
 from rich.table import Table
 
+from GcodeEncoder import DIALECTS, GcodeEncoder
+from GrblRealtime import COMMANDS_BY_KEY, CYCLE_START, FEED_HOLD, KEY_BINDINGS, RX_BUFFER_SIZE, SOFT_RESET, key_label
+from JobEstimator import ACKNOWLEDGEMENT_LAG, MACHINES, JobProgress, estimate_lines, format_duration
+from SendMetrics import PERCENTILES, SendMetrics, export_metrics
+
 console = Console()
 FINISHED_RESPONSE = "ok"
 
@@ -30,12 +41,45 @@ class SerialCommunicator:
             console.print(f"[red]Error opening port {port}: {e}[/red]")
             sys.exit(1)
 
-    def send(self, command: str):
-        self.serial_port.reset_output_buffer()
-        self.serial_port.reset_input_buffer()
-        if not command.endswith("\n"):
-            command += "\n"
-        self.serial_port.write(command.encode())
+        self.write_lock = threading.Lock()
+        self.held = threading.Event()
+        self.reset_event = threading.Event()
+        self.resets = 0  # soft resets sent so far
+
+    def send(self, command: str, resets=None) -> bool:
+        """
+        Writes a line. Given ``resets`` (a count read from self.resets), only while no soft reset has been sent
+        since; returns whether the line was written.
+        """
+        with self.write_lock:
+            if resets is not None and resets != self.resets:
+                return False
+
+            # A reset before this line is over, its banner dropped with the input below
+            self.reset_event.clear()
+            self.serial_port.reset_output_buffer()
+            self.serial_port.reset_input_buffer()
+            if not command.endswith("\n"):
+                command += "\n"
+            self.serial_port.write(command.encode())
+            return True
+
+    def send_realtime(self, command: bytes):
+        """
+        Writes a real-time command straight to the port, from any thread, without waiting for the line in flight.
+        """
+        with self.write_lock:
+            self.serial_port.write(command)
+            self.serial_port.flush()
+
+            if command == SOFT_RESET:
+                self.resets += 1
+                self.reset_event.set()
+
+        if command == FEED_HOLD:
+            self.held.set()
+        elif command in (CYCLE_START, SOFT_RESET):
+            self.held.clear()
 
     def read_line(self) -> str:
         try:
@@ -49,15 +93,25 @@ class SerialCommunicator:
         while True:
             response_line = self.read_line()
             response += response_line
-            if FINISHED_RESPONSE in response:
+            if FINISHED_RESPONSE in response.lower():
                 break
+            if self.reset_event.is_set():
+                break
+            if self.held.is_set():
+                # A held machine stops answering; that is not a timeout
+                start_time = time.time()
             if time.time() - start_time > 20:
                 break
         return response
 
-    def send_and_wait(self, command: str) -> str:
+    def send_and_wait(self, command: str, resets=None) -> str:
+        """
+        Sends a line and returns the controller's reply; empty if ``resets`` is given and a soft reset has been sent
+        since (see send), in which case nothing is written.
+        """
         start = time.time()
-        self.send(command)
+        if not self.send(command, resets):
+            return ""
         response = self.wait_for_ok()
         elapsed = time.time() - start
 
@@ -67,6 +121,73 @@ class SerialCommunicator:
             )
         return response
 
+    def stream(self, lines, on_ack=None) -> collections.Counter:
+        """
+        Streams lines with GRBL character counting: lines are written as long as every unacknowledged line still
+        fits in the controller's RX buffer, so the planner never waits on a round trip.
+
+        ``on_ack(index, response)`` is called as each line is answered. Stops early on an alarm, a soft reset or
+        a 20 second silence. Only for GRBL; the MakeBlock firmware drops a move when the next line arrives.
+        """
+        counts = collections.Counter()
+        in_flight = collections.deque()  # (index, length) of lines not yet answered
+        last_response = time.time()
+
+        def take_response():
+            nonlocal last_response
+            response = self.read_line().strip()
+            if not response:
+                if self.held.is_set():
+                    last_response = time.time()
+                return time.time() - last_response <= 20
+
+            last_response = time.time()
+            lowered = response.lower()
+            if lowered == FINISHED_RESPONSE or lowered.startswith("error"):
+                index, _ = in_flight.popleft()
+                counts["errors" if lowered.startswith("error") else "ok"] += 1
+                if on_ack is not None:
+                    on_ack(index, response)
+            elif lowered.startswith("alarm"):
+                console.log(f"[red]{response}[/red]")
+                counts["alarms"] += 1
+                return False
+            elif response:
+                console.log(f"[blue]Response:[/blue] {response}")
+            return True
+
+        # Only a reset sent from here on stops the stream; the check and each write share the lock with it
+        with self.write_lock:
+            resets = self.resets
+            self.reset_event.clear()
+            self.serial_port.reset_input_buffer()
+
+        for index, line in enumerate(lines):
+            text = line.strip()
+            if not text:
+                continue
+
+            data = (text + "\n").encode()
+            while in_flight and sum(length for _, length in in_flight) + len(data) > RX_BUFFER_SIZE:
+                if not take_response() or self.resets != resets:
+                    counts["aborted"] += 1
+                    return counts
+
+            with self.write_lock:
+                if self.resets != resets:
+                    counts["aborted"] += 1
+                    return counts
+                self.serial_port.write(data)
+            in_flight.append((index, len(data)))
+            counts["bytes"] += len(data)
+
+        while in_flight:
+            if not take_response() or self.resets != resets:
+                counts["aborted"] += 1
+                break
+
+        return counts
+
     def close(self):
         if self.serial_port and self.serial_port.is_open:
             self.serial_port.close()
@@ -76,7 +197,104 @@ def list_serial_ports():
     return glob.glob("/dev/ttyUSB*")
 
 
-def run_gcode_once(serial_comm: SerialCommunicator, file_path: str):
+class RealtimeKeys(threading.Thread):
+    """
+    Reads single key presses while a job streams and sends the bound real-time command straight away.
+    """
+
+    def __init__(self, serial_comm: SerialCommunicator):
+        super().__init__(daemon=True)
+        self.serial_comm = serial_comm
+        self.stop_event = threading.Event()
+
+    def __enter__(self):
+        if sys.stdin.isatty():
+            self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        fd = sys.stdin.fileno()
+        saved = termios.tcgetattr(fd)
+        try:
+            tty.setcbreak(fd)
+            while not self.stop_event.is_set():
+                readable, _, _ = select.select([fd], [], [], 0.1)
+                if not readable:
+                    continue
+
+                key = sys.stdin.read(1)
+                if key in COMMANDS_BY_KEY:
+                    command, description = COMMANDS_BY_KEY[key]
+                    self.serial_comm.send_realtime(command)
+                    console.log(f"[yellow]{description}[/yellow]")
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+
+
+def print_key_bindings():
+    console.print(
+        "[dim]Keys: " + "  ".join(f"{key_label(key)} {description}" for key, _, description in KEY_BINDINGS) + "[/dim]"
+    )
+
+
+def encode_for_link(encoder: GcodeEncoder, file_path: str, lines):
+    encoded = encoder.encode(lines)
+
+    bytes_in = sum(len(line.rstrip("\n")) + 1 for line in lines)
+    bytes_out = sum(len(line) + 1 for line in encoded)
+    saved = 1 - bytes_out / bytes_in if bytes_in else 0
+    console.print(
+        f"[green]Encoded {file_path}: {bytes_in} -> {bytes_out} bytes ({saved:.1%} saved)[/green]"
+    )
+    return encoded
+
+
+def print_latency_table(metrics: SendMetrics, title):
+    table = Table(title=title)
+    table.add_column("Command", style="cyan")
+    table.add_column("Count", justify="right")
+    table.add_column("Mean (ms)", justify="right", style="magenta")
+    for percent in PERCENTILES:
+        table.add_column(f"p{percent:g} (ms)", justify="right", style="magenta")
+    table.add_column("Max (ms)", justify="right", style="magenta")
+
+    for command, histogram in metrics.rows():
+        if not histogram.count:
+            continue
+        name = "[bold]All[/bold]" if command == "all" else command
+        table.add_row(
+            name,
+            str(histogram.count),
+            f"{histogram.mean() * 1e3:.1f}",
+            *(f"{histogram.percentile(percent) * 1e3:.1f}" for percent in PERCENTILES),
+            f"{histogram.max / 1e3:.1f}",
+        )
+
+    console.print(table)
+    console.print(
+        f"[cyan]Starvation: {metrics.starvation_events} events, {metrics.starved_seconds:.2f} s idle; "
+        f"{metrics.timeouts} timeouts, {metrics.errors} errors[/cyan]"
+    )
+
+
+def write_metrics(metrics: SendMetrics, metrics_dir):
+    if metrics_dir:
+        paths = export_metrics(metrics, metrics_dir)
+        console.print(f"[green]Metrics written to {', '.join(paths)}[/green]")
+
+
+def run_gcode_once(
+    serial_comm: SerialCommunicator,
+    file_path: str,
+    encoder: GcodeEncoder = None,
+    machine="grbl",
+    metrics: SendMetrics = None,
+):
     file_start = time.time()
 
     try:
@@ -86,8 +304,18 @@ def run_gcode_once(serial_comm: SerialCommunicator, file_path: str):
         console.print(f"[red]Failed to open file: {e}[/red]")
         return False, 0
 
+    if encoder is not None:
+        lines = encode_for_link(encoder, file_path, lines)
+
     total_lines = len(lines)
+    estimates = estimate_lines(lines, machine)
+    job = JobProgress(estimates, lag_lines=ACKNOWLEDGEMENT_LAG[machine])
+    if metrics is None:
+        metrics = SendMetrics(file_path)
     console.print(f"[green]Uploading {total_lines} G-code commands from {file_path}[/green]")
+    console.print(f"[green]Estimated motion time {format_duration(job.total)} ({job.split()})[/green]")
+    print_key_bindings()
+    resets = serial_comm.resets
     time.sleep(1)
 
     with Progress(
@@ -95,37 +323,82 @@ def run_gcode_once(serial_comm: SerialCommunicator, file_path: str):
         BarColumn(),
         "[progress.percentage]{task.percentage:>3.0f}%",
         "•",
-        TimeRemainingColumn(),
+        TextColumn("{task.fields[remaining]} left"),
+        "•",
+        TextColumn("{task.fields[split]}"),
         transient=True,
-    ) as progress:
-
-        task = progress.add_task("[green]Uploading G-code...", total=total_lines)
+    ) as progress, RealtimeKeys(serial_comm):
 
-        for line in lines:
-            response = serial_comm.send_and_wait(line)
+        task = progress.add_task(
+            "[green]Uploading G-code...",
+            total=job.total or 1,
+            remaining=format_duration(job.total),
+            split=job.split(),
+        )
+        job.start()
+
+        for index, line in enumerate(lines):
+            sent = time.monotonic()
+            response = serial_comm.send_and_wait(line, resets)
+            if serial_comm.resets != resets:
+                console.print("[red]Soft reset sent. Job aborted; send $X to unlock.[/red]")
+                metrics.elapsed = time.time() - file_start
+                return False, metrics.elapsed
+
+            acknowledged = time.monotonic()
+            if line.strip():
+                metrics.record(line, acknowledged - sent, response, estimates[index], acknowledged)
             if len(response) > 5:
                 console.log(f"[blue]Response:[/blue] {response.strip()}")
-            progress.advance(task)
+
+            job.acknowledge(index)
+            progress.update(
+                task,
+                completed=job.done,
+                remaining=format_duration(job.remaining()),
+                split=job.split(),
+            )
+
+        # The last lines acknowledged were still in the planner; the job is done now it has been sent
+        job.finish()
+        progress.update(task, completed=job.done, remaining=format_duration(0), split=job.split())
 
     elapsed = time.time() - file_start
-    console.print(f"[bold green]Run finished in {elapsed:.2f} seconds.[/bold green]")
+    metrics.elapsed = elapsed
+    console.print(
+        f"[bold green]Run finished in {elapsed:.2f} seconds "
+        f"(estimated {job.total:.2f} seconds of motion).[/bold green]"
+    )
 
     return True, elapsed
 
 
-def run_gcode_batch(serial_comm: SerialCommunicator, file_list):
+def run_gcode_batch(
+    serial_comm: SerialCommunicator,
+    file_list,
+    encoder: GcodeEncoder = None,
+    machine="grbl",
+    batch_label="batch",
+    metrics_dir=None,
+):
     batch_start = time.time()
     file_times = []
+    batch_metrics = SendMetrics(batch_label)
 
     for idx, file_path in enumerate(file_list, start=1):
         console.print(
             f"\n[bold magenta]=== File {idx}/{len(file_list)}: {file_path} ===[/bold magenta]"
         )
 
-        ok, elapsed = run_gcode_once(serial_comm, file_path)
+        run_metrics = SendMetrics(f"{batch_label}-{idx:02d}-{os.path.basename(file_path)}")
+        ok, elapsed = run_gcode_once(serial_comm, file_path, encoder, machine, run_metrics)
         send_notification(f"{file_path} finished")
 
+        batch_metrics.merge(run_metrics)
+        write_metrics(run_metrics, metrics_dir)
+
         if not ok:
+            write_metrics(batch_metrics, metrics_dir)
             console.print("[red]Error during batch. Stopping remaining files.[/red]")
             return False, 0, []
 
@@ -148,6 +421,9 @@ def run_gcode_batch(serial_comm: SerialCommunicator, file_list):
 
     console.print(table)
 
+    print_latency_table(batch_metrics, "Batch Command Latency")
+    write_metrics(batch_metrics, metrics_dir)
+
     return True, batch_elapsed, file_times
 
 
@@ -158,15 +434,21 @@ def repeat_controller(
     repeat_count: int,
     wait_enter: bool,
     wait_seconds: float,
+    encoder: GcodeEncoder = None,
+    machine="grbl",
+    metrics_dir=None,
 ):
     run_number = 1
     overall_start = time.time()
     all_batch_times = []
+    session = time.strftime("%Y%m%d-%H%M%S")
 
     while True:
         console.print(f"\n[cyan]Starting batch run {run_number}[/cyan]")
 
-        ok, batch_time, _ = run_gcode_batch(serial_comm, file_list)
+        ok, batch_time, _ = run_gcode_batch(
+            serial_comm, file_list, encoder, machine, f"{session}-batch{run_number}", metrics_dir
+        )
         send_notification(f"Batch run {run_number} finished")
 
         if not ok:
@@ -217,6 +499,11 @@ def interactive_mode(serial_comm: SerialCommunicator):
         command = Prompt.ask("Enter G-code command")
         if command.lower() in ("exit", "quit"):
             break
+        if command in COMMANDS_BY_KEY:
+            realtime, description = COMMANDS_BY_KEY[command]
+            serial_comm.send_realtime(realtime)
+            console.print(f"[yellow]Sent {description}[/yellow]")
+            continue
         response = serial_comm.send_and_wait(command)
         console.print(f"[blue]Response:[/blue] {response.strip()}")
 
@@ -237,6 +524,22 @@ def main():
     mode_group.add_argument("--wait-enter", action="store_true")
     mode_group.add_argument("--wait-seconds", type=float)
 
+    parser.add_argument(
+        "--encode",
+        choices=list(DIALECTS),
+        help="shrink each file for the serial link before sending",
+    )
+    parser.add_argument(
+        "--machine",
+        choices=list(MACHINES),
+        help="motion model for time estimates (default: makeblock with --encode makeblock, else grbl)",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="DIR",
+        help="write per-run and per-batch latency metrics to DIR as CSV and Prometheus text files",
+    )
+
     args = parser.parse_args()
 
     if args.port:
@@ -290,6 +593,9 @@ def main():
                 args.repeat_count,
                 wait_enter,
                 wait_seconds,
+                GcodeEncoder(args.encode) if args.encode else None,
+                args.machine or ("makeblock" if args.encode == "makeblock" else "grbl"),
+                args.metrics,
             )
         else:
             interactive_mode(serial_comm)
@@ -0,0 +1,574 @@
+import argparse
+import hashlib
+import os
+import typing
+import xml.etree.ElementTree as ET
+import zipfile
+
+import numpy as np
+
+from CurveFlattener import flatten_path
+from GcodeEncoder import DIALECTS
+from GcodeInterpreter import format_number
+
+SVG_NS = "{http://www.w3.org/2000/svg}"
+
+# Largest distance between a glyph's curves and the chords that replace them (font units)
+FLATTEN_TOLERANCE = 0.5
+
+GLYPH_CACHE_DIR = "glyph_cache"
+GLYPH_CACHE_VERSION = 3
+
+# Kerning pairs are looked up as (first codepoint << KERN_SHIFT) | second codepoint
+KERN_SHIFT = 21
+
+# Strokes whose ends are closer than this are drawn without lifting the pen (mm)
+MERGE_TOLERANCE = 0.01
+
+PEN_UP = "M5"
+PEN_DOWN = "M3"
+DRAW_FEED = 3000  # mm/min
+COORDINATE_DECIMALS = 3
+
+
+# ============================================================
+# SVG Fonts
+# ============================================================
+
+class SVGFont:
+    """
+    Glyph outlines and metrics of an SVG font, flattened to polylines in font units (y up) the first time each
+    glyph is used.
+    """
+
+    def __init__(self, path, tolerance=FLATTEN_TOLERANCE):
+        self.path = path
+        self.tolerance = tolerance
+        root = ET.parse(path).getroot()
+
+        font = root.find(f".//{SVG_NS}font")
+        face = root.find(f".//{SVG_NS}font-face")
+        if font is None or face is None:
+            raise ValueError(f"{path} is not an SVG font")
+
+        self.default_advance = float(font.get("horiz-adv-x", 0))
+        self.units_per_em = float(face.get("units-per-em", 1000))
+        self.ascent = float(face.get("ascent", self.units_per_em * 0.8))
+        self.descent = float(face.get("descent", -self.units_per_em * 0.2))
+        self.cap_height = float(face.get("cap-height", self.ascent))
+
+        self.outlines = {}
+        self.advances = {}
+        names = {}
+        for glyph in root.iter(f"{SVG_NS}glyph"):
+            char = glyph.get("unicode")
+            if not char or len(char) != 1:
+                continue
+            self.outlines[char] = glyph.get("d", "")
+            self.advances[char] = float(glyph.get("horiz-adv-x", self.default_advance))
+            if glyph.get("glyph-name"):
+                names[glyph.get("glyph-name")] = char
+
+        # {(first, second): k}; k is taken off the first glyph's advance
+        self.kerning = {}
+        for kern in root.iter(f"{SVG_NS}hkern"):
+            firsts = _kern_chars(kern.get("u1"), kern.get("g1"), names)
+            seconds = _kern_chars(kern.get("u2"), kern.get("g2"), names)
+            k = float(kern.get("k", 0))
+            for first in firsts:
+                for second in seconds:
+                    self.kerning[(first, second)] = k
+
+        self._strokes = {}
+
+    def advance(self, char):
+        return self.advances.get(char, self.default_advance)
+
+    def strokes(self, char) -> list:
+        """
+        The glyph's strokes as (n, 2) arrays in font units; empty for spaces and unknown characters.
+        """
+        if char not in self._strokes:
+            self._strokes[char] = flatten_path(self.outlines.get(char, ""), self.tolerance)
+        return self._strokes[char]
+
+
+def _kern_chars(unicodes, glyph_names, names) -> list:
+    """
+    Characters named by an hkern's u1/u2 (characters or U+ ranges) and g1/g2 (glyph names) lists.
+    """
+    chars = []
+    for entry in (unicodes or "").split(","):
+        entry = entry.strip()
+        if entry.upper().startswith("U+"):
+            first, _, last = entry[2:].partition("-")
+            chars.extend(chr(code) for code in range(int(first, 16), int(last or first, 16) + 1))
+        elif len(entry) == 1:
+            chars.append(entry)
+
+    for name in (glyph_names or "").split(","):
+        if name.strip() in names:
+            chars.append(names[name.strip()])
+
+    return chars
+
+
+# ============================================================
+# Glyph Cache
+# ============================================================
+
+def font_hash(path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_npz_mmap(path) -> dict:
+    """
+    np.load ignores mmap_mode for .npz files, so this maps each member of an uncompressed .npz (as np.savez writes
+    them) straight out of the archive.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} is compressed and cannot be memory-mapped")
+
+            # The local header repeats the name and may carry a different extra field than the central directory
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+            f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if shape == ():
+                arrays[name] = np.fromfile(f, dtype=dtype, count=1).reshape(())
+            elif 0 in shape:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran_order else "C"
+                )
+    return arrays
+
+
+class GlyphCache:
+    """
+    Every glyph of a font flattened once and kept as flat arrays: ``vertices`` holds all points, ``stroke_offsets``
+    where each stroke starts in it and ``glyph_offsets`` where each glyph's strokes start. Glyphs are sorted by
+    codepoint, kerning pairs by their packed codepoints. The arrays are memory-mapped from the cache file, so loading
+    costs nothing until a glyph is used.
+    """
+
+    METRICS = ("units_per_em", "ascent", "descent", "cap_height", "default_advance")
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+        # Plain ndarray views of the mapped memory; indexing through np.memmap is several times slower
+        self.vertices = np.asarray(arrays["vertices"])
+        self.stroke_offsets = np.asarray(arrays["stroke_offsets"])
+        self.glyph_offsets = np.asarray(arrays["glyph_offsets"])
+        self.codepoints = np.asarray(arrays["codepoints"])
+        self.advances = np.asarray(arrays["advances"])
+        self.kern_pairs = np.asarray(arrays["kern_pairs"])
+        self.kern_values = np.asarray(arrays["kern_values"])
+        for name, value in zip(self.METRICS, arrays["metrics"]):
+            setattr(self, name, float(value))
+
+        self.index = {int(codepoint): i for i, codepoint in enumerate(self.codepoints)}
+
+    @classmethod
+    def build(cls, font: SVGFont, key):
+        chars = sorted(font.outlines, key=ord)
+        vertices, stroke_offsets, glyph_offsets = [], [0], [0]
+
+        for char in chars:
+            for stroke in font.strokes(char):
+                vertices.append(stroke)
+                stroke_offsets.append(stroke_offsets[-1] + len(stroke))
+            glyph_offsets.append(len(stroke_offsets) - 1)
+
+        pairs = sorted((ord(first) << KERN_SHIFT | ord(second), k) for (first, second), k in font.kerning.items())
+
+        return cls({
+            "key": np.array(key),
+            "vertices": np.concatenate(vertices).astype(np.float32) if vertices else np.zeros((0, 2), np.float32),
+            "stroke_offsets": np.array(stroke_offsets, dtype=np.int64),
+            "glyph_offsets": np.array(glyph_offsets, dtype=np.int64),
+            "codepoints": np.array([ord(char) for char in chars], dtype=np.int32),
+            "advances": np.array([font.advance(char) for char in chars], dtype=np.float32),
+            "metrics": np.array([getattr(font, name) for name in cls.METRICS], dtype=np.float64),
+            "kern_pairs": np.array([pair for pair, _ in pairs], dtype=np.int64),
+            "kern_values": np.array([k for _, k in pairs], dtype=np.float32),
+        })
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = path + ".tmp.npz"
+        np.savez(temporary, **{name: np.asarray(array) for name, array in self.arrays.items()})
+        os.replace(temporary, path)
+
+    def glyph(self, char):
+        return self.index.get(ord(char))
+
+    def advance(self, char):
+        index = self.glyph(char)
+        return self.default_advance if index is None else float(self.advances[index])
+
+    def kern(self, first, second):
+        key = ord(first) << KERN_SHIFT | ord(second)
+        position = np.searchsorted(self.kern_pairs, key)
+        if position < len(self.kern_pairs) and self.kern_pairs[position] == key:
+            return float(self.kern_values[position])
+        return 0.0
+
+    def strokes(self, char) -> list:
+        index = self.glyph(char)
+        if index is None:
+            return []
+        first, last = self.glyph_offsets[index], self.glyph_offsets[index + 1]
+        offsets = self.stroke_offsets[first:last + 1]
+        return [self.vertices[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def cache_path(font_path, key, tolerance, directory=GLYPH_CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(font_path))[0]
+    return os.path.join(directory, f"{stem}-{key[:16]}-{tolerance:g}.npz")
+
+
+def load_font(font_path, tolerance=FLATTEN_TOLERANCE, directory=GLYPH_CACHE_DIR) -> GlyphCache:
+    """
+    The font's glyph cache for ``tolerance``, built and saved on first use and memory-mapped afterwards. The cache
+    is keyed on a hash of the font file, so editing the font rebuilds it.
+    """
+    key = f"{font_hash(font_path)}:{tolerance:g}:{GLYPH_CACHE_VERSION}"
+    path = cache_path(font_path, key, tolerance, directory)
+
+    if os.path.exists(path):
+        try:
+            arrays = load_npz_mmap(path)
+            if str(arrays["key"]) == key:
+                return GlyphCache(arrays)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass
+
+    cache = GlyphCache.build(SVGFont(font_path, tolerance), key)
+    cache.save(path)
+    return cache
+
+
+# ============================================================
+# Layout
+# ============================================================
+
+class TextLayout(typing.NamedTuple):
+    """
+    Laid out text: all stroke points in mm, where each stroke starts in ``vertices`` (plus the end) and which line
+    each stroke is on.
+    """
+    vertices: np.ndarray
+    offsets: np.ndarray
+    stroke_lines: np.ndarray
+    line_count: int
+
+    def strokes(self, line=None) -> list:
+        offsets = self.offsets
+        indices = range(len(offsets) - 1) if line is None else np.flatnonzero(self.stroke_lines == line)
+        return [self.vertices[offsets[i]:offsets[i + 1]] for i in indices]
+
+
+def _ranges(starts, counts):
+    """
+    np.concatenate([np.arange(s, s + c) for s, c in zip(starts, counts)]) without the Python loop.
+    """
+    total = int(counts.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+    return np.repeat(starts - (ends - counts), counts) + np.arange(total)
+
+
+def _line_starts(codes, pen, width):
+    """
+    Index of the first character of every line: after each newline, and greedy word wrap where a line would run
+    past ``width`` (font units). ``pen`` is the advance sum before each character and after the last.
+    """
+    newline, space = ord("\n"), ord(" ")
+    count = len(codes)
+    index = np.arange(count)
+
+    # Next newline at or after each character, and the last space at or before it
+    next_break = np.minimum.accumulate(np.where(codes == newline, index, count)[::-1])[::-1]
+    last_space = np.maximum.accumulate(np.where(codes == space, index, -1))
+    # First character that is not a space at or after each character
+    next_ink = np.minimum.accumulate(np.where(codes != space, index, count)[::-1])[::-1]
+
+    starts = [0]
+    start = 0
+    while start < count:
+        stop = int(next_break[start])
+        resume = stop + 1
+
+        if width is not None:
+            # Characters start .. fit - 1 fit on the line
+            fit = int(np.searchsorted(pen, pen[start] + width, side="right")) - 1
+            if fit < stop:
+                wrap = int(last_space[fit])
+                if wrap > start:
+                    stop = wrap
+                else:
+                    stop = max(start + 1, fit)
+                # The spaces a line wraps at are not drawn at the start of the next one
+                resume = int(next_ink[stop]) if stop < count else count
+
+        if stop >= count:
+            break
+        starts.append(resume)
+        start = resume
+
+    return np.array(starts, dtype=np.int64)
+
+
+def layout_text(font: GlyphCache, text, height=5.0, origin=(0.0, 0.0), width=None, line_spacing=1.2) -> TextLayout:
+    """
+    Places ``text`` with its first baseline starting at ``origin`` (mm); ``height`` is the cap height in mm.
+    Advances come from horiz-adv-x less the font's kerning, and lines wrap at spaces to fit ``width`` mm.
+
+    Everything after line breaking is batched over the whole text: glyph lookup, kerning, pen positions and the
+    gather and transform of every glyph's points from the cache arrays.
+    """
+    scale = height / font.cap_height
+    line_height = (font.ascent - font.descent) * scale * line_spacing
+
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    count = len(codes)
+
+    # Glyph of every character, -1 where the font has none
+    position = np.minimum(np.searchsorted(font.codepoints, codes), max(len(font.codepoints) - 1, 0))
+    found = font.codepoints[position] == codes if len(font.codepoints) else np.zeros(count, dtype=bool)
+    glyphs = np.where(found, position, -1)
+
+    advances = np.where(found, font.advances[position], font.default_advance).astype(np.float64)
+    if count > 1 and len(font.kern_pairs):
+        pairs = codes[:-1] << KERN_SHIFT | codes[1:]
+        slot = np.minimum(np.searchsorted(font.kern_pairs, pairs), len(font.kern_pairs) - 1)
+        advances[:-1] -= np.where(font.kern_pairs[slot] == pairs, font.kern_values[slot], 0.0)
+
+    pen = np.concatenate([[0.0], np.cumsum(advances)])
+    starts = _line_starts(codes, pen, None if width is None else width / scale)
+    lines = np.searchsorted(starts, np.arange(count), side="right") - 1
+    x = origin[0] + (pen[:-1] - pen[starts[lines]]) * scale
+    y = origin[1] - lines * line_height
+
+    # Strokes of every drawn character, then their points
+    drawn = np.flatnonzero(glyphs >= 0)
+    first_stroke = font.glyph_offsets[glyphs[drawn]]
+    stroke_counts = font.glyph_offsets[glyphs[drawn] + 1] - first_stroke
+    strokes = _ranges(first_stroke, stroke_counts)
+    owner = np.repeat(drawn, stroke_counts)
+
+    vertex_counts = font.stroke_offsets[strokes + 1] - font.stroke_offsets[strokes]
+    points = _ranges(font.stroke_offsets[strokes], vertex_counts)
+    point_owner = np.repeat(owner, vertex_counts)
+
+    # np.take is much faster than fancy indexing for gathering rows
+    vertices = np.take(font.vertices, points, axis=0) * np.float64(scale)
+    vertices[:, 0] += np.take(x, point_owner)
+    vertices[:, 1] += np.take(y, point_owner)
+
+    offsets = np.concatenate([[0], np.cumsum(vertex_counts)])
+    return TextLayout(vertices, offsets, lines[owner], len(starts))
+
+
+# ============================================================
+# Toolpath
+# ============================================================
+
+def order_strokes(strokes, start=(0.0, 0.0)) -> list:
+    """
+    Greedy nearest-neighbour ordering: from the pen's position, draw whichever stroke end is closest next, reversing
+    strokes where that shortens the travel.
+    """
+    if not strokes:
+        return []
+
+    starts = np.array([stroke[0] for stroke in strokes])
+    ends = np.array([stroke[-1] for stroke in strokes])
+    remaining = np.ones(len(strokes), dtype=bool)
+    position = np.asarray(start, dtype=float)
+
+    ordered = []
+    for _ in range(len(strokes)):
+        to_start = np.where(remaining, np.hypot(*(starts - position).T), np.inf)
+        to_end = np.where(remaining, np.hypot(*(ends - position).T), np.inf)
+
+        index = int(np.argmin(np.minimum(to_start, to_end)))
+        remaining[index] = False
+        if to_end[index] < to_start[index]:
+            stroke = strokes[index][::-1]
+        else:
+            stroke = strokes[index]
+
+        ordered.append(stroke)
+        position = stroke[-1]
+
+    return ordered
+
+
+def merge_strokes(strokes, tolerance=MERGE_TOLERANCE) -> list:
+    """
+    Joins strokes that start where the previous one ended, so the pen stays down, and drops repeated points.
+    """
+    merged = []
+    for stroke in strokes:
+        if merged and np.hypot(*(merged[-1][-1] - stroke[0])) <= tolerance:
+            merged[-1] = np.concatenate([merged[-1], stroke[1:]])
+        else:
+            merged.append(stroke)
+
+    compact = []
+    for stroke in merged:
+        keep = np.ones(len(stroke), dtype=bool)
+        keep[1:] = np.any(np.abs(np.diff(stroke, axis=0)) > 10 ** -COORDINATE_DECIMALS / 2, axis=1)
+        if keep.sum() > 1:
+            compact.append(stroke[keep])
+
+    return compact
+
+
+_FRACTIONS = [""] + [
+    f".{f:0{COORDINATE_DECIMALS}d}".rstrip("0") for f in range(1, 10 ** COORDINATE_DECIMALS)
+]
+
+
+def _fixed_texts(values, strip_leading_zero=True) -> list:
+    """
+    Coordinates (already in integer 10^-COORDINATE_DECIMALS units) as G-code numbers, with no trailing zeros. The
+    fractional digits come from a table, so each number costs one lookup and one join.
+    """
+    whole, fraction = np.divmod(np.abs(values), 10 ** COORDINATE_DECIMALS)
+    table = _FRACTIONS
+    texts = []
+    for value, w, f in zip(values.tolist(), whole.tolist(), fraction.tolist()):
+        sign = "-" if value < 0 else ""
+        texts.append(f"{sign}{table[f]}" if strip_leading_zero and not w and f else f"{sign}{w}{table[f]}")
+    return texts
+
+
+def format_strokes(strokes, dialect="grbl") -> list:
+    """
+    The moves drawing ``strokes``, written directly in the dialect's compact form: packed words and modal G1 for
+    GRBL, axes that do not change left out. Much faster than running the lines through the encoder, which matters
+    when the same job is generated hundreds of times.
+    """
+    config = DIALECTS[dialect]
+    separator = config["separator"]
+    strip = config["strip_leading_zero"]
+    if not strokes:
+        return []
+
+    counts = [len(stroke) for stroke in strokes]
+    fixed = np.rint(np.concatenate(strokes) * 10 ** COORDINATE_DECIMALS).astype(np.int64)
+    xs = _fixed_texts(fixed[:, 0], strip)
+    ys = _fixed_texts(fixed[:, 1], strip)
+
+    changed = np.ones((len(fixed), 2), dtype=bool)
+    changed[1:] = fixed[1:] != fixed[:-1]
+    changed_x = changed[:, 0].tolist()
+    changed_y = changed[:, 1].tolist()
+
+    draw = "G1" + separator
+    lines = []
+    start = 0
+    for count in counts:
+        lines.append(f"G0{separator}X{xs[start]}{separator}Y{ys[start]}")
+        lines.append(PEN_DOWN)
+        motion = draw
+        for i in range(start + 1, start + count):
+            if changed_x[i] and changed_y[i]:
+                lines.append(f"{motion}X{xs[i]}{separator}Y{ys[i]}")
+            elif changed_x[i]:
+                lines.append(f"{motion}X{xs[i]}")
+            elif changed_y[i]:
+                lines.append(f"{motion}Y{ys[i]}")
+            else:
+                continue
+            if config["modal_motion"]:
+                motion = ""
+        lines.append(PEN_UP)
+        start += count
+
+    return lines
+
+
+def toolpath_to_gcode(strokes, feed=DRAW_FEED, dialect="grbl", header=(), footer=()) -> list:
+    """
+    G-code drawing ``strokes`` in order: pen up, rapid to the start, pen down, feed along the stroke.
+    """
+    separator = DIALECTS[dialect]["separator"]
+    lines = list(header)
+    lines.append(PEN_UP)
+    lines.append(f"G1{separator}F{format_number(feed)}")
+    lines.extend(format_strokes(strokes, dialect))
+    lines.extend(footer)
+    return lines
+
+
+def order_layout(layout: TextLayout, start=(0.0, 0.0)) -> list:
+    """
+    Orders strokes line by line, which keeps the nearest-neighbour search to one line's worth of strokes.
+    """
+    ordered = []
+    for line in range(layout.line_count):
+        ordered.extend(order_strokes(layout.strokes(line), ordered[-1][-1] if ordered else start))
+    return ordered
+
+
+def compile_text(font, text, height=5.0, origin=(0.0, 0.0), feed=DRAW_FEED, dialect="grbl",
+                 header=(), footer=(), width=None) -> list:
+    return layout_to_gcode(layout_text(font, text, height, origin, width), origin, feed, dialect, header, footer)
+
+
+def layout_to_gcode(layout, origin=(0.0, 0.0), feed=DRAW_FEED, dialect="grbl", header=(), footer=()) -> list:
+    strokes = merge_strokes(order_layout(layout, origin))
+    return toolpath_to_gcode(strokes, feed, dialect, header, footer)
+
+
+def write_gcode(lines, path):
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile text in an SVG font to G-code")
+    parser.add_argument("text")
+    parser.add_argument("--font", default="ReliefSingleLineSVG-Regular.svg")
+    parser.add_argument("--height", type=float, default=5.0, help="cap height (mm)")
+    parser.add_argument("--origin", type=float, nargs=2, default=(10.0, 10.0), metavar=("X", "Y"))
+    parser.add_argument("--width", type=float, help="wrap lines to this width (mm)")
+    parser.add_argument("--feed", type=float, default=DRAW_FEED)
+    parser.add_argument("--dialect", choices=list(DIALECTS), default="grbl")
+    parser.add_argument("--output", default="text.gcode")
+    args = parser.parse_args()
+
+    font = load_font(args.font)
+    lines = compile_text(
+        font, args.text.replace("\\n", "\n"), args.height, tuple(args.origin), args.feed, args.dialect,
+        width=args.width,
+    )
+    write_gcode(lines, args.output)
+    print(f"Wrote {len(lines)} lines to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
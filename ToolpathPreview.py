@@ -0,0 +1,487 @@
+import argparse
+import os
+import sys
+import threading
+import typing
+
+import numpy as np
+
+from PyQt5.QtCore import QObject, QPointF, QRectF, Qt, QThread, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen
+from PyQt5.QtWidgets import QApplication, QWidget
+
+from GcodeInterpreter import trace_moves
+
+
+# ============================================================
+# Toolpath
+# ============================================================
+
+# Kind of the segment that ends at a vertex
+KIND_NONE = 0  # first vertex of a path, no segment
+KIND_TRAVEL = 1
+KIND_CUT = 2
+
+FINEST_CELL = 0.01  # mm, grid of the first decimated level
+COARSEST_SEGMENTS = 2000  # stop building levels once one has this few segments
+LOD_PIXELS = 0.75  # a level is fine enough once its cell is this many pixels wide on screen
+
+MAX_SAMPLES = 8_000_000  # pixels plotted per frame
+
+# RGBA, drawn in this order so cuts sit on top of travel and executed work on top of pending work
+COLORS = (
+    (KIND_TRAVEL, False, (80, 80, 80, 255)),
+    (KIND_TRAVEL, True, (70, 110, 160, 255)),
+    (KIND_CUT, False, (175, 175, 175, 255)),
+    (KIND_CUT, True, (255, 140, 0, 255)),
+)
+
+
+class Toolpath:
+    """
+    A program flattened into vertex arrays.
+
+    ``lines`` holds the source line of the segment ending at each vertex and never decreases, so everything up to a
+    line is a prefix of the arrays. ``levels`` are the segments to draw at each level of detail, finest first, as
+    (cell size, starts, ends, lines, kinds) with a cell size of 0 for the full resolution.
+    """
+
+    def __init__(self, points, lines, kinds):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.lines = np.asarray(lines, dtype=np.int64)
+        self.kinds = np.asarray(kinds, dtype=np.int8)
+
+        if len(self.points):
+            self.bounds = (*self.points.min(axis=0), *self.points.max(axis=0))
+        else:
+            self.bounds = (0.0, 0.0, 1.0, 1.0)
+
+        self.levels = build_levels(self.points, self.lines, self.kinds, self.bounds)
+
+    def __len__(self):
+        return len(self.points)
+
+    def level_for(self, scale):
+        """
+        Coarsest level whose cells are still below LOD_PIXELS on screen at ``scale`` pixels per mm.
+        """
+        chosen = self.levels[0]
+        for level in self.levels[1:]:
+            if level[0] * scale > LOD_PIXELS:
+                break
+            chosen = level
+        return chosen
+
+    def position_after(self, line_count):
+        """
+        Where the tool is once the first ``line_count`` lines have run, or None before the first vertex.
+        """
+        index = int(np.searchsorted(self.lines, line_count, side="left")) - 1
+        if index < 0:
+            return None
+        return self.points[index]
+
+
+def _is_cut(step):
+    if step.motion not in ("G1", "G2", "G3"):
+        return False
+    return step.spindle != "M5" and step.power != 0
+
+
+def toolpath_from_gcode(lines) -> Toolpath:
+    points = [(0.0, 0.0)]
+    line_numbers = [0]
+    kinds = [KIND_NONE]
+
+    for index, step, start, moves in trace_moves(lines, arc_tolerance=0.01):
+        if not moves:
+            continue
+
+        kind = KIND_CUT if step.kind == "move" and _is_cut(step) else KIND_TRAVEL
+        for point in moves:
+            points.append((point[0], point[1]))
+            line_numbers.append(index)
+            kinds.append(kind)
+
+    return Toolpath(points, line_numbers, kinds)
+
+
+def load_toolpath(path) -> Toolpath:
+    """
+    Reads a .gcode file, or a binary toolpath written by save_toolpath.
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return Toolpath(data["points"], data["lines"], data["kinds"])
+
+    with open(path, "r") as f:
+        return toolpath_from_gcode(f.read().splitlines())
+
+
+def save_toolpath(path, toolpath: Toolpath):
+    np.savez(path, points=toolpath.points, lines=toolpath.lines, kinds=toolpath.kinds)
+
+
+# ============================================================
+# Level of Detail
+# ============================================================
+
+def decimate(points, lines, kinds, cell):
+    """
+    Drops every vertex that falls in the same ``cell`` sized grid square as the vertex before it. Path starts, the
+    last vertex and both sides of a travel/cut change are always kept.
+    """
+    if len(points) < 3:
+        return points, lines, kinds
+
+    grid = np.floor(points / cell).astype(np.int64)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (grid[1:] != grid[:-1]).any(axis=1) | (kinds[1:] == KIND_NONE)
+
+    change = kinds[1:] != kinds[:-1]
+    keep[1:] |= change
+    keep[:-1] |= change | (kinds[1:] == KIND_NONE)
+    keep[-1] = True
+
+    return points[keep], lines[keep], kinds[keep]
+
+
+def to_segments(points, lines, kinds):
+    drawn = kinds[1:] != KIND_NONE
+    return points[:-1][drawn], points[1:][drawn], lines[1:][drawn], kinds[1:][drawn]
+
+
+def merge_segments(starts, ends, lines, kinds, cell):
+    """
+    Keeps one segment, the earliest, of every group that starts and ends in the same grid squares. This is what
+    collapses the thousands of raster rows that share a pixel when zoomed out.
+    """
+    if len(starts) < 2:
+        return starts, ends, lines, kinds
+
+    key = np.column_stack((
+        np.floor(starts / cell).astype(np.int64),
+        np.floor(ends / cell).astype(np.int64),
+        kinds.astype(np.int64),
+    ))
+    _, first = np.unique(key, axis=0, return_index=True)
+    first.sort()
+    return starts[first], ends[first], lines[first], kinds[first]
+
+
+def build_levels(points, lines, kinds, bounds):
+    levels = [(0.0, *to_segments(points, lines, kinds))]
+    extent = max(bounds[2] - bounds[0], bounds[3] - bounds[1], FINEST_CELL)
+    cell = FINEST_CELL
+
+    while len(levels[-1][1]) > COARSEST_SEGMENTS and cell < extent:
+        points, lines, kinds = decimate(points, lines, kinds, cell)
+        segments = merge_segments(*to_segments(points, lines, kinds), cell)
+        if len(segments[0]) < len(levels[-1][1]):
+            levels.append((cell, *segments))
+        cell *= 2
+
+    return levels
+
+
+# ============================================================
+# Rasterizer
+# ============================================================
+
+class View(typing.NamedTuple):
+    """
+    ``scale`` pixels per mm, with the world point (left, bottom) at the bottom left corner of the image.
+    """
+    width: int
+    height: int
+    scale: float
+    left: float
+    bottom: float
+    progress: int
+
+
+def _clip(start, delta, low, high):
+    """
+    Liang-Barsky: the parameter range of each segment that lies within [low, high) along one axis.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_low = (low - start) / delta
+        t_high = (high - start) / delta
+
+    t_enter = np.where(delta != 0, np.minimum(t_low, t_high), np.where((start >= low) & (start < high), 0.0, 2.0))
+    t_exit = np.where(delta != 0, np.maximum(t_low, t_high), np.where((start >= low) & (start < high), 1.0, -1.0))
+    return t_enter, t_exit
+
+
+def render_toolpath(toolpath: Toolpath, view: View) -> np.ndarray:
+    """
+    Draws the level of detail that suits ``view`` into an RGBA array, executed lines (source line < progress) in
+    their own colours.
+    """
+    image = np.zeros((view.height, view.width, 4), dtype=np.uint8)
+    _, starts, ends, lines, segment_kinds = toolpath.level_for(view.scale)
+    if not len(starts):
+        return image
+
+    x0 = (starts[:, 0] - view.left) * view.scale
+    y0 = view.height - (starts[:, 1] - view.bottom) * view.scale
+    dx = (ends[:, 0] - starts[:, 0]) * view.scale
+    dy = -(ends[:, 1] - starts[:, 1]) * view.scale
+    executed = lines < view.progress
+
+    x_enter, x_exit = _clip(x0, dx, 0.0, view.width)
+    y_enter, y_exit = _clip(y0, dy, 0.0, view.height)
+    t_enter = np.maximum(0.0, np.maximum(x_enter, y_enter))
+    t_exit = np.minimum(1.0, np.minimum(x_exit, y_exit))
+
+    visible = t_enter <= t_exit
+    if not visible.any():
+        return image
+
+    x0, y0, dx, dy = x0[visible], y0[visible], dx[visible], dy[visible]
+    t_enter, t_exit = t_enter[visible], t_exit[visible]
+    segment_kinds, executed = segment_kinds[visible], executed[visible]
+
+    # One sample per pixel along the longer axis of each clipped segment
+    span = t_exit - t_enter
+    counts = np.ceil(np.maximum(np.abs(dx), np.abs(dy)) * span).astype(np.int64) + 1
+    total = int(counts.sum())
+    if total > MAX_SAMPLES:
+        counts = np.maximum(2, counts * MAX_SAMPLES // total)
+        total = int(counts.sum())
+
+    segment = np.repeat(np.arange(len(counts)), counts)
+    index = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = t_enter[segment] + span[segment] * index / np.maximum(counts[segment] - 1, 1)
+
+    px = np.clip((x0[segment] + dx[segment] * t).astype(np.int64), 0, view.width - 1)
+    py = np.clip((y0[segment] + dy[segment] * t).astype(np.int64), 0, view.height - 1)
+    sample_kinds = segment_kinds[segment]
+    sample_executed = executed[segment]
+
+    for kind, is_executed, color in COLORS:
+        selected = (sample_kinds == kind) & (sample_executed == is_executed)
+        image[py[selected], px[selected]] = color
+
+    return image
+
+
+# ============================================================
+# Widget
+# ============================================================
+
+class PreviewRenderer(QObject):
+    """
+    Loads and rasterizes toolpaths on its own thread.
+
+    Render requests are coalesced: submit() only replaces the pending view, so a burst of zoom or progress updates
+    costs one frame rather than one frame each.
+    """
+
+    loaded = pyqtSignal(object, str)
+    rendered = pyqtSignal(QImage, object)
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.pending = None
+        self.toolpath = None
+
+    def submit(self, view: View):
+        with self.lock:
+            self.pending = view
+
+    @pyqtSlot(str)
+    def load(self, path):
+        try:
+            self.toolpath = load_toolpath(path)
+            self.loaded.emit(self.toolpath, "")
+        except Exception as e:
+            self.toolpath = None
+            self.loaded.emit(None, str(e))
+
+    @pyqtSlot()
+    def render(self):
+        with self.lock:
+            view, self.pending = self.pending, None
+
+        if view is None or self.toolpath is None:
+            return
+
+        pixels = render_toolpath(self.toolpath, view)
+        image = QImage(pixels.data, view.width, view.height, view.width * 4, QImage.Format_RGBA8888).copy()
+        self.rendered.emit(image, view)
+
+
+class ToolpathPreview(QWidget):
+    """
+    Pan (drag) and zoom (wheel) view of a toolpath with executed lines highlighted. Double click fits the job.
+    """
+
+    load_requested = pyqtSignal(str)
+    render_requested = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(200)
+
+        self.toolpath = None
+        self.message = "No toolpath loaded"
+        self.progress = 0
+        self.scale = 1.0
+        self.left = 0.0
+        self.bottom = 0.0
+        self.image = None
+        self.image_view = None
+        self.drag_start = None
+
+        self.render_thread = QThread()
+        self.renderer = PreviewRenderer()
+        self.renderer.moveToThread(self.render_thread)
+        self.load_requested.connect(self.renderer.load)
+        self.render_requested.connect(self.renderer.render)
+        self.renderer.loaded.connect(self.on_loaded)
+        self.renderer.rendered.connect(self.on_rendered)
+        self.render_thread.start()
+
+    def shutdown(self):
+        self.render_thread.quit()
+        self.render_thread.wait()
+
+    def load_file(self, path):
+        self.toolpath = None
+        self.image = None
+        self.progress = 0
+        self.message = f"Loading {os.path.basename(path)}..."
+        self.load_requested.emit(path)
+        self.update()
+
+    def set_progress(self, lines_done):
+        if lines_done != self.progress:
+            self.progress = lines_done
+            self.request_render()
+
+    def fit(self):
+        if self.toolpath is None:
+            return
+
+        min_x, min_y, max_x, max_y = self.toolpath.bounds
+        width, height = max(max_x - min_x, 1e-3), max(max_y - min_y, 1e-3)
+        self.scale = 0.95 * min(self.width() / width, self.height() / height)
+        self.left = (min_x + max_x) / 2 - self.width() / self.scale / 2
+        self.bottom = (min_y + max_y) / 2 - self.height() / self.scale / 2
+
+    def request_render(self):
+        if self.toolpath is None or self.width() <= 0 or self.height() <= 0:
+            return
+
+        self.renderer.submit(View(self.width(), self.height(), self.scale, self.left, self.bottom, self.progress))
+        self.render_requested.emit()
+
+    def on_loaded(self, toolpath, message):
+        self.toolpath = toolpath
+        self.message = message
+        self.fit()
+        self.request_render()
+        self.update()
+
+    def on_rendered(self, image, view):
+        self.image = image
+        self.image_view = view
+        self.update()
+
+    def to_screen(self, x, y):
+        return QPointF((x - self.left) * self.scale, self.height() - (y - self.bottom) * self.scale)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), self.palette().base())
+
+        if self.image is not None:
+            # Show the last frame where it belongs in the current view until the next one arrives
+            old = self.image_view
+            ratio = self.scale / old.scale
+            top_left = self.to_screen(old.left, old.bottom + old.height / old.scale)
+            painter.drawImage(QRectF(top_left.x(), top_left.y(), old.width * ratio, old.height * ratio), self.image)
+
+        if self.toolpath is not None:
+            position = self.toolpath.position_after(self.progress)
+            if position is not None:
+                painter.setPen(QPen(QColor(255, 60, 60), 2))
+                painter.drawEllipse(self.to_screen(position[0], position[1]), 4, 4)
+        elif self.message:
+            painter.setPen(self.palette().text().color())
+            painter.drawText(self.rect(), Qt.AlignCenter, self.message)
+
+    def resizeEvent(self, event):
+        if self.image is None:
+            self.fit()
+        self.request_render()
+
+    def wheelEvent(self, event):
+        factor = 1.25 ** (event.angleDelta().y() / 120)
+        cursor = event.pos()
+
+        # Keep the point under the cursor where it is
+        world_x = self.left + cursor.x() / self.scale
+        world_y = self.bottom + (self.height() - cursor.y()) / self.scale
+        self.scale *= factor
+        self.left = world_x - cursor.x() / self.scale
+        self.bottom = world_y - (self.height() - cursor.y()) / self.scale
+
+        self.update()
+        self.request_render()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_start = (event.pos(), self.left, self.bottom)
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is None:
+            return
+
+        start, left, bottom = self.drag_start
+        self.left = left - (event.pos().x() - start.x()) / self.scale
+        self.bottom = bottom + (event.pos().y() - start.y()) / self.scale
+        self.update()
+        self.request_render()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.fit()
+        self.update()
+        self.request_render()
+
+
+# ============================================================
+# Main
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Preview a toolpath, or convert it to a binary toolpath")
+    parser.add_argument("file", help=".gcode file or .npz binary toolpath")
+    parser.add_argument("--save", type=str, help="write the binary toolpath here instead of opening a window")
+    args = parser.parse_args()
+
+    if args.save:
+        toolpath = load_toolpath(args.file)
+        save_toolpath(args.save, toolpath)
+        print(f"{len(toolpath)} vertices, {len(toolpath.levels)} levels of detail written to {args.save}")
+        return
+
+    app = QApplication(sys.argv)
+    preview = ToolpathPreview()
+    preview.setWindowTitle(os.path.basename(args.file))
+    preview.resize(800, 600)
+    preview.show()
+    preview.load_file(args.file)
+
+    code = app.exec_()
+    preview.shutdown()
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
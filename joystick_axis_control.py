@@ -1,11 +1,22 @@
+import argparse
+import collections
+import math
+import re
+import time
+
 import pygame
 import serial
-import time
-import re
+
+from GrblRealtime import JOG_CANCEL, PLANNER_BLOCKS, RX_BUFFER_SIZE, STATUS_REPORT
 
 SERIAL_PORT = "/dev/ttyUSB0"
 BAUD_RATE = 115200
-UPDATE_INTERVAL = 0.05  # 50 ms
+UPDATE_INTERVAL = 0.05  # 50 ms, the length of motion in each jog command
+STATUS_INTERVAL = 0.2
+DEADZONE = 0.1
+
+MPOS_RE = re.compile(r"<(\w+)[^>]*\|MPos:([-\d.]+),([-\d.]+),([-\d.]+)")
+
 
 # ----------------------
 # Read GRBL settings
@@ -18,116 +29,227 @@ def read_grbl_settings(ser):
     print("GRBL settings dump:")
     print(text)
 
-    def parse_val(name):
+    def parse_val(name, default):
         match = re.search(rf"\${name}=([\d.]+)", text)
-        return float(match.group(1)) if match else 500.0
+        return float(match.group(1)) if match else default
 
-    max_x = parse_val(110)  # mm/min
-    max_y = parse_val(111)
-    max_z = parse_val(112)
+    # Convert to mm/sec and mm/sec^2
+    rates = [parse_val(name, 500.0) / 60.0 for name in (110, 111, 112)]
+    accelerations = [parse_val(name, 10.0) for name in (120, 121, 122)]
+    return rates, accelerations
 
-    # Convert to mm/sec
-    return max_x / 60.0, max_y / 60.0, max_z / 60.0
 
+def jog_queue_size(rates, accelerations, interval=UPDATE_INTERVAL):
+    """
+    Number of jog commands to keep in flight.
 
-# ----------------------
-# Init hardware
-# ----------------------
-ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.2)
-time.sleep(3)
-
-# Read GRBL feed rates
-MAX_VX, MAX_VY, MAX_VZ = read_grbl_settings(ser)
-print(f"Max Speeds from GRBL: X={MAX_VX} mm/s  Y={MAX_VY} mm/s  Z={MAX_VZ} mm/s")
-
-# Init pygame
-pygame.init()
-pygame.joystick.init()
-if pygame.joystick.get_count() == 0:
-    raise RuntimeError("No joystick found")
-joystick = pygame.joystick.Joystick(0)
-joystick.init()
+    GRBL plans every queued jog to end at rest, so it only reaches full speed when the queued distance covers the
+    stopping distance v^2 / 2a (GRBL's jogging guide: N - 1 >= v / (2 a dt)). One more covers the serial round trip.
+    Anything beyond that only adds stick latency, and the planner has room for at most PLANNER_BLOCKS - 1 jogs.
+    """
+    needed = max(rate / (2 * acceleration * interval) for rate, acceleration in zip(rates, accelerations))
+    return max(2, min(PLANNER_BLOCKS - 1, math.ceil(needed) + 2))
 
-print("Using joystick:", joystick.get_name())
 
-# Position state
-px = py = pz = 0.0
-laser_on = False
-laser_power = 0
-last_time = time.time()
-
-
-def send(cmd):
-    ser.write((cmd + "\n").encode("utf-8"))
-    resp = ser.readline().decode("utf-8", errors="ignore").strip()
-    print(">>", cmd, "<<", resp)
-    return resp
+# ----------------------
+# Jogging
+# ----------------------
+class JogController:
+    """
+    Streams $J= jogs from stick velocities without ever waiting on the port.
+
+    GRBL acknowledges a jog as soon as it is planned, so besides keeping at most ``queue_size`` lines (and never
+    more than GRBL's RX buffer) unacknowledged, the controller tracks how much jog motion it has handed over and
+    stops sending once queue_size * interval seconds are queued. That bounds how far the machine keeps going after
+    the stick moves. Releasing the stick sends a jog cancel, which stops the machine and throws away the queued
+    jogs.
+    """
+
+    def __init__(self, ser, queue_size):
+        self.ser = ser
+        self.queue_size = queue_size
+        self.in_flight = collections.deque()  # lengths of sent, unacknowledged lines
+        self.commands = collections.deque()  # non-jog lines waiting for the queue to drain
+        self.received = b""
+        self.jogging = False
+        self.queued_until = 0.0
+        self.state = "Idle"
+        self.position = None
+        self.last_status = 0.0
+
+    def can_send(self, line):
+        return (
+            len(self.in_flight) < self.queue_size
+            and sum(self.in_flight) + len(line) + 1 <= RX_BUFFER_SIZE
+        )
+
+    def send_line(self, line):
+        self.ser.write((line + "\n").encode())
+        self.in_flight.append(len(line) + 1)
+
+    def command(self, line):
+        """
+        Queues a normal G-code line. It is sent once every jog is acknowledged, since GRBL waits for a jog to
+        finish before running anything else.
+        """
+        self.commands.append(line)
+
+    def jog(self, velocity, now, interval=UPDATE_INTERVAL):
+        """
+        Sends one incremental jog covering ``interval`` seconds at ``velocity`` (mm/s per axis), if there is room.
+        """
+        speed = math.sqrt(sum(v * v for v in velocity))
+        if speed == 0:
+            self.release()
+            return
+
+        self.jogging = True
+        words = " ".join(f"{axis}{v * interval:.3f}" for axis, v in zip("XYZ", velocity) if v)
+        line = f"$J=G91 G21 {words} F{speed * 60:.0f}"
+        if self.queued_until - now < self.queue_size * interval and self.can_send(line):
+            self.send_line(line)
+            self.queued_until = max(self.queued_until, now) + interval
+
+    def release(self):
+        if self.jogging:
+            self.ser.write(JOG_CANCEL)
+            self.jogging = False
+            self.queued_until = 0.0
+
+    def poll(self, now):
+        """
+        Reads whatever has arrived, sends waiting commands and asks for a status report every STATUS_INTERVAL.
+        """
+        waiting = self.ser.in_waiting
+        if waiting:
+            self.received += self.ser.read(waiting)
+
+        while b"\n" in self.received:
+            raw, self.received = self.received.split(b"\n", 1)
+            self.handle(raw.decode("utf-8", errors="ignore").strip())
+
+        while self.commands and not self.jogging and not self.in_flight:
+            line = self.commands.popleft()
+            self.send_line(line)
+            print(">>", line)
+
+        if now - self.last_status >= STATUS_INTERVAL:
+            self.last_status = now
+            self.ser.write(STATUS_REPORT)
+
+    def handle(self, response):
+        if response == "ok" or response.startswith("error"):
+            if self.in_flight:
+                self.in_flight.popleft()
+            if response.startswith("error"):
+                print("<<", response)
+            return
+
+        match = MPOS_RE.match(response)
+        if match:
+            self.state = match.group(1)
+            self.position = tuple(float(value) for value in match.groups()[1:])
+            print(
+                f"\r{self.state:<5} X{self.position[0]:9.3f} Y{self.position[1]:9.3f} Z{self.position[2]:9.3f}",
+                end="",
+                flush=True,
+            )
+        elif response:
+            print("<<", response)
+
+
+def read_stick(joystick, rates):
+    x_axis = joystick.get_axis(0)
+    y_axis = -joystick.get_axis(1)  # INVERTED
+    z_axis = -joystick.get_axis(3)  # INVERTED
+
+    return tuple(
+        0.0 if abs(value) < DEADZONE else value * rate
+        for value, rate in zip((x_axis, y_axis, z_axis), rates)
+    )
 
 
 # ----------------------
 # Main loop
 # ----------------------
-try:
-    while True:
-        now = time.time()
-        if now - last_time >= UPDATE_INTERVAL:
-            last_time = now
-
-            pygame.event.pump()
-
-            # -------------------
-            # Read axis input
-            # -------------------
-            x_axis = joystick.get_axis(0)
-            y_axis = -joystick.get_axis(1)  # INVERTED
-            z_axis = -joystick.get_axis(3)  # INVERTED
-
-            # Deadzone
-            if abs(x_axis) < 0.1: x_axis = 0
-            if abs(y_axis) < 0.1: y_axis = 0
-            if abs(z_axis) < 0.1: z_axis = 0
-
-            dt = UPDATE_INTERVAL
-
-            # -------------------
-            # Apply GRBL speeds (mm/sec)
-            # -------------------
-            px += x_axis * MAX_VX * dt
-            py += y_axis * MAX_VY * dt
-            pz += z_axis * MAX_VZ * dt
-
-            send(f"G0 X{px:.3f} Y{py:.3f} Z{pz:.3f}")
-
-            # -------------------
-            # Laser on/off
-            # -------------------
-            button_a = joystick.get_button(1)
-            button_b = joystick.get_button(2)
-
-            if button_a and not laser_on:
-                laser_on = True
-                send("M3")
-
-            if button_b and laser_on:
-                laser_on = False
-                send("M5")
-
-            # -------------------
-            # Laser power (D-pad)
-            # -------------------
-            hat_x, hat_y = joystick.get_hat(0)
-            if hat_x == 1:
-                laser_power = min(1000, laser_power + 10)
-                send(f"S{laser_power}")
-            if hat_x == -1:
-                laser_power = max(0, laser_power - 10)
-                send(f"S{laser_power}")
-
-        time.sleep(0.01)
-
-except KeyboardInterrupt:
-    print("Exiting...")
-
-finally:
-    ser.close()
-    pygame.quit()
+def main():
+    parser = argparse.ArgumentParser(description="Jog a GRBL machine with a joystick")
+    parser.add_argument("--port", default=SERIAL_PORT)
+    parser.add_argument("--baud", type=int, default=BAUD_RATE)
+    args = parser.parse_args()
+
+    ser = serial.Serial(args.port, args.baud, timeout=0.2)
+    time.sleep(3)
+
+    # Read GRBL feed rates and accelerations
+    rates, accelerations = read_grbl_settings(ser)
+    print(f"Max Speeds from GRBL: X={rates[0]} mm/s  Y={rates[1]} mm/s  Z={rates[2]} mm/s")
+    ser.timeout = 0
+
+    queue_size = jog_queue_size(rates, accelerations)
+    print(f"Keeping {queue_size} jog commands in flight")
+
+    # Init pygame
+    pygame.init()
+    pygame.joystick.init()
+    if pygame.joystick.get_count() == 0:
+        raise RuntimeError("No joystick found")
+    joystick = pygame.joystick.Joystick(0)
+    joystick.init()
+
+    print("Using joystick:", joystick.get_name())
+
+    controller = JogController(ser, queue_size)
+    laser_on = False
+    laser_power = 0
+    last_time = time.time()
+
+    try:
+        while True:
+            now = time.time()
+            controller.poll(now)
+
+            if now - last_time >= UPDATE_INTERVAL:
+                last_time = now
+
+                pygame.event.pump()
+                controller.jog(read_stick(joystick, rates), now)
+
+                # -------------------
+                # Laser on/off
+                # -------------------
+                button_a = joystick.get_button(1)
+                button_b = joystick.get_button(2)
+
+                if button_a and not laser_on:
+                    laser_on = True
+                    controller.command("M3")
+
+                if button_b and laser_on:
+                    laser_on = False
+                    controller.command("M5")
+
+                # -------------------
+                # Laser power (D-pad)
+                # -------------------
+                hat_x, hat_y = joystick.get_hat(0)
+                if hat_x == 1:
+                    laser_power = min(1000, laser_power + 10)
+                    controller.command(f"S{laser_power}")
+                if hat_x == -1:
+                    laser_power = max(0, laser_power - 10)
+                    controller.command(f"S{laser_power}")
+
+            time.sleep(0.005)
+
+    except KeyboardInterrupt:
+        print("\nExiting...")
+
+    finally:
+        controller.release()
+        ser.close()
+        pygame.quit()
+
+
+if __name__ == "__main__":
+    main()